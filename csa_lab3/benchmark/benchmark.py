@@ -0,0 +1,229 @@
+import argparse
+import json
+import logging
+import platform
+import sys
+import tempfile
+import time
+import tracemalloc
+from collections.abc import Callable, Iterable
+from pathlib import Path
+from typing import NamedTuple
+
+from machine import machine
+from machine.isa import load_binary, machine2binary
+from translator import translator
+
+DEFAULT_THRESHOLD = 0.2  # relative change of a metric that is reported as a regression
+STRING = 'abcdefghijklmnopqrstuvwxyzABCDEFGHIJKLMNOPQRSTUVWXYZ0123456789!'  # the longest string of the language
+
+
+class Workload(NamedTuple):
+    code: str
+    input: str
+    expected_output: str
+
+
+def arithmetic(scale: float) -> Workload:
+    # tight loop of arithmetic on the variables
+    count = _count(3000, scale)
+    code = f'n = 0\nsum = 0\nwhile n < {count}:\n  sum = (sum + n * 3) % 1000\n  n = n + 1\n;\n> sum'
+    return Workload(code, '', str(sum(n * 3 for n in range(count)) % 1000))
+
+
+def string_copy(scale: float) -> Workload:
+    # assignments of a string variable, which copy the string symbol by symbol
+    count = _count(120, scale)
+    code = f"s = '{STRING}'\nt = ' '\nn = 0\nwhile n < {count}:\n  t = s\n  n = n + 1\n;\n> t"
+    return Workload(code, '', STRING)
+
+
+def cat(scale: float) -> Workload:
+    # input copied to the output
+    text = (STRING + ' ') * _count(80, scale)
+    return Workload("s = ' '\nwhile s:\n  /in s\n  > s\n;", text, text)
+
+
+def nested(scale: float, depth: int = 6) -> Workload:
+    # nested loops with a condition on every level
+    counts = [_count(4, scale)] + [3] * (depth - 1)
+    head, tail = ['x = 0'], ['> x']
+    for level, count in enumerate(counts):
+        indent = '  ' * level
+        head += [f'{indent}i{level} = 0', f'{indent}while i{level} < {count}:', f'{indent}  if i{level} % 2 == 0:']
+        head += [f'{indent}    x = x + 1', f'{indent}  ;']
+        tail = [f'{indent}  i{level} = i{level} + 1', f'{indent};', *tail]
+    expected, iterations = 0, 1
+    for count in counts:
+        expected += iterations * ((count + 1) // 2)
+        iterations *= count
+    return Workload('\n'.join(head + tail), '', str(expected))
+
+
+def large_source(scale: float, variables: int = 20) -> str:
+    # many short statements over a few variables
+    lines = [f'x{i} = {i}' for i in range(variables)]
+    for i in range(_count(500, scale)):
+        x, y, z = (f'x{(i + offset) % variables}' for offset in range(3))
+        lines += [f'{x} = {y} * 3 + {i} - ({z} % 7)', f'if {x} > {i}:', f'  > {x}', ';']
+    return '\n'.join(lines)
+
+
+WORKLOADS: dict[str, Callable[[float], Workload]] = {
+    'arithmetic': arithmetic,
+    'string_copy': string_copy,
+    'cat': cat,
+    'nested': nested,
+}
+
+
+def _count(base: int, scale: float) -> int:
+    return max(1, round(base * scale))
+
+
+def measure(func: Callable[[], object], repeat: int) -> tuple[float, int, object]:
+    # the best time of `repeat` calls, the peak of the memory allocated by one more call and its result
+    seconds = float('inf')
+    for _ in range(repeat):
+        start = time.perf_counter()
+        func()
+        seconds = min(seconds, time.perf_counter() - start)
+    tracemalloc.start()
+    try:
+        result = func()
+        _, peak_memory = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+    return max(seconds, 1e-9), peak_memory, result
+
+
+def bench_simulation(workload: Workload, engine: str, repeat: int) -> dict:
+    instructions, memory = translator.code2machine(workload.code)
+    seconds, peak_memory, (output, instr, ticks) = measure(
+        lambda: machine.simulation(instructions, memory, workload.input, instr_limit=sys.maxsize, engine=engine), repeat
+    )
+    assert output == workload.expected_output, f'The output of the workload is wrong: {output!r}'
+    return {
+        'seconds': seconds,
+        'instr': instr,
+        'ticks': ticks,
+        'instr_per_second': instr / seconds,
+        'ticks_per_second': ticks / seconds,
+        'peak_memory': peak_memory,
+    }
+
+
+def bench_translation(code: str, opt_level: int, repeat: int) -> dict:
+    lines = code.count('\n') + 1
+    seconds, peak_memory, _ = measure(lambda: translator.build(code, opt_level), repeat)
+    return {'seconds': seconds, 'lines': lines, 'lines_per_second': lines / seconds, 'peak_memory': peak_memory}
+
+
+def bench_binary(code: str, repeat: int) -> dict[str, dict]:
+    # encoding of the program with the writing of the binary file, and the loading of it
+    instructions, memory = translator.code2machine(code)
+    with tempfile.TemporaryDirectory() as tmpdir:
+        binary_file = Path(tmpdir) / 'program.bin'
+        store_seconds, store_memory, size = measure(lambda: binary_file.write_bytes(machine2binary(instructions, memory)), repeat)
+        load_seconds, load_memory, _ = measure(lambda: load_binary(str(binary_file)), repeat)
+    results = {}
+    for name, seconds, peak_memory in (('store', store_seconds, store_memory), ('load', load_seconds, load_memory)):
+        results[f'binary_{name}'] = {
+            'seconds': seconds,
+            'instructions': len(instructions),
+            'instructions_per_second': len(instructions) / seconds,
+            'bytes_per_second': size / seconds,
+            'peak_memory': peak_memory,
+        }
+    return results
+
+
+def run_suite(scale: float = 1, repeat: int = 3, engines: Iterable[str] = tuple(machine.ENGINES),
+              workloads: Iterable[str] = tuple(WORKLOADS)) -> dict:  # fmt: skip
+    benchmarks = {}
+    for name in workloads:
+        workload = WORKLOADS[name](scale)
+        for engine in engines:
+            benchmarks[f'{name}/{engine}'] = bench_simulation(workload, engine, repeat)
+    # the optimizer takes most of the time of the optimized translation, so its source is smaller
+    benchmarks['translate/O0'] = bench_translation(large_source(scale), 0, repeat)
+    benchmarks['translate/O2'] = bench_translation(large_source(scale / 5), 2, repeat)
+    benchmarks.update(bench_binary(large_source(scale * 10), repeat))
+    meta = {
+        'python': platform.python_version(),
+        'implementation': platform.python_implementation(),
+        'machine': platform.machine(),
+        'scale': scale,
+        'repeat': repeat,
+    }
+    return {'meta': meta, 'benchmarks': benchmarks}
+
+
+def compare(results: dict, baseline: dict, threshold: float = DEFAULT_THRESHOLD) -> list[tuple[str, str, float, float, bool]]:
+    # (benchmark, metric, baseline value, value, is regression) for the throughputs and the peak memory,
+    # a throughput is expected not to fall and the memory not to grow by more than the threshold
+    rows = []
+    for name, metrics in results['benchmarks'].items():
+        base_metrics = baseline['benchmarks'].get(name, {})
+        for metric, value in metrics.items():
+            base = base_metrics.get(metric)
+            if base is None or not (metric.endswith('_per_second') or metric == 'peak_memory'):
+                continue
+            is_memory = metric == 'peak_memory'
+            rows.append((
+                name,
+                metric,
+                base,
+                value,
+                value > base * (1 + threshold) if is_memory else value < base * (1 - threshold),
+            ))
+    return rows
+
+
+def format_results(results: dict) -> str:
+    lines = [f'{"benchmark":<24}{"seconds":>10}{"instr/s":>14}{"ticks/s":>14}{"lines/s":>14}{"peak memory":>14}']
+    for name, metrics in results['benchmarks'].items():
+        rates = (metrics.get(key) for key in ('instr_per_second', 'ticks_per_second', 'lines_per_second'))
+        if name.startswith('binary_'):
+            rates = (metrics['instructions_per_second'], None, None)
+        rates = ''.join(f'{rate:>14,.0f}' if rate is not None else f'{"-":>14}' for rate in rates)
+        lines.append(f'{name:<24}{metrics["seconds"]:>10.4f}{rates}{metrics["peak_memory"]:>14,}')
+    return '\n'.join(lines)
+
+
+def format_comparison(rows: list[tuple[str, str, float, float, bool]]) -> str:
+    lines = [f'{"benchmark":<24}{"metric":<24}{"baseline":>16}{"current":>16}{"change":>9}']
+    for name, metric, base, value, is_regression in rows:
+        change = f'{value / base - 1:+.1%}' if base else '-'
+        flag = '  REGRESSION' if is_regression else ''
+        lines.append(f'{name:<24}{metric:<24}{base:>16,.0f}{value:>16,.0f}{change:>9}{flag}')
+    return '\n'.join(lines)
+
+
+def main(argv: list[str]) -> int:
+    parser = argparse.ArgumentParser(prog='benchmark.py', description='Throughput benchmarks of the translator and the machine')
+    parser.add_argument('--scale', type=float, default=1, help='size of the workloads, 1 is ~100k instructions')
+    parser.add_argument('--repeat', type=int, default=3, help='runs of every benchmark, the best time is taken')
+    parser.add_argument('--engine', dest='engines', action='append', choices=machine.ENGINES, help='engines (all by default)')
+    parser.add_argument('--workload', dest='workloads', action='append', choices=WORKLOADS, help='workloads (all by default)')
+    parser.add_argument('-o', '--output', help='file to save the results to (JSON)')
+    parser.add_argument('--compare', help='results of the baseline to compare with (JSON)')
+    parser.add_argument('--threshold', type=float, default=DEFAULT_THRESHOLD, help='relative change reported as a regression')
+    args = parser.parse_args(argv)
+    baseline = json.loads(Path(args.compare).read_text(encoding='utf-8')) if args.compare is not None else None
+
+    results = run_suite(args.scale, args.repeat, args.engines or machine.ENGINES, args.workloads or WORKLOADS)
+    print(format_results(results))
+    if args.output is not None:
+        Path(args.output).write_text(json.dumps(results, indent=1), encoding='utf-8')
+    if baseline is None:
+        return 0
+    rows = compare(results, baseline, args.threshold)
+    print()
+    print(format_comparison(rows))
+    return int(any(is_regression for *_, is_regression in rows))
+
+
+if __name__ == '__main__':
+    logging.basicConfig(level=logging.ERROR)  # the warnings of the simulations are expected
+    sys.exit(main(sys.argv[1:]))
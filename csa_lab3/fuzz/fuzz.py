@@ -0,0 +1,304 @@
+import argparse
+import contextlib
+import json
+import logging
+import multiprocessing
+import random
+import sys
+from collections.abc import Callable, Iterator
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from typing import NamedTuple
+
+from machine import machine
+from machine.ports import BufferOutputPort
+from translator import translator
+
+OPT_LEVELS = (0, 1, 2)
+DEFAULT_INSTR_LIMIT = 20000
+MACHINE_ERRORS = (AssertionError, ArithmeticError, IndexError, ValueError)  # errors stopping a program
+SYMBOLS = 'abcxyzABC019 ,.!?-мяу'  # symbols of the generated string literals and input
+
+
+class Case(NamedTuple):
+    code: str
+    input: str
+
+
+class Result(NamedTuple):
+    output: str  # output written before the machine stopped
+    instr: int | None  # None if the machine stopped with an error
+    ticks: int | None
+    error: str | None  # repr of the error
+
+    def limited(self, instr_limit: int) -> bool:
+        return self.instr is not None and self.instr >= instr_limit
+
+
+class Mismatch(NamedTuple):
+    kind: str  # `O<level>/<engine>` for engines disagreeing with ControlUnit, `O<level>` for optimization levels
+    expected: Result
+    actual: Result
+
+
+class ProgramGenerator:
+    """Random valid programs: assignments, expressions over the variables in scope, string copies, input and output
+    of strings and numbers, nested `if` and `while` blocks. Every loop has a counter bounding its iterations,
+    declared before it and never assigned in the body, so the programs terminate (or stop with an error).
+    """
+
+    def __init__(self, rng: random.Random, max_depth: int = 2, max_statements: int = 5):
+        self.rng = rng
+        self.max_depth = max_depth
+        self.max_statements = max_statements
+        self.names = 0
+        self.scopes: list[dict[str, type]] = [{}]  # name: type of the variables declared in every open block
+        self.counters: set[str] = set()  # loop counters, which are not assigned
+
+    def _declare(self, var_type: type) -> str:
+        name = f'{"s" if var_type is str else "v"}{self.names}'
+        self.names += 1
+        self.scopes[-1][name] = var_type
+        return name
+
+    def _variables(self, var_type: type | None = None, assignable: bool = False) -> list[str]:
+        return [
+            name
+            for scope in self.scopes
+            for name, name_type in scope.items()
+            if var_type in (None, name_type) and not (assignable and name in self.counters)
+        ]
+
+    def _literal(self) -> str:
+        length = self.rng.choice([0, 1, 2, 5, 12, self.rng.randint(0, translator.Translator.STR_MAX_LENGTH)])
+        return "'" + ''.join(self.rng.choice(SYMBOLS) for _ in range(length)) + "'"
+
+    def program(self) -> str:
+        return '\n'.join(self._block(0))
+
+    def _block(self, depth: int) -> list[str]:
+        lines = []
+        for _ in range(self.rng.randint(1, self.max_statements)):
+            lines += ['  ' * depth + line for line in self._statement(depth)]
+        return lines
+
+    def _statement(self, depth: int) -> list[str]:
+        kind = self.rng.choices(
+            ['int', 'str', 'output', 'output_str', 'input', 'if', 'while'],
+            [5, 2, 3, 2, 1, 2 if depth < self.max_depth else 0, 2 if depth < self.max_depth else 0],
+        )[0]
+        ints, strs = self._variables(int, assignable=True), self._variables(str)
+        if kind == 'int':
+            value = self.expression(3)
+            if value in strs or value.startswith("'"):  # a string would be copied over the cells after the variable
+                value = f'+{value}'
+            name = self.rng.choice(ints) if ints and self.rng.random() < 0.6 else self._declare(int)
+            return [f'{name} = {value}']
+        if kind == 'str' or (kind in ('output_str', 'input') and not strs):
+            value = self.rng.choice(strs) if strs and self.rng.random() < 0.4 else self._literal()
+            name = self.rng.choice(strs) if strs and self.rng.random() < 0.5 else self._declare(str)
+            return [f'{name} = {value}']
+        if kind == 'output':
+            return [f'> {self.expression(3)}']
+        if kind == 'output_str':
+            return [f'> {self.rng.choice([*strs, self._literal()])}']
+        if kind == 'input':
+            return [f'/in {self.rng.choice(strs)}']
+        if kind == 'if':
+            condition = self.expression(2)
+            return [f'if {condition}:', *self._body(depth), ';']
+
+        counter = self._declare(int)
+        condition = f'{counter} < {self.rng.randint(1, 4)}'
+        if self.rng.random() < 0.5:
+            condition += f' {self.rng.choice(["&&", "||"])} {self.expression(1)}'
+        self.counters.add(counter)
+        body = self._body(depth)
+        return [f'{counter} = 0', f'while {condition}:', *body, f'  {counter} = {counter} + 1', ';']
+
+    def _body(self, depth: int) -> list[str]:
+        self.scopes.append({})
+        body = ['  ' + line for line in self._block(depth)]
+        self.scopes.pop()
+        return body
+
+    def expression(self, depth: int) -> str:
+        variables = self._variables()
+        if depth == 0 or self.rng.random() < 0.3:
+            choice = self.rng.random()
+            if variables and choice < 0.5:
+                return self.rng.choice(variables)
+            if choice < 0.9:
+                return str(self.rng.randint(0, 9))
+            if choice < 0.95:
+                return str(self.rng.randint(0, 2**31 - 1))
+            return self._literal()
+        if self.rng.random() < 0.15:
+            return f'{self.rng.choice("-+!")}{self._operand(depth - 1)}'
+        op = self.rng.choices(
+            ['+', '-', '*', '/', '%', '==', '!=', '<', '<=', '>', '>=', '&&', '||'],
+            [4, 4, 3, 1, 1, 1, 1, 1, 1, 1, 1, 1, 1],
+        )[0]
+        return f'{self._operand(depth - 1)} {op} {self._operand(depth - 1)}'
+
+    def _operand(self, depth: int) -> str:
+        expression = self.expression(depth)
+        return f'({expression})' if ' ' in expression else expression
+
+    def input(self) -> str:
+        lines = []
+        for _ in range(self.rng.randint(0, 4)):
+            length = self.rng.choice([0, 1, 3, 10, self.rng.randint(0, 80)])
+            lines.append(''.join(self.rng.choice(SYMBOLS) for _ in range(length)))
+        return '\n'.join(lines)
+
+
+def generate(seed: int) -> Case:
+    generator = ProgramGenerator(random.Random(seed))
+    return Case(generator.program(), generator.input())
+
+
+def execute(case: Case, opt_level: int, engine: str, instr_limit: int) -> Result:
+    # the data memory fits the program, the levels use different numbers of cells for the same program
+    translator_ = translator.Translator(opt_level)
+    try:
+        translator_.translate(case.code)
+    except AssertionError as e:
+        return Result('', None, None, f'translation: {e!r}')
+    instructions, memory = translator_.instructions, translator_.string_literal_mem
+    output_port = BufferOutputPort()
+    try:
+        output, instr, ticks = machine.simulation(
+            instructions, memory, case.input, memory_capacity=translator_.data_memory_size + 1, instr_limit=instr_limit,
+            engine=engine, output_port=output_port,
+        )  # fmt: skip
+    except MACHINE_ERRORS as e:
+        return Result(output_port.getvalue(), None, None, repr(e))
+    return Result(output, instr, ticks, None)
+
+
+def check(case: Case, instr_limit: int = DEFAULT_INSTR_LIMIT) -> list[Mismatch]:
+    # every engine agrees with ControlUnit at every optimization level on the output, the counters and the error,
+    # the optimization levels agree on the output and the error, if the program ends before the limit,
+    # a case that is not a valid program is skipped, the optimizer could hide the error
+    mismatches = []
+    reference = None
+    try:
+        translator.code2machine(case.code)
+    except AssertionError:
+        return mismatches
+    for opt_level in OPT_LEVELS:
+        expected = execute(case, opt_level, 'signal', instr_limit)
+        actuals = {engine: execute(case, opt_level, engine, instr_limit) for engine in machine.ENGINES if engine != 'signal'}
+        mismatches += [
+            Mismatch(f'O{opt_level}/{engine}', expected, actual) for engine, actual in actuals.items() if actual != expected
+        ]
+        reference = expected if reference is None else reference
+        comparable = not (reference.limited(instr_limit) or expected.limited(instr_limit))
+        if comparable and (reference.output, reference.error) != (expected.output, expected.error):
+            mismatches.append(Mismatch(f'O{opt_level}', reference, expected))
+    return mismatches
+
+
+def minimize(case: Case, is_failing: Callable[[Case], bool]) -> Case:
+    """Smallest program and input found that still fail: statements with their blocks are removed, blocks are
+    replaced by their bodies, input lines are removed and shortened, while the case keeps failing."""
+    for reductions in (_code_reductions, _input_reductions):
+        reduced = True
+        while reduced:
+            reduced = False
+            for candidate in reductions(case):
+                if is_failing(candidate):
+                    case, reduced = candidate, True
+                    break
+    return case
+
+
+def _code_reductions(case: Case) -> Iterator[Case]:
+    lines = case.code.split('\n')
+    for start, line in enumerate(lines):
+        if line.strip() == ';':
+            continue
+        end = _statement_end(lines, start)
+        yield case._replace(code='\n'.join(lines[:start] + lines[end:]))
+        if end - start > 1:  # the body of the block without the header and the end
+            yield case._replace(code='\n'.join(lines[:start] + [line[2:] for line in lines[start + 1 : end - 1]] + lines[end:]))
+
+
+def _statement_end(lines: list[str], start: int) -> int:
+    # the line after the statement, the end of the block for `if` and `while`
+    if not lines[start].endswith(':'):
+        return start + 1
+    end = lines[start][: len(lines[start]) - len(lines[start].lstrip())] + ';'
+    return next((addr + 1 for addr in range(start + 1, len(lines)) if lines[addr] == end), len(lines))
+
+
+def _input_reductions(case: Case) -> Iterator[Case]:
+    lines = case.input.split('\n') if case.input else []
+    for number, line in enumerate(lines):
+        yield case._replace(input='\n'.join(lines[:number] + lines[number + 1 :]))
+        if len(line) > 1:
+            yield case._replace(input='\n'.join([*lines[:number], line[: len(line) // 2], *lines[number + 1 :]]))
+
+
+def fuzz_case(seed: int, instr_limit: int = DEFAULT_INSTR_LIMIT, reduce: bool = True) -> dict | None:
+    # the report of the case generated by the seed, None if everything agrees
+    case = generate(seed)
+    mismatches = check(case, instr_limit)
+    if not mismatches:
+        return None
+    kind = mismatches[0].kind
+    if reduce:
+        case = minimize(case, lambda case: any(mismatch.kind == kind for mismatch in check(case, instr_limit)))
+        mismatches = [mismatch for mismatch in check(case, instr_limit) if mismatch.kind == kind]
+    return {
+        'seed': seed,
+        'kind': kind,
+        'code': case.code,
+        'input': case.input,
+        'expected': mismatches[0].expected._asdict(),
+        'actual': mismatches[0].actual._asdict(),
+    }
+
+
+def _fuzz_chunk(seeds: range, instr_limit: int, reduce: bool) -> list[dict]:
+    logging.disable(logging.WARNING)  # the warnings of the simulations are expected
+    return [report for seed in seeds if (report := fuzz_case(seed, instr_limit, reduce)) is not None]
+
+
+def run_fuzz(cases: int, seed: int = 0, workers: int | None = None, chunksize: int = 50,
+             instr_limit: int = DEFAULT_INSTR_LIMIT, reduce: bool = True) -> Iterator[dict]:  # fmt: skip
+    # reports of the failing cases of the seeds [seed, seed + cases), checked by a process pool
+    methods = multiprocessing.get_all_start_methods()
+    context = multiprocessing.get_context('fork' if 'fork' in methods else None)
+    with ProcessPoolExecutor(workers, context) as executor:
+        futures = [
+            executor.submit(_fuzz_chunk, range(start, min(start + chunksize, seed + cases)), instr_limit, reduce)
+            for start in range(seed, seed + cases, chunksize)
+        ]
+        for future in as_completed(futures):
+            yield from future.result()
+
+
+def main(argv: list[str]) -> int:
+    parser = argparse.ArgumentParser(prog='fuzz.py', description='Differential fuzzing of the engines and the optimizer')
+    parser.add_argument('--cases', type=int, default=1000, help='number of the generated programs')
+    parser.add_argument('--seed', type=int, default=0, help='seed of the first program, the next ones take the next seeds')
+    parser.add_argument('-j', '--workers', type=int, default=None, help='number of worker processes')
+    parser.add_argument('--chunksize', type=int, default=50, help='programs sent to a worker at once')
+    parser.add_argument('--instr-limit', type=int, default=DEFAULT_INSTR_LIMIT)
+    parser.add_argument('--no-minimize', dest='reduce', action='store_false', help='report the failing cases as generated')
+    parser.add_argument('-o', '--output', help='file to write the reports to (JSON lines)')
+    args = parser.parse_args(argv)
+
+    failures = 0
+    with open(args.output, 'w', encoding='utf-8') if args.output is not None else contextlib.nullcontext(sys.stdout) as f:
+        for report in run_fuzz(args.cases, args.seed, args.workers, args.chunksize, args.instr_limit, args.reduce):
+            failures += 1
+            f.write(json.dumps(report, ensure_ascii=False) + '\n')
+            f.flush()
+    print(f'cases: {args.cases}, failures: {failures}', file=sys.stderr)
+    return int(failures > 0)
+
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv[1:]))
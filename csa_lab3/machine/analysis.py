@@ -0,0 +1,236 @@
+import argparse
+import json
+from collections.abc import Sequence
+from typing import NamedTuple
+
+from .isa import (
+    JUMP_INSTRUCTIONS,
+    Instruction,
+    Opcode,
+    SourceMap,
+    basic_block_leaders,
+    instruction_ticks,
+    load_binary,
+    load_source_map,
+)
+
+
+class BasicBlock(NamedTuple):
+    start: int
+    end: int  # address after the last instruction
+    ticks: int  # ticks of one execution of the block, by the rules of ControlUnit
+    successors: list[int]  # starts of the blocks the control passes to, in range
+
+
+class Loop(NamedTuple):
+    header: int  # start of the block dominating the loop
+    blocks: list[int]  # starts of the blocks of the loop, the header first
+    latches: list[int]  # starts of the blocks jumping back to the header
+    ticks: int  # ticks of one execution of every block of the loop, an estimate of an iteration
+    depth: int  # 1 for the outermost loops
+
+
+class ControlFlowGraph:
+    """Basic blocks of the program, the edges between them, their dominators and the natural loops.
+
+    A block ends at a jump, HLT, or before a jump target, the control passes from it to the jump targets and to
+    the next block unless the block ends with JMP or HLT. The blocks not reachable from the entry at 0 are reported,
+    as well as the jumps out of the program and the blocks falling through its end. The tick cost of a block is
+    the sum of `instruction_ticks`, the ticks ControlUnit spends on its instructions.
+    """
+
+    def __init__(self, instructions: Sequence[Instruction]):
+        self.instructions = instructions
+        size = len(instructions)
+        leaders = sorted(basic_block_leaders(instructions))
+        self.out_of_range: list[tuple[int, int]] = []  # (address, target) of the jumps and fall-throughs out of the code
+        self.blocks: dict[int, BasicBlock] = {}
+        for start, end in zip(leaders, leaders[1:]):
+            last = instructions[end - 1]
+            targets = []
+            if last.opcode in JUMP_INSTRUCTIONS:
+                targets.append(last.argument)
+            if last.opcode is not Opcode.HLT and last.opcode is not Opcode.JMP:
+                targets.append(end)
+            self.out_of_range += [(end - 1, target) for target in targets if not 0 <= target < size]
+            successors = list(dict.fromkeys(target for target in targets if 0 <= target < size))
+            ticks = sum(instruction_ticks(instr) for instr in instructions[start:end])
+            self.blocks[start] = BasicBlock(start, end, ticks, successors)
+
+        self.predecessors: dict[int, list[int]] = {start: [] for start in self.blocks}
+        for block in self.blocks.values():
+            for successor in block.successors:
+                self.predecessors[successor].append(block.start)
+        self.order = self._reverse_postorder()  # the blocks reachable from the entry
+        self.unreachable = [start for start in self.blocks if start not in self.order]
+        self.idom = self._dominators()  # immediate dominator of every reachable block, the entry is its own
+        self.loops = self._natural_loops()
+
+    def _reverse_postorder(self) -> list[int]:
+        if not self.blocks:
+            return []
+        order, visited, stack = [], {0}, [(0, iter(self.blocks[0].successors))]
+        while stack:
+            start, successors = stack[-1]
+            successor = next((successor for successor in successors if successor not in visited), None)
+            if successor is None:
+                order.append(start)
+                stack.pop()
+            else:
+                visited.add(successor)
+                stack.append((successor, iter(self.blocks[successor].successors)))
+        return order[::-1]
+
+    def _dominators(self) -> dict[int, int]:
+        # the iterative algorithm of Cooper, Harvey and Kennedy over the reverse postorder
+        index = {start: i for i, start in enumerate(self.order)}
+        idom = dict.fromkeys(self.order[:1], self.order[0]) if self.order else {}
+
+        def intersect(a: int, b: int) -> int:
+            while a != b:
+                while index[a] > index[b]:
+                    a = idom[a]
+                while index[b] > index[a]:
+                    b = idom[b]
+            return a
+
+        changed = True
+        while changed:
+            changed = False
+            for start in self.order[1:]:
+                processed = [pred for pred in self.predecessors[start] if pred in idom]
+                new_idom = processed[0]
+                for pred in processed[1:]:
+                    new_idom = intersect(pred, new_idom)
+                if idom.get(start) != new_idom:
+                    idom[start], changed = new_idom, True
+        return idom
+
+    def dominates(self, a: int, b: int) -> bool:
+        # whether every path from the entry to the block `b` passes the block `a`
+        if b not in self.idom:
+            return False
+        while b != a and self.idom[b] != b:
+            b = self.idom[b]
+        return b == a
+
+    def _natural_loops(self) -> list[Loop]:
+        # the blocks reaching the latches without passing the header, loops with the same header are merged
+        bodies: dict[int, tuple[set[int], list[int]]] = {}
+        for start in self.order:
+            for successor in self.blocks[start].successors:
+                if self.dominates(successor, start):
+                    body, latches = bodies.setdefault(successor, ({successor}, []))
+                    latches.append(start)
+                    stack = [start]
+                    while stack:
+                        block = stack.pop()
+                        if block not in body:
+                            body.add(block)
+                            stack += self.predecessors[block]
+        loops = []
+        for header, (body, latches) in sorted(bodies.items()):
+            depth = sum(1 for other_body, _ in bodies.values() if body <= other_body)
+            blocks = [header, *sorted(body - {header})]
+            loops.append(Loop(header, blocks, sorted(latches), sum(self.blocks[block].ticks for block in body), depth))
+        return loops
+
+    def loop_depth(self, start: int) -> int:
+        # number of the loops containing the block
+        return sum(1 for loop in self.loops if start in loop.blocks)
+
+    def to_json(self, source_map: SourceMap | None = None) -> dict:
+        lines = source_map.lines if source_map is not None else None
+        return {
+            'blocks': [
+                {
+                    'start': block.start,
+                    'end': block.end,
+                    'ticks': block.ticks,
+                    'successors': block.successors,
+                    'idom': self.idom.get(block.start),
+                    'loop_depth': self.loop_depth(block.start),
+                    'reachable': block.start in self.idom,
+                    **({'lines': sorted(set(lines[block.start : block.end]) - {0})} if lines is not None else {}),
+                    'instructions': [repr(instr) for instr in self.instructions[block.start : block.end]],
+                }
+                for block in self.blocks.values()
+            ],
+            'loops': [loop._asdict() for loop in self.loops],
+            'unreachable': self.unreachable,
+            'out_of_range': [{'addr': addr, 'target': target} for addr, target in self.out_of_range],
+        }
+
+    def to_dot(self, source_map: SourceMap | None = None) -> str:
+        # the blocks with their instructions, the loop headers are bold, the back edges and jumps out of the code red,
+        # the unreachable blocks gray
+        back_edges = {(latch, loop.header) for loop in self.loops for latch in loop.latches}
+        headers = {loop.header for loop in self.loops}
+        result = ['digraph cfg {', '  node [shape=box, fontname="monospace"];']
+        for block in self.blocks.values():
+            label = f'{block.start}-{block.end - 1}: {block.ticks} ticks\\l'
+            for addr in range(block.start, block.end):
+                line = f' ({source_map.lines[addr]})' if source_map is not None and source_map.lines[addr] else ''
+                label += f'{addr}: {self.instructions[addr]}{line}\\l'
+            style = ', style=bold' if block.start in headers else ''
+            style += ', color=gray, fontcolor=gray' if block.start in self.unreachable else ''
+            result.append(f'  b{block.start} [label="{label}"{style}];')
+            for successor in block.successors:
+                edge_style = ' [color=red]' if (block.start, successor) in back_edges else ''
+                result.append(f'  b{block.start} -> b{successor}{edge_style};')
+        for addr, target in self.out_of_range:
+            result.append(f'  out{target} [label="{target}: out of range", shape=octagon, color=red];')
+            result.append(f'  b{self._block_of(addr)} -> out{target} [color=red];')
+        result.append('}')
+        return '\n'.join(dict.fromkeys(result)) + '\n'
+
+    def _block_of(self, addr: int) -> int:
+        return next(block.start for block in self.blocks.values() if block.start <= addr < block.end)
+
+    def report(self, source_map: SourceMap | None = None) -> str:
+        # tables of the blocks in the order of addresses and of the loops by their cost, and the problems found
+        result = ['basic blocks:', f'{"block":>12}{"ticks":>8}{"instr":>8}{"depth":>7}  successors']
+        for block in self.blocks.values():
+            name = f'{block.start}-{block.end - 1}'
+            successors = ', '.join(map(str, block.successors)) or '-'
+            note = '  (unreachable)' if block.start in self.unreachable else ''
+            depth = self.loop_depth(block.start)
+            result.append(f'{name:>12}{block.ticks:>8}{block.end - block.start:>8}{depth:>7}  {successors}{note}')
+
+        result += ['', 'loops:', f'{"header":>8}{"ticks":>8}{"depth":>7}{"blocks":>8}  source']
+        for loop in sorted(self.loops, key=lambda loop: -loop.ticks):
+            line = source_map.lines[loop.header] if source_map is not None else 0
+            source = f'{line}: {source_map.source[line - 1].strip()}' if line else ''
+            result.append(f'{loop.header:>8}{loop.ticks:>8}{loop.depth:>7}{len(loop.blocks):>8}  {source}')
+
+        if self.unreachable:
+            result += ['', f'unreachable blocks: {", ".join(map(str, self.unreachable))}']
+        for addr, target in self.out_of_range:
+            result += [f'out of range: {addr}: {self.instructions[addr]} -> {target}']
+        return '\n'.join(result)
+
+    def dump(self, json_file: str, source_map: SourceMap | None = None):
+        with open(json_file, 'w', encoding='utf-8') as file:
+            json.dump(self.to_json(source_map), file, ensure_ascii=False, indent=1)
+
+
+def main(binary_file: str, source_map_file: str | None = None, dot_file: str | None = None, json_file: str | None = None):
+    instructions, _ = load_binary(binary_file)
+    source_map = load_source_map(source_map_file) if source_map_file is not None else None
+    cfg = ControlFlowGraph(instructions)
+    print(cfg.report(source_map))
+    if dot_file is not None:
+        with open(dot_file, 'w', encoding='utf-8') as file:
+            file.write(cfg.to_dot(source_map))
+    if json_file is not None:
+        cfg.dump(json_file, source_map)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(prog='analysis.py', description='Control flow graph, loops and tick costs of the program')
+    parser.add_argument('binary_file', help='file with the machine code')
+    parser.add_argument('--source-map', help='source map written by the translator, to show the source lines')
+    parser.add_argument('--dot', help='write the graph to the file in the DOT format')
+    parser.add_argument('--json', help='write the graph to the file as JSON')
+    args = parser.parse_args()
+    main(args.binary_file, args.source_map, args.dot, args.json)
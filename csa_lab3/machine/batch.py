@@ -0,0 +1,108 @@
+import argparse
+import contextlib
+import json
+import logging
+import multiprocessing
+import sys
+from collections.abc import Iterable, Iterator
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from typing import NamedTuple
+
+from .isa import load_binary
+from .machine import ENGINES, simulation
+
+
+class Job(NamedTuple):
+    binary_file: str
+    input_file: str
+
+
+class SimulationOptions(NamedTuple):
+    engine: str = 'fast'
+    memory_capacity: int = 1000
+    instr_limit: int = 60000
+
+
+DEFAULT_OPTIONS = SimulationOptions()
+
+
+class _WarningCollector(logging.Handler):
+    def __init__(self):
+        super().__init__(logging.WARNING)
+        self.messages = []
+
+    def emit(self, record):
+        self.messages.append(record.getMessage())
+
+
+@contextlib.contextmanager
+def capture_warnings() -> Iterator[list[str]]:
+    # collect the messages of the warnings logged by `simulation`, e.g. 'Input buffer is empty!'
+    collector = _WarningCollector()
+    logging.getLogger().addHandler(collector)
+    try:
+        yield collector.messages
+    finally:
+        logging.getLogger().removeHandler(collector)
+
+
+_programs: dict = {}  # binary file: (instructions, memory), loaded once and shared with the workers
+
+
+def _init_worker(programs: dict):
+    # with the `fork` start method the programs are inherited by the worker without pickling
+    _programs.update(programs)
+    logging.getLogger().setLevel(logging.WARNING)
+
+
+def run_job(job: Job, options: SimulationOptions) -> dict:
+    instructions, memory = _programs[job.binary_file]
+    result = {'binary': job.binary_file, 'input': job.input_file}
+    with capture_warnings() as warnings:
+        try:  # ValueError - the input is not in UTF-8 or the program outputs an invalid char
+            with open(job.input_file, encoding='utf-8') as f:
+                input_stream = f.read()
+            output, instr_executed, ticks = simulation(instructions, memory, input_stream, **options._asdict())
+            result.update(output=output, instr=instr_executed, ticks=ticks, error=None)
+        except (AssertionError, ArithmeticError, IndexError, ValueError, OSError) as e:
+            result.update(output=None, instr=None, ticks=None, error=repr(e))
+    result['warnings'] = warnings
+    return result
+
+
+def _run_chunk(jobs: list[Job], options: SimulationOptions) -> list[dict]:
+    return [run_job(job, options) for job in jobs]
+
+
+def run_batch(jobs: Iterable[Job], options: SimulationOptions = DEFAULT_OPTIONS,
+              workers: int | None = None, chunksize: int = 16) -> Iterator[dict]:  # fmt: skip
+    # run the jobs on a process pool, results are yielded in completion order
+    jobs = [Job(*job) for job in jobs]
+    programs = {binary_file: load_binary(binary_file) for binary_file in dict.fromkeys(job.binary_file for job in jobs)}
+    methods = multiprocessing.get_all_start_methods()
+    context = multiprocessing.get_context('fork' if 'fork' in methods else None)
+    with ProcessPoolExecutor(workers, context, initializer=_init_worker, initargs=(programs,)) as executor:
+        futures = [executor.submit(_run_chunk, jobs[i : i + chunksize], options) for i in range(0, len(jobs), chunksize)]
+        for future in as_completed(futures):
+            yield from future.result()
+
+
+def main(argv: list[str]):
+    parser = argparse.ArgumentParser(prog='batch.py', description='Run many (binary, input) jobs on a process pool')
+    parser.add_argument('jobs_file', help='file with a `<binary_file> <input_file>` pair per line, `-` for stdin')
+    parser.add_argument('-j', '--workers', type=int, default=None, help='number of worker processes')
+    parser.add_argument('--chunksize', type=int, default=16, help='jobs sent to a worker at once')
+    parser.add_argument('--engine', choices=ENGINES, default=DEFAULT_OPTIONS.engine)
+    parser.add_argument('--memory-capacity', type=int, default=DEFAULT_OPTIONS.memory_capacity)
+    parser.add_argument('--instr-limit', type=int, default=DEFAULT_OPTIONS.instr_limit)
+    args = parser.parse_args(argv)
+
+    with open(args.jobs_file, encoding='utf-8') if args.jobs_file != '-' else contextlib.nullcontext(sys.stdin) as f:
+        jobs = [Job(*line.split()) for line in f if line.strip()]
+    options = SimulationOptions(args.engine, args.memory_capacity, args.instr_limit)
+    for result in run_batch(jobs, options, args.workers, args.chunksize):
+        print(json.dumps(result, ensure_ascii=False), flush=True)
+
+
+if __name__ == '__main__':
+    main(sys.argv[1:])
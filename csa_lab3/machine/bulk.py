@@ -0,0 +1,136 @@
+from collections.abc import Callable, Sequence
+
+from .isa import AddressingMode, Instruction, Opcode, instruction_ticks
+from .memory import SparseMemory
+
+DIRECT, INDIRECT, IMMEDIATE = AddressingMode.DIRECT, AddressingMode.INDIRECT, AddressingMode.IMMEDIATE
+MIN_ITERATIONS = 2  # fewer iterations are executed by the plain handlers
+
+# loops of the string routines of the translator, a name stands for any argument, the same in all its places,
+# `head` is the address of the first instruction
+COPY_LOOP = (  # while *src != *end: src += 1; dest += 1; **dest = **src
+    (Opcode.LD, DIRECT, 'src'),
+    (Opcode.CMP, DIRECT, 'end'),
+    (Opcode.JE, DIRECT, 'exit'),
+    (Opcode.ADD, IMMEDIATE, 1),
+    (Opcode.ST, DIRECT, 'src'),
+    (Opcode.LD, DIRECT, 'dest'),
+    (Opcode.ADD, IMMEDIATE, 1),
+    (Opcode.ST, DIRECT, 'dest'),
+    (Opcode.LD, INDIRECT, 'src'),
+    (Opcode.ST, INDIRECT, 'dest'),
+    (Opcode.JMP, DIRECT, 'head'),
+)
+OUTPUT_LOOP = (  # while *src != *end: src += 1; out **src
+    (Opcode.LD, DIRECT, 'src'),
+    (Opcode.CMP, DIRECT, 'end'),
+    (Opcode.JE, DIRECT, 'exit'),
+    (Opcode.ADD, IMMEDIATE, 1),
+    (Opcode.ST, DIRECT, 'src'),
+    (Opcode.LD, INDIRECT, 'src'),
+    (Opcode.OUT, DIRECT, 0),
+    (Opcode.JMP, DIRECT, 'head'),
+)
+
+
+class RoundEnd(Exception):  # noqa: N818
+    """Raised by a bulk handler after executing many instructions at once, so the dispatch round is recounted."""
+
+
+def match_loop(instructions: Sequence[Instruction], head: int, template: tuple) -> dict[str, int] | None:
+    # arguments of the loop at `head` by their names in the template, None if the loop does not match it
+    arguments = {'head': head}
+    if head + len(template) > len(instructions):
+        return None
+    for instr, (opcode, mode, argument) in zip(instructions[head : head + len(template)], template):
+        if instr.opcode is not opcode or instr.addressing_mode is not mode:
+            return None
+        if isinstance(argument, str) and arguments.setdefault(argument, instr.argument) != instr.argument:
+            return None
+        if not isinstance(argument, str) and instr.argument != argument:
+            return None
+    return arguments
+
+
+def _cells(memory, start: int, count: int) -> Sequence[int]:
+    if isinstance(memory, SparseMemory):
+        return [memory[addr] for addr in range(start, start + count)]
+    return memory[start : start + count]
+
+
+def _copy_cells(memory, src: int, dest: int, count: int):
+    if isinstance(memory, SparseMemory):
+        for offset, value in enumerate(_cells(memory, src, count)):
+            memory[dest + offset] = value
+    else:
+        memory[dest : dest + count] = memory[src : src + count]
+
+
+def bulk_handler(control_unit, head: int, handler: Callable[[], int]) -> Callable[[], int] | None:
+    """Handler of the string loop at `head` that executes all its iterations fitting into the instruction limit
+    at once, slicing the memory and writing the output port. `handler` runs the loop one instruction at a time,
+    when the loop is about to end, its pointers are out of the memory or the copy overlaps its cells.
+
+    The loop is entered at its head only, where it checks its condition, so any state at the head is valid.
+    Instructions, ticks and the registers are left as by the iterations executed one by one.
+    """
+    instructions, data_path = control_unit.instructions, control_unit.data_path
+    for template, make in ((COPY_LOOP, _copy_handler), (OUTPUT_LOOP, _output_handler)):
+        arguments = match_loop(instructions, head, template)
+        if arguments is None:
+            continue
+        cells = [arguments[name] for name in ('src', 'end', 'dest') if name in arguments]
+        if len(set(cells)) < len(cells) or not all(0 <= cell < data_path.memory_capacity for cell in cells):
+            return None
+        iteration_ticks = sum(instruction_ticks(instr) for instr in instructions[head : head + len(template)])
+        return make(control_unit, handler, arguments, len(template), iteration_ticks)
+    return None
+
+
+def _copy_handler(control_unit, handler, arguments: dict[str, int], iteration_instr: int, iteration_ticks: int):
+    data_path, memory, capacity = control_unit.data_path, control_unit.data_path.memory, control_unit.data_path.memory_capacity
+    src, end, dest = arguments['src'], arguments['end'], arguments['dest']
+
+    def execute():
+        src_addr, dest_addr = memory[src], memory[dest]
+        count = min(memory[end] - src_addr, control_unit.instructions_left() // iteration_instr)
+        first, last = dest_addr + 1, dest_addr + count
+        if (
+            count < MIN_ITERATIONS
+            or not (src_addr >= 0 and src_addr + count < capacity and dest_addr >= 0 and last < capacity)
+            or any(first <= cell <= last or src_addr < cell <= src_addr + count for cell in (src, end, dest))
+            or (src_addr != dest_addr and first <= src_addr + count and src_addr + 1 <= last)  # overlapping strings
+        ):
+            return handler()
+        _copy_cells(memory, src_addr + 1, first, count)
+        memory[src], memory[dest] = src_addr + count, last
+        data_path.alu_output = data_path.acc = memory[last]
+        data_path.address_reg = data_path.memory_output = last
+        control_unit.account_blocks(count * iteration_instr, count * iteration_ticks)
+        raise RoundEnd
+
+    return execute
+
+
+def _output_handler(control_unit, handler, arguments: dict[str, int], iteration_instr: int, iteration_ticks: int):
+    data_path, memory, capacity = control_unit.data_path, control_unit.data_path.memory, control_unit.data_path.memory_capacity
+    src, end = arguments['src'], arguments['end']
+
+    def execute():
+        src_addr = memory[src]
+        count = min(memory[end] - src_addr, control_unit.instructions_left() // iteration_instr)
+        if count < MIN_ITERATIONS or data_path.tracer is not None or not 0 <= src_addr < src_addr + count < capacity:
+            return handler()
+        symbols = _cells(memory, src_addr + 1, count)
+        try:
+            text = ''.join(map(chr, symbols))
+        except (ValueError, OverflowError):
+            return handler()  # the symbol stops the machine
+        data_path.output_port.write(text)
+        memory[src] = last = src_addr + count
+        data_path.memory_output = data_path.alu_output = data_path.acc = symbols[-1]
+        data_path.address_reg = last
+        control_unit.account_blocks(count * iteration_instr, count * iteration_ticks)
+        raise RoundEnd
+
+    return execute
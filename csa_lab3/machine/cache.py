@@ -0,0 +1,157 @@
+import functools
+import hashlib
+import json
+import os
+import tempfile
+import weakref
+from collections import OrderedDict
+from collections.abc import Iterable, Sequence
+from pathlib import Path
+from typing import NamedTuple
+
+from .isa import Instruction, machine2binary
+
+DEFAULT_MAX_ENTRIES = 1024  # results kept in memory
+DEFAULT_MAX_SIZE = 64 * 2**20  # bytes of the results on disk
+ENTRY_SUFFIX = '.result'
+
+
+class SimulationResult(NamedTuple):
+    output: str
+    instr: int
+    ticks: int
+    input_is_over: bool  # the simulation logged 'Input buffer is empty!'
+
+
+@functools.cache
+def machine_version() -> str:
+    # hash of the machine sources, any change of them invalidates the results on disk
+    digest = hashlib.sha256()
+    for path in sorted(Path(__file__).parent.glob('*.py')):
+        digest.update(path.name.encode())
+        digest.update(path.read_bytes())
+    return digest.hexdigest()
+
+
+def program_digest(binary: bytes) -> str:
+    # the digest of the binary image identifying the program, the same for the file and `machine2binary`
+    return hashlib.sha256(binary).hexdigest()
+
+
+_image_digests: weakref.WeakKeyDictionary = weakref.WeakKeyDictionary()  # instructions: (memory, digest)
+
+
+def image_digest(instructions: Sequence[Instruction], memory: Sequence[int]) -> str:
+    # `program_digest` of the binary image of the program; remembered while the instructions (a loaded
+    # InstructionStore, which is not changed) live and come with the same memory, other programs are encoded every time
+    try:
+        cached_memory, digest = _image_digests.get(instructions, (None, None))
+    except TypeError:  # lists may change and cannot be weakly referenced
+        return program_digest(machine2binary(instructions, memory))
+    if cached_memory is not memory:
+        digest = program_digest(machine2binary(instructions, memory))
+        _image_digests[instructions] = memory, digest
+    return digest
+
+
+def write_atomically(path: Path, chunks: Iterable[bytes]):
+    # write to a temporary file first and then rename it, so the processes sharing the directory never read a part
+    fd, temp_path = tempfile.mkstemp(dir=path.parent, suffix='.tmp')
+    try:
+        with os.fdopen(fd, 'wb') as f:
+            f.writelines(chunks)
+        Path(temp_path).replace(path)
+    except BaseException:
+        Path(temp_path).unlink()
+        raise
+
+
+def evict_least_recently_used(directory: Path, suffix: str, max_size: int):
+    # delete the least recently used files with the suffix until the rest fit into `max_size`,
+    # the modification time of a file is its last use
+    entries = []
+    for entry in os.scandir(directory):
+        if entry.name.endswith(suffix):
+            try:
+                stat = entry.stat()
+            except FileNotFoundError:  # deleted by another process
+                continue
+            entries.append((stat.st_mtime_ns, stat.st_size, entry.path))
+    total_size = sum(size for _, size, _ in entries)
+    for _, size, path in sorted(entries):
+        if total_size <= max_size:
+            break
+        Path(path).unlink(missing_ok=True)
+        total_size -= size
+
+
+class SimulationCache:
+    """Results of the simulations by their program, input, memory capacity and instruction limit, as the machine
+    is deterministic. The engine is not a part of the key, since all engines compute the same results.
+
+    The least recently used results are kept in memory, up to `max_entries`. With a directory the results are
+    also stored on disk, one file per result written by `write_atomically`: the modification time of a file is
+    its last use and `evict_least_recently_used` deletes the least recently used files over `max_size`.
+    """
+
+    def __init__(self, max_entries: int = DEFAULT_MAX_ENTRIES, directory: str | os.PathLike | None = None,
+                 max_size: int = DEFAULT_MAX_SIZE):  # fmt: skip
+        self.max_entries = max_entries
+        self.directory = Path(directory) if directory is not None else None
+        self.max_size = max_size
+        self.entries: OrderedDict[str, SimulationResult] = OrderedDict()
+        self.hits = 0  # results found in memory
+        self.disk_hits = 0  # results found on disk only
+        self.misses = 0
+        if self.directory is not None:
+            self.directory.mkdir(parents=True, exist_ok=True)
+
+    @staticmethod
+    def key(program: str, input_stream: str, memory_capacity: int, instr_limit: int) -> str:
+        digest = hashlib.sha256(f'{machine_version()} {program} {memory_capacity} {instr_limit} '.encode())
+        digest.update(input_stream.encode('utf-8', 'surrogatepass'))
+        return digest.hexdigest()
+
+    def _path(self, key: str) -> Path:
+        return self.directory / (key + ENTRY_SUFFIX)
+
+    def get(self, key: str) -> SimulationResult | None:
+        result = self.entries.get(key)
+        if result is not None:
+            self.entries.move_to_end(key)
+            self.hits += 1
+            return result
+        result = self._load(key) if self.directory is not None else None
+        if result is None:
+            self.misses += 1
+            return None
+        self.disk_hits += 1
+        self._remember(key, result)
+        return result
+
+    def _load(self, key: str) -> SimulationResult | None:
+        path = self._path(key)
+        try:
+            data = path.read_bytes()
+            os.utime(path)
+        except OSError:
+            return None
+        try:
+            return SimulationResult(**json.loads(data))
+        except (ValueError, TypeError):  # truncated or foreign file
+            path.unlink(missing_ok=True)
+            return None
+
+    def put(self, key: str, result: SimulationResult):
+        self._remember(key, result)
+        if self.directory is None:
+            return
+        data = json.dumps(result._asdict(), ensure_ascii=False).encode('utf-8', 'surrogatepass')
+        write_atomically(self._path(key), [data])
+        evict_least_recently_used(self.directory, ENTRY_SUFFIX, self.max_size)
+
+    def _remember(self, key: str, result: SimulationResult):
+        self.entries[key] = result
+        self.entries.move_to_end(key)
+        while len(self.entries) > self.max_entries:
+            self.entries.popitem(last=False)
@@ -0,0 +1,185 @@
+from collections.abc import Sequence
+
+from .fast import WORD_MAX, WORD_MIN, FastControlUnit
+from .isa import (
+    ADDRESS_INSTRUCTIONS,
+    JUMP_INSTRUCTIONS,
+    AddressingMode,
+    Instruction,
+    Opcode,
+    basic_block_leaders,
+    instruction_ticks,
+)
+
+ALU_OPERATORS = {Opcode.ADD: '+', Opcode.SUB: '-', Opcode.MUL: '*', Opcode.DIV: '//', Opcode.MOD: '%', Opcode.CMP: '-'}
+JUMP_CONDITIONS = {Opcode.JE: '{} == 0', Opcode.JNE: '{} != 0', Opcode.JL: '{} < 0', Opcode.JG: '{} > 0'}
+
+
+class BlockCompiler:
+    """Translates every basic block of the program into a python function `block_<addr>(acc, alu)`.
+
+    A block function executes the whole straight-line run on local variables and returns the next instruction
+    pointer with the new `acc` and `alu` (source of the flags). HLT and IN always get blocks of their own,
+    so a block is either completed or has not changed anything when it stops the machine.
+    """
+
+    def __init__(self, instructions: Sequence[Instruction], memory_capacity: int):
+        self.instructions = instructions
+        self.memory_capacity = memory_capacity
+        leaders = basic_block_leaders(instructions)
+        for addr, instr in enumerate(instructions):
+            if instr.opcode in {Opcode.IN, Opcode.HLT}:
+                leaders.update((addr, addr + 1))
+        self.leaders = sorted(leaders)
+
+    def blocks(self):
+        # yield (start, end) of every basic block
+        yield from zip(self.leaders, self.leaders[1:])
+
+    def source(self) -> str:
+        return '\n\n'.join(self._block_source(start, end) for start, end in self.blocks())
+
+    def _block_source(self, start: int, end: int) -> str:
+        self._lines = [f'def block_{start}(acc, alu):']
+        self._alu = 'alu'  # expression holding the last ALU output
+        for addr in range(start, end):
+            instr = self.instructions[addr]
+            if instr.opcode in JUMP_INSTRUCTIONS:
+                self._emit_jump(instr, addr + 1)
+                break
+            if instr.opcode is Opcode.HLT:
+                self._emit('raise StopIteration')
+                break
+            if instr.opcode in ADDRESS_INSTRUCTIONS:
+                self._emit_address_instruction(instr)
+            else:
+                self._emit_io(instr)
+        else:
+            self._emit(f'return {end}, acc, {self._alu}')
+        return '\n'.join(self._lines)
+
+    def _emit(self, line: str):
+        self._lines.append(' ' * 4 + line)
+
+    def _emit_word_check(self, value: str):
+        self._emit(f"assert {WORD_MIN} <= {value} <= {WORD_MAX}, f'Integer overflow: {{{value}}}'")
+
+    def _emit_address_check(self, addr: str):
+        self._emit(f"assert 0 <= {addr} < {self.memory_capacity}, f'Out of memory: {{{addr}}}'")
+
+    def _direct_operand(self, addr: int) -> str:
+        if not 0 <= addr < self.memory_capacity:
+            self._emit(f'raise AssertionError({f"Out of memory: {addr}"!r})')
+        return f'mem[{addr}]'
+
+    def _emit_address_instruction(self, instr: Instruction):
+        arg, mode = instr.argument, instr.addressing_mode
+        if instr.opcode is Opcode.LD:
+            if mode is AddressingMode.IMMEDIATE:
+                if not WORD_MIN <= arg <= WORD_MAX:
+                    self._emit(f'raise AssertionError({f"Integer overflow: {arg}"!r})')
+                self._emit(f'acc = {arg}')
+            elif mode is AddressingMode.DIRECT:
+                self._emit(f'acc = {self._direct_operand(arg)}')
+            else:
+                self._emit(f'addr = {self._direct_operand(arg)}')
+                self._emit_address_check('addr')
+                self._emit('acc = mem[addr]')
+            self._alu = 'acc'
+        elif instr.opcode is Opcode.ST:
+            if mode is AddressingMode.INDIRECT:
+                self._emit(f'addr = {self._direct_operand(arg)}')
+                self._emit_address_check('addr')
+                self._emit('mem[addr] = acc')
+            else:
+                self._emit(f'{self._direct_operand(arg)} = acc')
+            self._alu = 'acc'
+        else:
+            right = str(arg) if mode is AddressingMode.IMMEDIATE else self._direct_operand(arg)
+            result = 'alu' if instr.opcode is Opcode.CMP else 'acc'
+            self._emit(f'{result} = acc {ALU_OPERATORS[instr.opcode]} {right}')
+            self._emit_word_check(result)
+            self._alu = result
+
+    def _emit_io(self, instr: Instruction):
+        if instr.opcode is Opcode.IN:
+            self._emit('data_path.signal_latch_acc(sel_input=True)')
+            self._emit('acc = data_path.acc')
+            self._alu = 'acc'
+        else:
+            self._emit('data_path.acc = acc')
+            self._emit(f'data_path.signal_output(is_number={instr.opcode is Opcode.OUTN})')
+
+    def _emit_jump(self, instr: Instruction, next_ip: int):
+        if instr.opcode is Opcode.JMP:
+            self._emit(f'return {instr.argument}, acc, {self._alu}')
+            return
+        self._emit(f'if {JUMP_CONDITIONS[instr.opcode].format(self._alu)}:')
+        self._emit(f'    return {instr.argument}, acc, {self._alu}')
+        self._emit(f'return {next_ip}, acc, {self._alu}')
+
+
+class CompiledControlUnit:
+    """Execution engine that runs the program as basic blocks compiled to python functions.
+
+    Instructions and ticks are accounted per block. When a whole block does not fit into the instruction limit,
+    or the execution starts in the middle of a block, instructions are stepped one by one with FastControlUnit.
+    Only `acc` and the flags are kept up to date in DataPath, the address and memory output registers are not.
+    """
+
+    def __init__(self, instructions: Sequence[Instruction], data_path):
+        self.instructions = instructions
+        self.instr_pointer = 0
+        self.instr_counter = 0
+        self.data_path = data_path
+        self._tick = 0
+        self._stepper = FastControlUnit(instructions, data_path, fuse=False)
+
+        compiler = BlockCompiler(instructions, data_path.memory_capacity)
+        namespace = {'mem': data_path.memory, 'data_path': data_path}
+        exec(compile(compiler.source(), '<compiled program>', 'exec'), namespace)
+
+        # blocks are entered at the leaders only, the limit never fits other addresses, so they are stepped
+        never_fits = 2**63
+        self.block_functions = [None] * len(instructions)
+        self.block_sizes = [never_fits] * len(instructions)
+        self.block_ticks = [0] * len(instructions)
+        for start, end in compiler.blocks():
+            self.block_functions[start] = namespace[f'block_{start}']
+            block = instructions[start:end]
+            self.block_sizes[start] = len(block) - (block[-1].opcode is Opcode.HLT)
+            self.block_ticks[start] = sum(instruction_ticks(instr) for instr in block)
+
+    def current_tick(self) -> int:
+        return self._tick
+
+    def set_tick(self, tick: int):
+        self._tick = tick
+
+    def decode_and_execute_instruction(self):
+        instr = self.instructions[self.instr_pointer]
+        self._stepper.instr_pointer = self.instr_pointer
+        self._stepper.decode_and_execute_instruction()
+        self.instr_pointer = self._stepper.instr_pointer
+        self.instr_counter += 1
+        self._tick += instruction_ticks(instr)
+
+    def run(self, instr_limit: int):
+        # execute instructions until HLT (StopIteration), empty input (EOFError) or the instruction limit
+        functions, sizes, ticks = self.block_functions, self.block_sizes, self.block_ticks
+        data_path = self.data_path
+        while True:
+            instr_pointer, instr_counter, tick = self.instr_pointer, self.instr_counter, self._tick
+            acc, alu = data_path.acc, data_path.alu_output
+            try:
+                while instr_counter + sizes[instr_pointer] <= instr_limit:
+                    block_start = instr_pointer
+                    instr_pointer, acc, alu = functions[block_start](acc, alu)
+                    instr_counter += sizes[block_start]
+                    tick += ticks[block_start]
+            finally:
+                self.instr_pointer, self.instr_counter, self._tick = instr_pointer, instr_counter, tick
+                data_path.acc, data_path.alu_output = acc, alu
+            if self.instr_counter >= instr_limit:
+                return
+            self.decode_and_execute_instruction()
@@ -0,0 +1,274 @@
+import argparse
+import bisect
+import cmd
+from collections.abc import Sequence
+
+from .isa import Instruction, SourceMap, load_binary, load_source_map
+from .machine import ControlUnit, DataPath
+from .snapshot import Snapshot, restore_snapshot, take_snapshot
+
+# reasons the debugger stops the program for
+BREAKPOINT = 'breakpoint'
+WATCHPOINT = 'watchpoint'
+STEP = 'step'
+HALTED = 'halted'
+INPUT_IS_OVER = 'input is over'
+LIMIT = 'instruction limit'
+
+ACC = 'acc'  # watchpoint on the accumulator, the others are on the memory cells
+SNAPSHOT_EVERY = 1000  # executed instructions between the snapshots the reverse steps start from
+
+
+class Debugger:
+    """Program on ControlUnit stopped at breakpoints on instruction addresses or source lines and at watchpoints
+    on memory cells and the accumulator, executed by steps, continued and stepped back.
+
+    Breakpoints and watchpoints are checked after every instruction only while some of them are set, otherwise
+    the program is continued by the plain loop of ControlUnit. A snapshot is taken every `snapshot_every` executed
+    instructions, a reverse step restores the last snapshot before the target and executes the rest of the way.
+    """
+
+    def __init__(self, instructions: Sequence[Instruction], memory: Sequence[int], input_stream: str,
+                 memory_capacity: int = 1000, instr_limit: int = 60000, source_map: SourceMap | None = None,
+                 snapshot_every: int = SNAPSHOT_EVERY):  # fmt: skip
+        assert snapshot_every > 0, 'Snapshot interval must be positive'
+        self.instructions = instructions
+        self.memory = memory
+        self.input_stream = input_stream
+        self.memory_capacity = memory_capacity
+        self.instr_limit = instr_limit
+        self.source_map = source_map
+        self.snapshot_every = snapshot_every
+        self.breakpoints: set[int] = set()
+        self.watchpoints: dict[int | str, int] = {}  # cell address or `acc`: value seen last
+        self.stopped: str | None = None  # HALTED or INPUT_IS_OVER, when the program cannot continue
+        self._resumed_at: int | None = None  # address of the last stop, its breakpoint does not stop the next run
+        self.control_unit = self._new_control_unit()
+        self.snapshots: list[Snapshot] = [take_snapshot(self.control_unit, memory)]  # by the executed instructions
+
+    def _new_control_unit(self) -> ControlUnit:
+        return ControlUnit(self.instructions, DataPath(self.memory, self.memory_capacity, self.input_stream))
+
+    @property
+    def data_path(self) -> DataPath:
+        return self.control_unit.data_path
+
+    @property
+    def output(self) -> str:
+        return self.data_path.output_port.getvalue()
+
+    def line(self, addr: int | None = None) -> int:
+        # source line of the instruction, the current one by default, 0 without the source map
+        addr = self.control_unit.instr_pointer if addr is None else addr
+        if self.source_map is None or not 0 <= addr < len(self.source_map.lines):
+            return 0
+        return self.source_map.lines[addr]
+
+    def add_breakpoint(self, addr: int):
+        assert 0 <= addr < len(self.instructions), f'No instruction at {addr}'
+        self.breakpoints.add(addr)
+
+    def add_line_breakpoint(self, line: int) -> int:
+        # breakpoint on the first instruction of the source line, its address is returned
+        assert self.source_map is not None, 'Line breakpoints need the source map'
+        assert line in self.source_map.lines, f'No instructions on line {line}'
+        addr = self.source_map.lines.index(line)
+        self.add_breakpoint(addr)
+        return addr
+
+    def add_watchpoint(self, target: int | str):
+        assert target == ACC or (isinstance(target, int) and 0 <= target < self.memory_capacity), f'Cannot watch {target}'
+        self.watchpoints[target] = self._watched(target)
+
+    def remove(self, target: int | str):
+        # remove the breakpoint at the address and the watchpoint on the target
+        self.breakpoints.discard(target)
+        self.watchpoints.pop(target, None)
+
+    def _watched(self, target: int | str) -> int:
+        return self.data_path.acc if target == ACC else self.data_path.memory[target]
+
+    def read_memory(self, start: int, count: int = 1) -> list[int]:
+        assert start >= 0, 'Out of memory'
+        assert start + count <= self.memory_capacity, 'Out of memory'
+        return [self.data_path.memory[addr] for addr in range(start, start + count)]
+
+    def step(self, count: int = 1) -> str:
+        # execute `count` instructions, stopping at the watchpoints but not at the breakpoints
+        return self._execute(min(self.instr_limit, self.control_unit.instr_counter + count), breakpoints=False) or STEP
+
+    def continue_(self) -> str:
+        # execute until a breakpoint, a watchpoint, HLT, the end of the input or the instruction limit
+        return self._execute(self.instr_limit, breakpoints=True) or LIMIT
+
+    def reverse_step(self, count: int = 1) -> str:
+        # return to the state `count` instructions back, the breakpoints and watchpoints are not checked
+        target = max(0, self.control_unit.instr_counter - count)
+        snapshot = self.snapshots[bisect.bisect_right([s.instr_counter for s in self.snapshots], target) - 1]
+        self.control_unit, self.stopped = self._new_control_unit(), None
+        restore_snapshot(self.control_unit, snapshot)
+        self._run(target)
+        self._update_watchpoints()
+        self._resumed_at = self.control_unit.instr_pointer
+        return STEP
+
+    def _execute(self, limit: int, breakpoints: bool) -> str | None:
+        # the reason of the stop before the limit, None at the limit
+        if self.stopped is not None:
+            return self.stopped
+        checked = self.watchpoints or (breakpoints and self.breakpoints)
+        try:
+            if checked:
+                return self._run_checked(limit, breakpoints)
+            self._run(limit)
+        except StopIteration:
+            self.stopped = HALTED
+        except EOFError:
+            self.stopped = INPUT_IS_OVER
+        finally:
+            self._update_watchpoints()
+            self._resumed_at = self.control_unit.instr_pointer
+        return self.stopped
+
+    def _run(self, limit: int):
+        # the plain loop of ControlUnit by slices ending at the snapshots
+        control_unit = self.control_unit
+        while control_unit.instr_counter < limit:
+            control_unit.run(min(limit, (control_unit.instr_counter // self.snapshot_every + 1) * self.snapshot_every))
+            self._take_snapshot()
+
+    def _run_checked(self, limit: int, breakpoints: bool) -> str | None:
+        control_unit, data_path = self.control_unit, self.data_path
+        stops = self.breakpoints if breakpoints else set()
+        watched = [(target, value) for target, value in self.watchpoints.items() if target != ACC]
+        acc = self.watchpoints.get(ACC)
+        resumed_at = self._resumed_at  # the instruction the program stopped at is executed even if it has a breakpoint
+        while control_unit.instr_counter < limit:
+            if control_unit.instr_pointer in stops and control_unit.instr_pointer != resumed_at:
+                return BREAKPOINT
+            resumed_at = None
+            control_unit.decode_and_execute_instruction()
+            control_unit.instr_counter += 1
+            if control_unit.instr_counter % self.snapshot_every == 0:
+                self._take_snapshot()
+            if (acc is not None and data_path.acc != acc) or any(data_path.memory[addr] != value for addr, value in watched):
+                return WATCHPOINT
+        return None
+
+    def _take_snapshot(self):
+        if self.control_unit.instr_counter > self.snapshots[-1].instr_counter:
+            self.snapshots.append(take_snapshot(self.control_unit, self.memory))
+
+    def _update_watchpoints(self):
+        for target in self.watchpoints:
+            self.watchpoints[target] = self._watched(target)
+
+    def where(self) -> str:
+        # the state of the machine and the source line of the current instruction
+        control_unit, data_path = self.control_unit, self.data_path
+        instr = self.instructions[control_unit.instr_pointer] if control_unit.instr_pointer < len(self.instructions) else '-'
+        result = (
+            f'INSTR: {control_unit.instr_counter} TICK: {control_unit.current_tick()} IP: {control_unit.instr_pointer} '
+            f'ACC: {data_path.acc} ADDR: {data_path.address_reg} {instr}'
+        )
+        if line := self.line():
+            result += f'\n{line:>5}  {self.source_map.source[line - 1].strip()}'
+        return result
+
+
+class DebuggerShell(cmd.Cmd):
+    """Command line of the debugger, an address is a number, a source line is a number after `:`."""
+
+    intro = 'Type help or ? to list the commands.'
+    prompt = '(debug) '
+
+    def __init__(self, debugger: Debugger, stdout=None):
+        super().__init__(stdout=stdout)
+        self.debugger = debugger
+
+    def _print(self, *values):
+        print(*values, file=self.stdout)
+
+    def _report(self, reason: str):
+        self._print(f'stopped: {reason}')
+        self._print(self.debugger.where())
+
+    def onecmd(self, line: str) -> bool:
+        try:
+            return super().onecmd(line)
+        except (AssertionError, ValueError) as e:
+            self._print(f'error: {e}')
+            return False
+
+    def emptyline(self) -> bool:
+        return False
+
+    def do_break(self, arg: str):
+        """break ADDR | break :LINE - stop before the instruction or the first instruction of the source line"""
+        if arg.startswith(':'):
+            self._print(f'breakpoint at {self.debugger.add_line_breakpoint(int(arg[1:]))}')
+        else:
+            self.debugger.add_breakpoint(int(arg))
+
+    def do_watch(self, arg: str):
+        """watch ADDR | watch acc - stop when the memory cell or the accumulator changes"""
+        self.debugger.add_watchpoint(ACC if arg == ACC else int(arg))
+
+    def do_delete(self, arg: str):
+        """delete ADDR | delete acc - remove the breakpoint and the watchpoint"""
+        self.debugger.remove(ACC if arg == ACC else int(arg))
+
+    def do_info(self, _arg: str):
+        """info - list the breakpoints and the watchpoints"""
+        self._print('breakpoints:', *sorted(self.debugger.breakpoints))
+        self._print('watchpoints:', *(f'{target}={value}' for target, value in self.debugger.watchpoints.items()))
+
+    def do_step(self, arg: str):
+        """step [N] - execute N instructions"""
+        self._report(self.debugger.step(int(arg or 1)))
+
+    def do_continue(self, _arg: str):
+        """continue - execute until a breakpoint, a watchpoint or the end of the program"""
+        self._report(self.debugger.continue_())
+
+    def do_reverse(self, arg: str):
+        """reverse [N] - go N instructions back"""
+        self._report(self.debugger.reverse_step(int(arg or 1)))
+
+    def do_memory(self, arg: str):
+        """memory START [COUNT] - print the memory cells"""
+        start, count = (int(value) for value in (*arg.split(), 1)[:2])
+        for addr, value in enumerate(self.debugger.read_memory(start, count), start):
+            self._print(f'{addr:>6}: {value}')
+
+    def do_where(self, _arg: str):
+        """where - print the registers and the current instruction"""
+        self._print(self.debugger.where())
+
+    def do_output(self, _arg: str):
+        """output - print the output of the program"""
+        self._print(repr(self.debugger.output))
+
+    def do_quit(self, _arg: str) -> bool:
+        """quit - leave the debugger"""
+        return True
+
+    do_b, do_w, do_s, do_c, do_rs, do_m, do_q = do_break, do_watch, do_step, do_continue, do_reverse, do_memory, do_quit
+    do_EOF = do_quit  # noqa: N815
+
+
+def main(binary_file: str, input_file: str, source_map_file: str | None = None):
+    instructions, memory = load_binary(binary_file)
+    with open(input_file, encoding='utf-8') as f:
+        input_stream = f.read()
+    source_map = load_source_map(source_map_file) if source_map_file is not None else None
+    DebuggerShell(Debugger(instructions, memory, input_stream, source_map=source_map)).cmdloop()
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(prog='debugger.py', description='Interactive debugger of the programs on ControlUnit')
+    parser.add_argument('binary_file', help='file with the machine code')
+    parser.add_argument('input_file', help='file with the input data')
+    parser.add_argument('--source-map', help='source map written by the translator, for the line breakpoints')
+    args = parser.parse_args()
+    main(args.binary_file, args.input_file, args.source_map)
@@ -0,0 +1,423 @@
+import operator
+from collections.abc import Callable, Sequence
+
+from .bulk import RoundEnd, bulk_handler
+from .isa import JUMP_INSTRUCTIONS, AddressingMode, Instruction, Opcode, basic_block_leaders, instruction_ticks
+
+Handler = Callable[[], int]  # executes one predecoded instruction and returns the next instruction pointer
+
+WORD_MIN, WORD_MAX = -(2**31), 2**31 - 1
+
+ALU_OPERATIONS = {
+    Opcode.ADD: operator.add,
+    Opcode.SUB: operator.sub,
+    Opcode.MUL: operator.mul,
+    Opcode.DIV: operator.floordiv,
+    Opcode.MOD: operator.mod,
+}
+
+
+def _out_of_memory_handler(data_path, addr: int) -> Handler:
+    def execute():
+        data_path.address_reg = addr
+        assert 0 <= addr < data_path.memory_capacity, f'Out of memory: {addr}'
+
+    return execute
+
+
+def _alu_handler(data_path, instr: Instruction, next_ip: int) -> Handler:  # noqa: C901
+    arg, memory = instr.argument, data_path.memory
+    operation = ALU_OPERATIONS.get(instr.opcode)  # None for CMP, which only sets the flags
+
+    if instr.addressing_mode is AddressingMode.IMMEDIATE:
+        if instr.opcode is Opcode.CMP:
+
+            def execute():
+                result = data_path.acc - arg
+                assert WORD_MIN <= result <= WORD_MAX, f'Integer overflow: {result}'
+                data_path.alu_output = result
+                return next_ip
+        elif instr.opcode is Opcode.ADD:
+
+            def execute():
+                result = data_path.acc + arg
+                assert WORD_MIN <= result <= WORD_MAX, f'Integer overflow: {result}'
+                data_path.alu_output = data_path.acc = result
+                return next_ip
+        else:
+
+            def execute():
+                result = operation(data_path.acc, arg)
+                assert WORD_MIN <= result <= WORD_MAX, f'Integer overflow: {result}'
+                data_path.alu_output = data_path.acc = result
+                return next_ip
+
+        return execute
+
+    if not 0 <= arg < data_path.memory_capacity:
+        return _out_of_memory_handler(data_path, arg)
+
+    if instr.opcode is Opcode.CMP:
+
+        def execute():
+            data_path.address_reg = arg
+            data_path.memory_output = value = memory[arg]
+            result = data_path.acc - value
+            assert WORD_MIN <= result <= WORD_MAX, f'Integer overflow: {result}'
+            data_path.alu_output = result
+            return next_ip
+    elif instr.opcode is Opcode.ADD:
+
+        def execute():
+            data_path.address_reg = arg
+            data_path.memory_output = value = memory[arg]
+            result = data_path.acc + value
+            assert WORD_MIN <= result <= WORD_MAX, f'Integer overflow: {result}'
+            data_path.alu_output = data_path.acc = result
+            return next_ip
+    else:
+
+        def execute():
+            data_path.address_reg = arg
+            data_path.memory_output = value = memory[arg]
+            result = operation(data_path.acc, value)
+            assert WORD_MIN <= result <= WORD_MAX, f'Integer overflow: {result}'
+            data_path.alu_output = data_path.acc = result
+            return next_ip
+
+    return execute
+
+
+def _load_handler(data_path, instr: Instruction, next_ip: int) -> Handler:
+    arg, memory, capacity = instr.argument, data_path.memory, data_path.memory_capacity
+
+    if instr.addressing_mode is AddressingMode.IMMEDIATE:
+
+        def execute():
+            assert WORD_MIN <= arg <= WORD_MAX, f'Integer overflow: {arg}'
+            data_path.alu_output = data_path.acc = arg
+            return next_ip
+
+        return execute
+
+    if not 0 <= arg < capacity:
+        return _out_of_memory_handler(data_path, arg)
+
+    if instr.addressing_mode is AddressingMode.DIRECT:
+
+        def execute():
+            data_path.address_reg = arg
+            data_path.memory_output = data_path.alu_output = data_path.acc = memory[arg]
+            return next_ip
+    else:
+
+        def execute():
+            addr = data_path.address_reg = memory[arg]
+            assert 0 <= addr < capacity, f'Out of memory: {addr}'
+            data_path.memory_output = data_path.alu_output = data_path.acc = memory[addr]
+            return next_ip
+
+    return execute
+
+
+def _store_handler(data_path, instr: Instruction, next_ip: int) -> Handler:
+    arg, memory, capacity = instr.argument, data_path.memory, data_path.memory_capacity
+
+    if not 0 <= arg < capacity:
+        return _out_of_memory_handler(data_path, arg)
+
+    if instr.addressing_mode is AddressingMode.INDIRECT:
+
+        def execute():
+            addr = data_path.address_reg = data_path.memory_output = memory[arg]
+            assert 0 <= addr < capacity, f'Out of memory: {addr}'
+            memory[addr] = data_path.alu_output = data_path.acc
+            return next_ip
+    else:  # the immediate mode is handled as the direct one, the same way ControlUnit does
+
+        def execute():
+            data_path.address_reg = arg
+            memory[arg] = data_path.alu_output = data_path.acc
+            return next_ip
+
+    return execute
+
+
+def _io_handler(data_path, instr: Instruction, next_ip: int) -> Handler:
+    if instr.opcode is Opcode.IN:
+
+        def execute():
+            data_path.signal_latch_acc(sel_input=True)
+            data_path.alu_output = data_path.acc
+            return next_ip
+    else:
+        is_number = instr.opcode is Opcode.OUTN
+
+        def execute():
+            data_path.signal_output(is_number=is_number)
+            return next_ip
+
+    return execute
+
+
+def _fits(data_path, instr: Instruction) -> bool:
+    # the instruction cannot stop the machine: a direct load or store in the memory, or an immediate load of a word
+    if instr.opcode is Opcode.LD and instr.addressing_mode is AddressingMode.IMMEDIATE:
+        return WORD_MIN <= instr.argument <= WORD_MAX
+    if instr.opcode is Opcode.ST or (instr.opcode is Opcode.LD and instr.addressing_mode is AddressingMode.DIRECT):
+        return instr.addressing_mode is not AddressingMode.INDIRECT and 0 <= instr.argument < data_path.memory_capacity
+    return False
+
+
+def _fused_store_handler(data_path, first: Instruction, second: Instruction, next_ip: int) -> Handler | None:
+    # `LD x; ST y`, `LD #c; ST y`, `OP #c; ST y` and `ST x; LD y`, the registers are left as by the two instructions
+    memory, arg, target = data_path.memory, first.argument, second.argument
+    if second.opcode is Opcode.ST and first.opcode is Opcode.LD:
+        if first.addressing_mode is AddressingMode.DIRECT:
+
+            def execute():
+                data_path.memory_output = value = memory[arg]
+                data_path.address_reg = target
+                memory[target] = data_path.alu_output = data_path.acc = value
+                return next_ip
+        else:
+
+            def execute():
+                data_path.address_reg = target
+                memory[target] = data_path.alu_output = data_path.acc = arg
+                return next_ip
+
+        return execute
+
+    if second.opcode is Opcode.ST and first.opcode in ALU_OPERATIONS and first.addressing_mode is AddressingMode.IMMEDIATE:
+        operation = ALU_OPERATIONS[first.opcode]
+
+        def execute():
+            result = operation(data_path.acc, arg)
+            assert WORD_MIN <= result <= WORD_MAX, f'Integer overflow: {result}'
+            data_path.address_reg = target
+            memory[target] = data_path.alu_output = data_path.acc = result
+            return next_ip
+
+        return execute
+
+    if second.opcode is Opcode.LD and second.addressing_mode is AddressingMode.DIRECT and first.opcode is Opcode.ST:
+
+        def execute():
+            memory[arg] = data_path.acc
+            data_path.address_reg = target
+            data_path.memory_output = data_path.alu_output = data_path.acc = memory[target]
+            return next_ip
+
+        return execute
+    return None
+
+
+def _halt_handler():
+    raise StopIteration
+
+
+class FastControlUnit:
+    """Execution engine that predecodes the program into one specialized handler per instruction.
+
+    Produces the same output, instruction and tick counts as ControlUnit. Ticks and instructions are summed per
+    basic block by the handler of the block's last instruction, so the dispatch loop does not have to account them.
+    Frequent pairs of adjacent instructions of a block (`LD x; ST y`, `ADD #1; ST y`, `CMP x; JE t` and alike) are
+    fused into superinstructions dispatched at once, the second instruction of a pair never stops the machine.
+    The instruction after the first one of a pair keeps its own handler, so the execution can continue from it.
+    With `bulk` the loops of the translator's string routines run as slices of the memory (see `bulk_handler`).
+    """
+
+    def __init__(self, instructions: Sequence[Instruction], data_path, fuse: bool = True, bulk: bool = True):
+        self.instructions = instructions
+        self.instr_pointer = 0
+        self.instr_counter = 0
+        self.data_path = data_path
+        self._block_tick = 0  # ticks of all the completed basic blocks
+        self._block_instr = 0  # instructions of all the completed basic blocks
+        self._instr_limit = 0  # instruction limit of the running `run`
+
+        costs = [instruction_ticks(instr) for instr in instructions]
+        leaders = basic_block_leaders(instructions)
+        self._block_prefix_ticks = []  # ticks spent from the start of the basic block to the instruction
+        self._block_prefix_instr = []  # instructions executed from the start of the basic block to the instruction
+        block_start, block_ticks = 0, 0
+        for addr, cost in enumerate(costs):
+            if addr in leaders:
+                block_start, block_ticks = addr, 0
+            self._block_prefix_ticks.append(block_ticks)
+            self._block_prefix_instr.append(addr - block_start)
+            block_ticks += cost
+
+        self.steps: list[Handler] = []  # handler of every single instruction
+        for addr, instr in enumerate(instructions):
+            block_ticks, block_instr = self._block_prefix_ticks[addr] + costs[addr], self._block_prefix_instr[addr] + 1
+            handler = self._predecode(instr, addr + 1, block_ticks, block_instr)
+            if instr.opcode not in JUMP_INSTRUCTIONS and addr + 1 in leaders:
+                handler = self._block_end(handler, block_ticks, block_instr)
+            self.steps.append(handler)
+
+        self.handlers = list(self.steps)  # handlers dispatched by `run`, the first instructions of the pairs are fused
+        self.fused: set[int] = set()  # addresses of the fused pairs
+        self.bulk: set[int] = set()  # heads of the loops run in bulk
+        if fuse:
+            addr = 0
+            while addr < len(instructions) - 1:
+                handler = self._fuse(addr, leaders, costs) if addr + 1 not in leaders else None
+                if handler is not None:
+                    self.handlers[addr] = handler
+                    self.fused.add(addr)
+                addr += 2 if handler is not None else 1
+        if bulk:
+            for head in sorted(leaders - {len(instructions)}):
+                handler = bulk_handler(self, head, self.handlers[head])
+                if handler is not None:
+                    self.handlers[head] = handler
+                    self.bulk.add(head)
+
+    def _fuse(self, addr: int, leaders: set[int], costs: list[int]) -> Handler | None:
+        first, second = self.instructions[addr], self.instructions[addr + 1]
+        if second.opcode in JUMP_INSTRUCTIONS:
+            # `CMP x; Jcc t` and `LD x; JMP t`, the jump accounts the block
+            loads = first.opcode is Opcode.LD and second.opcode is Opcode.JMP and _fits(self.data_path, first)
+            if first.opcode is not Opcode.CMP and not loads:
+                return None
+            block_ticks, block_instr = (
+                self._block_prefix_ticks[addr + 1] + costs[addr + 1],
+                self._block_prefix_instr[addr + 1] + 1,
+            )
+            return self._fused_jump_handler(self.steps[addr], second, addr + 2, block_ticks, block_instr)
+        if addr + 2 in leaders or not _fits(self.data_path, second):
+            return None  # the second instruction would have to account the block or could stop the machine
+        if first.opcode is Opcode.ST and not _fits(self.data_path, first):
+            return None
+        if first.opcode is Opcode.LD and not _fits(self.data_path, first):
+            return None
+        return _fused_store_handler(self.data_path, first, second, addr + 2)
+
+    def _predecode(self, instr: Instruction, next_ip: int, block_ticks: int, block_instr: int) -> Handler:
+        if instr.opcode is Opcode.HLT:
+            return _halt_handler
+        if instr.opcode in JUMP_INSTRUCTIONS:
+            return self._fused_jump_handler(None, instr, next_ip, block_ticks, block_instr)
+        if instr.opcode is Opcode.LD:
+            return _load_handler(self.data_path, instr, next_ip)
+        if instr.opcode is Opcode.ST:
+            return _store_handler(self.data_path, instr, next_ip)
+        if instr.opcode in {Opcode.IN, Opcode.OUT, Opcode.OUTN}:
+            return _io_handler(self.data_path, instr, next_ip)
+        return _alu_handler(self.data_path, instr, next_ip)
+
+    def _fused_jump_handler(self, first: Handler | None, instr: Instruction, next_ip: int,
+                            block_ticks: int, block_instr: int) -> Handler:  # fmt: skip
+        # the jump ending a basic block, preceded by the handler of the instruction before it if it is fused
+        data_path, target = self.data_path, instr.argument
+
+        def jump():
+            self._block_tick += block_ticks
+            self._block_instr += block_instr
+            return target
+
+        def jump_equal():
+            self._block_tick += block_ticks
+            self._block_instr += block_instr
+            return target if data_path.alu_output == 0 else next_ip
+
+        def jump_not_equal():
+            self._block_tick += block_ticks
+            self._block_instr += block_instr
+            return next_ip if data_path.alu_output == 0 else target
+
+        def jump_less():
+            self._block_tick += block_ticks
+            self._block_instr += block_instr
+            return target if data_path.alu_output < 0 else next_ip
+
+        def jump_greater():
+            self._block_tick += block_ticks
+            self._block_instr += block_instr
+            return target if data_path.alu_output > 0 else next_ip
+
+        handler = {
+            Opcode.JMP: jump,
+            Opcode.JE: jump_equal,
+            Opcode.JNE: jump_not_equal,
+            Opcode.JL: jump_less,
+            Opcode.JG: jump_greater,
+        }[instr.opcode]
+        if first is None:
+            return handler
+
+        def execute():
+            first()
+            return handler()
+
+        return execute
+
+    def _block_end(self, handler: Handler, block_ticks: int, block_instr: int) -> Handler:
+        def execute():
+            next_ip = handler()
+            self._block_tick += block_ticks
+            self._block_instr += block_instr
+            return next_ip
+
+        return execute
+
+    def _prefix(self, prefixes: list[int]) -> int:
+        # value of the block prefix at the current instruction pointer, 0 past the end of the program
+        if -len(self.instructions) <= self.instr_pointer < len(self.instructions):
+            return prefixes[self.instr_pointer]
+        return 0
+
+    def current_tick(self) -> int:
+        return self._block_tick + self._prefix(self._block_prefix_ticks)
+
+    def set_tick(self, tick: int):
+        # the tick counter at the current instruction pointer
+        self._block_tick = tick - self._prefix(self._block_prefix_ticks)
+
+    def instructions_left(self) -> int:
+        # instructions the running `run` may still execute, counted from the start of the current basic block
+        return self._instr_limit - self._block_instr
+
+    def account_blocks(self, instr: int, ticks: int):
+        # whole basic blocks executed by a bulk handler
+        self._block_instr += instr
+        self._block_tick += ticks
+
+    def decode_and_execute_instruction(self):
+        self.instr_pointer = self.steps[self.instr_pointer]()
+        self.instr_counter += 1
+
+    def run(self, instr_limit: int):
+        # execute instructions until HLT (StopIteration), empty input (EOFError) or the instruction limit
+        # a fused handler executes up to two instructions, so the dispatches are run in rounds of half
+        # of the remaining instructions, and the last instruction is stepped alone;
+        # a bulk handler executing more instructions ends the round
+        handlers, steps, prefixes = self.handlers, self.steps, self._block_prefix_instr
+        self._block_instr = self.instr_counter - self._prefix(prefixes)
+        self._instr_limit = instr_limit
+        while (remaining := instr_limit - self.instr_counter) >= 2:
+            instr_pointer = self.instr_pointer
+            try:
+                for _ in range(remaining // 2):
+                    instr_pointer = handlers[instr_pointer]()
+            except RoundEnd:
+                pass  # the bulk handler stays at the loop head
+            finally:
+                self.instr_pointer = instr_pointer
+                self.instr_counter = self._block_instr + self._prefix(prefixes)
+        if remaining == 1:
+            self.instr_pointer = steps[self.instr_pointer]()
+            self.instr_counter = self._block_instr + self._prefix(prefixes)
+
+    def __repr__(self):
+        return (
+            f'TICK: {self.current_tick():5} '
+            f'IP: {self.instr_pointer:5} '
+            f'ADDR: {self.data_path.address_reg:5} '
+            f'MEM_OUT: {self.data_path.memory_output:5} '
+            f'ALU_OUT: {self.data_path.alu_output:5} '
+            f'ACC: {self.data_path.acc:5} '
+            f'{self.instructions[self.instr_pointer]}'
+        )
@@ -1,4 +1,10 @@
+import json
+import mmap
+import os
 import struct
+import sys
+from array import array
+from collections.abc import Sequence
 from enum import Enum
 from typing import NamedTuple
 
@@ -55,29 +61,121 @@ class Instruction(NamedTuple):
         return f'{self.opcode.name} {self.argument}'
 
 
-def machine2binary(instructions: list[Instruction], memory: list[int]) -> bytes:
-    binary = b''
-    for instr in instructions:
-        op, addr_mode, arg = instr.opcode.value, instr.addressing_mode.value, instr.argument
-        binary += struct.pack('>Bi', (op << 2) | addr_mode, arg)
-    binary += b'\x00' * 5
-    for value in memory:
-        binary += struct.pack('>i', value)
+def instruction_ticks(instr: Instruction) -> int:
+    # number of ticks the control unit spends on the instruction (HLT stops the machine before the tick)
+    if instr.opcode in ZERO_ADDRESS_INSTRUCTIONS:
+        return 0
+    if instr.opcode in JUMP_INSTRUCTIONS or instr.opcode in IO_INSTRUCTIONS:
+        return 1
+    if instr.opcode is Opcode.LD:
+        return {AddressingMode.IMMEDIATE: 1, AddressingMode.DIRECT: 2, AddressingMode.INDIRECT: 3}[instr.addressing_mode]
+    if instr.opcode is Opcode.ST:
+        return 3 if instr.addressing_mode is AddressingMode.INDIRECT else 1
+    return 1 if instr.addressing_mode is AddressingMode.IMMEDIATE else 2  # arithmetic has no indirect mode
+
+
+def basic_block_leaders(instructions: Sequence[Instruction]) -> set[int]:
+    # addresses starting the basic blocks: the entry point, jump targets and the instructions after jumps or HLT
+    size = len(instructions)
+    leaders = {0, size}
+    for addr, instr in enumerate(instructions):
+        if instr.opcode in JUMP_INSTRUCTIONS or instr.opcode in ZERO_ADDRESS_INSTRUCTIONS:
+            leaders.add(addr + 1)
+        if instr.opcode in JUMP_INSTRUCTIONS and -size <= instr.argument < size:
+            leaders.add(instr.argument % size)
+    return leaders
+
+
+class SourceMap(NamedTuple):
+    lines: list[int]  # source line of every instruction, 0 if the instruction does not come from a statement
+    source: list[str]  # lines of the source code
+
+
+_OPCODES_BY_VALUE = {opcode.value: opcode for opcode in Opcode}
+_ADDRESSING_MODES_BY_VALUE = {mode.value: mode for mode in AddressingMode}
+
+
+class InstructionStore(Sequence):
+    """Compact columnar storage of the program: opcodes, addressing modes and arguments in parallel arrays.
+
+    Instruction tuples are created only on access, so a loaded program takes 6 bytes per instruction.
+    """
+
+    def __init__(self, opcodes: array, addressing_modes: array, arguments: array):
+        self.opcodes = opcodes
+        self.addressing_modes = addressing_modes
+        self.arguments = arguments
+
+    def __len__(self):
+        return len(self.arguments)
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            return [self[i] for i in range(*index.indices(len(self)))]
+        return Instruction(
+            _OPCODES_BY_VALUE[self.opcodes[index]],
+            self.arguments[index],
+            _ADDRESSING_MODES_BY_VALUE[self.addressing_modes[index]],
+        )
+
+    def __iter__(self):
+        opcodes, modes = _OPCODES_BY_VALUE, _ADDRESSING_MODES_BY_VALUE
+        for op, addr_mode, arg in zip(self.opcodes, self.addressing_modes, self.arguments):
+            yield Instruction(opcodes[op], arg, modes[addr_mode])
+
+
+def machine2binary(instructions: Sequence[Instruction], memory: Sequence[int]) -> bytearray:
+    binary = bytearray(len(instructions) * 5 + 5 + len(memory) * 4)  # instructions, empty instruction, data words
+    for offset, instr in zip(range(0, len(instructions) * 5, 5), instructions):
+        struct.pack_into('>Bi', binary, offset, (instr.opcode.value << 2) | instr.addressing_mode.value, instr.argument)
+    struct.pack_into(f'>{len(memory)}i', binary, len(instructions) * 5 + 5, *memory)
     return binary
 
 
-def binary2machine(binary_file: str) -> tuple[list[Instruction], list[int]]:
-    instructions = []
-    memory = []
+def _code_section_size(image) -> int:
+    # the code section ends with the empty (all zero) instruction, or with the end of the image
+    pos = image.find(b'\x00' * 5)
+    while pos != -1 and pos % 5:
+        pos = image.find(b'\x00' * 5, pos + 1)
+    return len(image) if pos == -1 else pos
+
+
+def load_binary(binary_file: str) -> tuple[InstructionStore, array]:
+    # maps the image to memory and decodes it in bulk: instruction columns and `array('i')` of the data memory
+    opcodes, addressing_modes, arguments, memory = array('B'), array('B'), array('i'), array('i')
+    assert memory.itemsize == 4, 'The platform has no 32-bit array type'
     with open(binary_file, 'rb') as file:
-        while instr := file.read(5):
-            assert len(instr) == 5, 'The bytecode is invalid'
-            if instr == b'\x00' * 5:
-                break
-            op, arg = struct.unpack('>Bi', instr)
-            op, addr_mode = op >> 2, op & 0b11
-            instructions.append(Instruction(Opcode(op), arg, AddressingMode(addr_mode)))
-        while memory_word := file.read(4):
-            assert len(memory_word) == 4, 'The bytecode is invalid'
-            memory.append(struct.unpack('>i', memory_word)[0])
-    return instructions, memory
+        if os.fstat(file.fileno()).st_size == 0:
+            return InstructionStore(opcodes, addressing_modes, arguments), memory
+        with mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ) as image, memoryview(image) as view:
+            code_size = _code_section_size(image)
+            assert code_size % 5 == 0, 'The bytecode is invalid'
+            for op, arg in struct.iter_unpack('>Bi', view[:code_size]):
+                opcodes.append(op >> 2)
+                addressing_modes.append(op & 0b11)
+                arguments.append(arg)
+            data = view[code_size + 5 :]
+            assert len(data) % 4 == 0, 'The bytecode is invalid'
+            memory.frombytes(data)
+            del data
+    if sys.byteorder == 'little':
+        memory.byteswap()
+    assert set(opcodes) <= _OPCODES_BY_VALUE.keys(), 'The bytecode is invalid'
+    assert set(addressing_modes) <= _ADDRESSING_MODES_BY_VALUE.keys(), 'The bytecode is invalid'
+    return InstructionStore(opcodes, addressing_modes, arguments), memory
+
+
+def source_map2json(source_map: SourceMap) -> str:
+    return json.dumps(source_map._asdict(), ensure_ascii=False)
+
+
+def load_source_map(source_map_file: str) -> SourceMap:
+    with open(source_map_file, encoding='utf-8') as file:
+        data = json.load(file)
+    assert len(data['source']) >= max(data['lines'], default=0), 'The source map is invalid'
+    return SourceMap(data['lines'], data['source'])
+
+
+def binary2machine(binary_file: str) -> tuple[list[Instruction], list[int]]:
+    instructions, memory = load_binary(binary_file)
+    return list(instructions), memory.tolist()
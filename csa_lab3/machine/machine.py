@@ -1,8 +1,21 @@
+import argparse
+import contextlib
+import functools
 import logging
 import sys
+from collections.abc import Callable, Sequence
 from enum import Enum
+from pathlib import Path
 
-from .isa import JUMP_INSTRUCTIONS, AddressingMode, Instruction, Opcode, binary2machine
+from .cache import SimulationCache, SimulationResult, image_digest, program_digest
+from .compiler import CompiledControlUnit
+from .fast import FastControlUnit
+from .isa import JUMP_INSTRUCTIONS, AddressingMode, Instruction, Opcode, load_binary, load_source_map
+from .memory import allocate_memory
+from .ports import BufferOutputPort, InputPort, OutputPort, StreamInputPort, StreamOutputPort, StringInputPort
+from .profiler import Profiler
+from .snapshot import Snapshot, restore_snapshot, run_with_checkpoints
+from .tracing import DROPPED, INPUT, OUTPUT, STATE, TRACE_WINDOW, WINDOW_END, Tracer
 
 
 class ALUMode(Enum):
@@ -12,10 +25,12 @@ class ALUMode(Enum):
 
 
 class DataPath:
-    def __init__(self, memory: list[int], memory_capacity: int, input_buffer: str):
+    def __init__(self, memory: Sequence[int], memory_capacity: int, input_buffer: str | InputPort,
+                 memory_backend: str = 'auto', output_port: OutputPort | None = None,
+                 tracer: Tracer | None = None):  # fmt: skip
         assert 0 <= memory_capacity <= 2**31, 'Data memory can consist of a maximum of 2^31 cells'
         assert len(memory) < memory_capacity, 'Memory capacity exceeded'
-        self.memory = memory + [0] * (memory_capacity - len(memory))
+        self.memory = allocate_memory(memory, memory_capacity, memory_backend)
         self.memory_capacity = memory_capacity
         self.memory_output = 0
 
@@ -26,15 +41,15 @@ class DataPath:
         self._flag_zero = True
         self._flag_negative = False
 
-        self.input_buffer = [char if char != '\n' else chr(0) for char in input_buffer] + [chr(0)]
-        self.output_buffer = []
+        self.input_port = StringInputPort(input_buffer) if isinstance(input_buffer, str) else input_buffer
+        self.output_port = BufferOutputPort() if output_port is None else output_port
+        self.tracer = tracer
 
     def signal_latch_acc(self, sel_input: bool):
         if sel_input:
-            if len(self.input_buffer) == 0:
-                raise EOFError
-            symbol = self.input_buffer.pop(0)
-            logging.debug(f'input: {symbol!r}')
+            symbol = self.input_port.read()  # raises EOFError if the input is over
+            if self.tracer is not None:
+                self.tracer.record_input(symbol)
             self.acc = ord(symbol)
         else:
             self.acc = self.alu_output
@@ -72,8 +87,9 @@ class DataPath:
 
     def signal_output(self, is_number: bool = False):
         output = str(self.acc) if is_number else chr(self.acc)
-        logging.debug(f'output: {"".join(self.output_buffer)!r} << {output!r}')
-        self.output_buffer.append(str(output))
+        if self.tracer is not None:
+            self.tracer.record_output(output)
+        self.output_port.write(output)
 
     def flag_zero(self) -> bool:
         return self.alu_output == 0
@@ -83,9 +99,10 @@ class DataPath:
 
 
 class ControlUnit:
-    def __init__(self, instructions: list[Instruction], data_path: DataPath):
+    def __init__(self, instructions: Sequence[Instruction], data_path: DataPath):
         self.instructions = instructions
         self.instr_pointer = 0
+        self.instr_counter = 0
         self.data_path = data_path
         self._tick = 0
 
@@ -95,6 +112,9 @@ class ControlUnit:
     def current_tick(self):
         return self._tick
 
+    def set_tick(self, tick: int):
+        self._tick = tick
+
     def signal_latch_instr_pointer(self, sel_next: bool, instr_pointer: int | None = None):
         if sel_next:
             self.instr_pointer += 1
@@ -173,6 +193,18 @@ class ControlUnit:
         self.tick()
         self.signal_latch_instr_pointer(sel_next=True)
 
+    def run(self, instr_limit: int, tracer: Tracer | None = None):
+        # execute instructions until HLT (StopIteration), empty input (EOFError) or the instruction limit
+        if tracer is None:
+            while self.instr_counter < instr_limit:
+                self.decode_and_execute_instruction()
+                self.instr_counter += 1
+        else:
+            while self.instr_counter < instr_limit:
+                self.decode_and_execute_instruction()
+                self.instr_counter += 1
+                tracer.trace_instruction(self, self.instr_counter)
+
     def __repr__(self):
         return (
             f'TICK: {self._tick:5} '
@@ -185,46 +217,163 @@ class ControlUnit:
         )
 
 
-def simulation(instructions: list[Instruction], memory: list[int], input_stream: str,
-               memory_capacity: int = 1000, instr_limit: int = 60000) -> tuple[str, int, int]:  # fmt: skip
-    data_path = DataPath(memory, memory_capacity, input_stream)
-    control_unit = ControlUnit(instructions, data_path)
-    instr_counter = 0
+ENGINES = {
+    'signal': ControlUnit,  # signal-level model, traces the state of every instruction in the trace window
+    'fast': FastControlUnit,  # predecoded handlers, no per-instruction tracing
+    'compiled': CompiledControlUnit,  # basic blocks compiled to python functions, no per-instruction tracing
+}
+
+# level and function the trace messages are logged with, the same they were logged with before the tracer
+TRACE_RECORD_ORIGINS = {
+    STATE: (logging.DEBUG, 'simulation'),
+    INPUT: (logging.DEBUG, 'signal_latch_acc'),
+    OUTPUT: (logging.DEBUG, 'signal_output'),
+    WINDOW_END: (logging.INFO, 'simulation'),
+    DROPPED: (logging.INFO, 'simulation'),
+}
+
+
+def log_trace(tracer: Tracer, output: str):
+    # dump the trace to the log, formatting the messages only for the enabled levels
+    logger = logging.getLogger()
+    for kind, message in tracer.messages(output):
+        level, func = TRACE_RECORD_ORIGINS[kind]
+        if logger.isEnabledFor(level):
+            logger.handle(logger.makeRecord(logger.name, level, __file__, 0, message, None, None, func))
+
+
+def simulation(instructions: Sequence[Instruction], memory: Sequence[int], input_stream: str | InputPort,
+               memory_capacity: int = 1000, instr_limit: int = 60000, engine: str = 'signal',
+               memory_backend: str = 'auto', output_port: OutputPort | None = None,
+               tracer: Tracer | None = None, snapshot: Snapshot | None = None, checkpoint_every: int | None = None,
+               on_checkpoint: Callable[[Snapshot], None] | None = None,
+               profiler: Profiler | None = None) -> tuple[str, int, int]:  # fmt: skip
+    # without a tracer the trace is recorded only if DEBUG messages are logged,
+    # the trace is dumped to the log when the simulation ends, even by an error
+    # the simulation continues `snapshot` if it is given (`instr_limit` counts the instructions executed before it),
+    # with `checkpoint_every` a snapshot is passed to `on_checkpoint` every that many instructions and at the limit
+    result = _simulate(instructions, memory, input_stream, memory_capacity, instr_limit, engine, memory_backend,
+                       output_port, tracer, snapshot, checkpoint_every, on_checkpoint, profiler)  # fmt: skip
+    if result.input_is_over:
+        logging.warning('Input buffer is empty!')
+    if result.instr >= instr_limit:
+        logging.warning('Instruction limit exceeded!')
+    logging.info(f'output_buffer: {result.output!r}')
+    return result.output, result.instr, result.ticks
+
+
+def _simulate(instructions: Sequence[Instruction], memory: Sequence[int], input_stream: str | InputPort,
+              memory_capacity: int, instr_limit: int, engine: str, memory_backend: str, output_port: OutputPort | None,
+              tracer: Tracer | None, snapshot: Snapshot | None, checkpoint_every: int | None,
+              on_checkpoint: Callable[[Snapshot], None] | None, profiler: Profiler | None) -> SimulationResult:  # fmt: skip
+    assert engine in ENGINES, f'Unknown engine: {engine}'
+    assert profiler is None or engine == 'fast', 'Profiling is supported by the fast engine only'
+    if tracer is None and logging.getLogger().isEnabledFor(logging.DEBUG):
+        tracer = Tracer(instructions)
+    data_path = DataPath(memory, memory_capacity, input_stream, memory_backend, output_port, tracer)
+    control_unit = ENGINES[engine](instructions, data_path)
+    if snapshot is not None:
+        restore_snapshot(control_unit, snapshot)
+    if profiler is not None:
+        profiler.attach(control_unit)
+    run = functools.partial(control_unit.run, tracer=tracer) if engine == 'signal' else control_unit.run
+    input_is_over = False
 
-    logging.debug(control_unit)
     try:
-        while instr_counter < instr_limit:
-            control_unit.decode_and_execute_instruction()
-            instr_counter += 1
-            if instr_counter < 500:
-                logging.debug(control_unit)
-            elif instr_counter == 500:
-                logging.info('To see more than 500 executed instructions, purchase the paid version of the program!')
+        if tracer is not None:
+            tracer.trace_instruction(control_unit, control_unit.instr_counter)
+        if checkpoint_every is None:
+            run(instr_limit)
+        else:
+            run_with_checkpoints(control_unit, run, instr_limit, memory, checkpoint_every, on_checkpoint)
     except EOFError:
-        logging.warning('Input buffer is empty!')
+        input_is_over = True
     except StopIteration:
         pass
-
-    if instr_counter >= instr_limit:
+    finally:
+        data_path.output_port.flush()
+        if profiler is not None:
+            profiler.detach(control_unit)
+        if tracer is not None:
+            log_trace(tracer, data_path.output_port.getvalue())
+    return SimulationResult(data_path.output_port.getvalue(), control_unit.instr_counter, control_unit.current_tick(),
+                            input_is_over)  # fmt: skip
+
+
+def cached_simulation(cache: SimulationCache, instructions: Sequence[Instruction], memory: Sequence[int],
+                      input_stream: str, memory_capacity: int = 1000, instr_limit: int = 60000,
+                      engine: str = 'signal', program: str | None = None) -> tuple[str, int, int]:  # fmt: skip
+    # `simulation` taking the result from the cache if it has it, its warnings are logged as the simulation does;
+    # `program` is the digest of the binary image, `image_digest` of the program if not given;
+    # with DEBUG messages logged the simulation always runs to trace it, the simulations failed are not cached
+    if logging.getLogger().isEnabledFor(logging.DEBUG):
+        return simulation(instructions, memory, input_stream, memory_capacity, instr_limit, engine)
+    program = image_digest(instructions, memory) if program is None else program
+    key = cache.key(program, input_stream, memory_capacity, instr_limit)
+    result = cache.get(key)
+    if result is None:
+        result = _simulate(instructions, memory, input_stream, memory_capacity, instr_limit, engine, 'auto',
+                           None, None, None, None, None, None)  # fmt: skip
+        cache.put(key, result)
+    if result.input_is_over:
+        logging.warning('Input buffer is empty!')
+    if result.instr >= instr_limit:
         logging.warning('Instruction limit exceeded!')
-    logging.info(f'output_buffer: {"".join(data_path.output_buffer)!r}')
-    return ''.join(data_path.output_buffer), instr_counter, control_unit.current_tick()
-
-
-def main(binary_file: str, input_file: str):
-    instructions, memory = binary2machine(binary_file)
-    with open(input_file, encoding='utf-8') as f:
-        input_stream = f.read()
-
-    output, instr_executed, ticks = simulation(instructions, memory, input_stream)
+    logging.info(f'output_buffer: {result.output!r}')
+    return result.output, result.instr, result.ticks
+
+
+def main(binary_file: str, input_file: str, engine: str = 'signal', stream: bool = False,
+         trace_window: int | None = TRACE_WINDOW, profile_file: str | None = None,
+         source_map_file: str | None = None, cache_dir: str | None = None):  # fmt: skip
+    # with `profile_file` the program runs on the fast engine, the profile is printed and dumped to the file as JSON
+    # with `cache_dir` the results of the runs are memoized in the directory, the runs traced or profiled are not
+    instructions, memory = load_binary(binary_file)
+    tracer = Tracer(instructions, trace_window) if logging.getLogger().isEnabledFor(logging.DEBUG) else None
+    profiler = None
+    if profile_file is not None:
+        profiler, engine = Profiler(instructions), 'fast'
+    if stream:  # the input is read lazily and the output is written to stdout while the program runs
+        with open(input_file, encoding='utf-8') if input_file != '-' else contextlib.nullcontext(sys.stdin) as f:
+            output_port = StreamOutputPort(sys.stdout)
+            _, instr_executed, ticks = simulation(instructions, memory, StreamInputPort(f), engine=engine,
+                                                  output_port=output_port, tracer=tracer, profiler=profiler)  # fmt: skip
+        print()
+    else:
+        with open(input_file, encoding='utf-8') as f:
+            input_stream = f.read()
+        if cache_dir is not None and tracer is None and profiler is None:
+            program = program_digest(Path(binary_file).read_bytes())
+            output, instr_executed, ticks = cached_simulation(SimulationCache(directory=cache_dir), instructions, memory,
+                                                              input_stream, engine=engine, program=program)  # fmt: skip
+        else:
+            output, instr_executed, ticks = simulation(instructions, memory, input_stream, engine=engine, tracer=tracer,
+                                                       profiler=profiler)  # fmt: skip
+        print(f'output: {"".join(output)!r}')
 
-    print(f'output: {"".join(output)!r}')
     print('instr executed:', instr_executed)
     print('ticks:', ticks)
+    if profiler is not None:
+        source_map = load_source_map(source_map_file) if source_map_file is not None else None
+        print()
+        print(profiler.report(source_map))
+        profiler.dump(profile_file, source_map)
 
 
 if __name__ == '__main__':
-    logging.getLogger().setLevel(logging.DEBUG)
-    assert len(sys.argv) == 3, 'Wrong arguments: machine.py <binary_file> <input_file>'
-    _, binary_file, input_file = sys.argv
-    main(binary_file, input_file)
+    logging.basicConfig(level=logging.DEBUG)
+    parser = argparse.ArgumentParser(prog='machine.py')
+    parser.add_argument('binary_file', help='file with the machine code')
+    parser.add_argument('input_file', help='file with the input data, `-` for stdin in the stream mode')
+    parser.add_argument('engine', nargs='?', choices=ENGINES, default='signal')
+    parser.add_argument('--stream', action='store_true', help='read the input lazily and write the output as it goes')
+    parser.add_argument('--trace-window', type=int, default=TRACE_WINDOW,
+                        help='number of executed instructions whose states are logged, -1 for all of them')  # fmt: skip
+    parser.add_argument('--profile', help='profile the program on the fast engine and write the profile to the file (JSON)')
+    parser.add_argument('--source-map', help='source map written by the translator, to report the profile by source lines')
+    parser.add_argument('--cache-dir', help='memoize the results of the runs in the directory, the runs are not traced')
+    args = parser.parse_args()
+    if args.stream or args.profile or args.cache_dir:
+        logging.getLogger().setLevel(logging.WARNING)
+    trace_window = None if args.trace_window < 0 else args.trace_window
+    main(args.binary_file, args.input_file, args.engine, args.stream, trace_window, args.profile, args.source_map, args.cache_dir)
@@ -0,0 +1,101 @@
+from array import array
+from collections.abc import Sequence
+from typing import NamedTuple
+
+PAGE_SIZE = 1024  # cells
+LIST_MAX_CAPACITY = 2**16  # boxed ints have the fastest access, but cost 8+ bytes per cell
+DENSE_MAX_CAPACITY = 2**24  # 64 MiB of `array('i')`, larger memories are allocated by pages
+
+MEMORY_BACKENDS = ('auto', 'list', 'dense', 'sparse')
+
+
+class MemoryStats(NamedTuple):
+    touched_pages: int  # pages that have been written to (non-zero pages for the list and dense backends)
+    resident_cells: int  # cells currently allocated
+    peak_resident_cells: int
+
+
+class SparseMemory:
+    """Data memory that allocates `array('i')` pages on the first write, unallocated cells are read as 0.
+
+    Like the dense backend, pages reject values outside the 32-bit word range. Addresses are not checked here,
+    DataPath and the engines check them against the memory capacity before the access.
+    """
+
+    def __init__(self, image: Sequence[int], capacity: int):
+        self.capacity = capacity
+        self.pages: dict[int, array] = {}
+        self.peak_resident_cells = 0
+        for addr, value in enumerate(image):
+            if value:
+                self[addr] = value
+
+    def __len__(self):
+        return self.capacity
+
+    def __getitem__(self, addr: int) -> int:
+        page = self.pages.get(addr // PAGE_SIZE)
+        return 0 if page is None else page[addr % PAGE_SIZE]
+
+    def __setitem__(self, addr: int, value: int):
+        page = self.pages.get(addr // PAGE_SIZE)
+        if page is None:
+            page = self.pages[addr // PAGE_SIZE] = array('i', bytes(4 * PAGE_SIZE))
+            self.peak_resident_cells = max(self.peak_resident_cells, len(self.pages) * PAGE_SIZE)
+        page[addr % PAGE_SIZE] = value
+
+    def stats(self) -> MemoryStats:
+        return MemoryStats(len(self.pages), len(self.pages) * PAGE_SIZE, self.peak_resident_cells)
+
+
+def allocate_memory(image: Sequence[int], capacity: int, backend: str = 'auto'):
+    # `auto` picks the list for small memories, `array('i')` for the medium ones and pages for the rest
+    assert backend in MEMORY_BACKENDS, f'Unknown memory backend: {backend}'
+    if backend == 'auto':
+        backend = 'list' if capacity <= LIST_MAX_CAPACITY else 'dense' if capacity <= DENSE_MAX_CAPACITY else 'sparse'
+
+    if backend == 'sparse':
+        return SparseMemory(image, capacity)
+    if backend == 'dense':
+        memory = array('i', image)
+        memory.frombytes(bytes(memory.itemsize * (capacity - len(image))))
+        return memory
+    return list(image) + [0] * (capacity - len(image))
+
+
+def memory_stats(memory) -> MemoryStats:
+    if isinstance(memory, SparseMemory):
+        return memory.stats()
+    touched_pages = sum(any(memory[start : start + PAGE_SIZE]) for start in range(0, len(memory), PAGE_SIZE))
+    return MemoryStats(touched_pages, len(memory), len(memory))
+
+
+def dirty_pages(memory, image: Sequence[int]) -> dict[int, array]:
+    # page number: cells of every page that differs from the initial image
+    pages = {}
+    if isinstance(memory, SparseMemory):
+        candidates = memory.pages.items()
+    else:
+        candidates = ((start // PAGE_SIZE, memory[start : start + PAGE_SIZE]) for start in range(0, len(memory), PAGE_SIZE))
+    for number, cells in candidates:
+        start = number * PAGE_SIZE
+        cells = array('i', cells[: len(memory) - start])
+        initial = array('i', image[start : start + len(cells)])
+        initial.frombytes(bytes(initial.itemsize * (len(cells) - len(initial))))
+        if cells != initial:
+            pages[number] = cells
+    return pages
+
+
+def write_pages(memory, pages: dict[int, Sequence[int]]):
+    # overwrite the pages in place, the engines keep references to the memory
+    for number, cells in pages.items():
+        start = number * PAGE_SIZE
+        if isinstance(memory, SparseMemory):
+            for offset, value in enumerate(cells):
+                if value != memory[start + offset]:  # zeros of the unallocated pages stay unallocated
+                    memory[start + offset] = value
+        elif isinstance(memory, array):
+            memory[start : start + len(cells)] = array('i', cells)
+        else:
+            memory[start : start + len(cells)] = list(cells)
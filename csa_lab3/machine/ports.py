@@ -0,0 +1,109 @@
+from typing import Protocol, TextIO
+
+
+class InputPort(Protocol):
+    consumed: int  # number of symbols read from the port
+
+    def read(self) -> str:
+        # next input symbol, new lines are replaced with chr(0) and one more chr(0) terminates the data
+        # raises EOFError after the terminating chr(0)
+        ...
+
+    def skip(self, count: int):
+        # discard the next `count` symbols, as if they were read
+        ...
+
+
+class OutputPort(Protocol):
+    def write(self, data: str): ...
+
+    def flush(self): ...
+
+    def getvalue(self) -> str:
+        # output retained by the port
+        ...
+
+
+class StringInputPort:
+    def __init__(self, data: str):
+        self.data = data.replace('\n', chr(0)) + chr(0)
+        self.consumed = 0
+
+    def read(self) -> str:
+        if self.consumed == len(self.data):
+            raise EOFError
+        self.consumed += 1
+        return self.data[self.consumed - 1]
+
+    def skip(self, count: int):
+        if self.consumed + count > len(self.data):
+            raise EOFError
+        self.consumed += count
+
+
+class StreamInputPort:
+    """Reads a text stream lazily by chunks, so the input takes constant memory."""
+
+    def __init__(self, stream: TextIO, chunk_size: int = 2**16):
+        self.stream = stream
+        self.chunk_size = chunk_size
+        self.consumed = 0
+        self._chunk = ''
+        self._chunk_pos = 0
+        self._terminated = False  # the terminating chr(0) has been read
+
+    def read(self) -> str:
+        if self._chunk_pos == len(self._chunk):
+            self._chunk, self._chunk_pos = self.stream.read(self.chunk_size).replace('\n', chr(0)), 0
+            if not self._chunk:
+                if self._terminated:
+                    raise EOFError
+                self._terminated = True
+                self.consumed += 1
+                return chr(0)
+        self._chunk_pos += 1
+        self.consumed += 1
+        return self._chunk[self._chunk_pos - 1]
+
+    def skip(self, count: int):
+        for _ in range(count):
+            self.read()
+
+
+class BufferOutputPort:
+    def __init__(self):
+        self.buffer: list[str] = []
+
+    def write(self, data: str):
+        self.buffer.append(data)
+
+    def flush(self):
+        pass
+
+    def getvalue(self) -> str:
+        return ''.join(self.buffer)
+
+
+class StreamOutputPort:
+    """Writes the output to a text sink by chunks of `buffer_size` symbols, nothing is retained."""
+
+    def __init__(self, sink: TextIO, buffer_size: int = 2**16):
+        self.sink = sink
+        self.buffer_size = buffer_size
+        self._buffer: list[str] = []
+        self._buffered = 0
+
+    def write(self, data: str):
+        self._buffer.append(data)
+        self._buffered += len(data)
+        if self._buffered >= self.buffer_size:
+            self.flush()
+
+    def flush(self):
+        self.sink.write(''.join(self._buffer))
+        self.sink.flush()
+        self._buffer.clear()
+        self._buffered = 0
+
+    def getvalue(self) -> str:
+        return ''
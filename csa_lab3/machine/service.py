@@ -0,0 +1,302 @@
+import argparse
+import asyncio
+import codecs
+import contextlib
+import logging
+import sys
+from collections.abc import Awaitable, Callable, Sequence
+from concurrent.futures import Executor, ProcessPoolExecutor
+from typing import NamedTuple
+
+from .isa import Instruction, load_binary
+from .machine import ENGINES, DataPath
+from .ports import BufferOutputPort
+from .snapshot import Snapshot, restore_snapshot, take_snapshot
+
+SLICE = 10000  # instructions executed between the returns to the event loop
+POOL_SLICE = 1000000  # instructions of a slice executed by a worker process
+OFFLOAD_AFTER = 1000000  # instructions executed without waiting for the input before the session goes to the pool
+READ_SIZE = 4096
+
+# reasons a slice stops for, the last three end the session
+WAITING = 'waiting for the input'
+HALTED = 'halted'
+INPUT_IS_OVER = 'input is over'
+LIMIT = 'instruction limit'
+
+
+class InputPending(Exception):  # noqa: N818
+    """Raised by AsyncInputPort when its buffer is empty and the source is not over, the IN is retried after the wait.
+
+    IN raises before changing the state of the machine in every engine, so the session continues from it.
+    """
+
+
+class AsyncInputPort:
+    """Input port fed by an async source chunk by chunk, the chunks read from the source are kept until consumed.
+
+    As StringInputPort, new lines are replaced with chr(0) and one more chr(0) terminates the input,
+    when the source is over.
+    """
+
+    def __init__(self):
+        self.consumed = 0
+        self.closed = False  # the source is over
+        self._data = ''
+        self._pos = 0
+        self.terminated = False  # the terminating chr(0) has been read
+
+    def feed(self, data: str):
+        self._data = self._data[self._pos :] + data.replace('\n', chr(0))
+        self._pos = 0
+
+    def close(self):
+        self.closed = True
+
+    def pending(self) -> str:
+        # the data read from the source and not consumed yet
+        return self._data[self._pos :]
+
+    def read(self) -> str:
+        if self._pos == len(self._data):
+            if not self.closed:
+                raise InputPending
+            if self.terminated:
+                raise EOFError
+            self.terminated = True
+            self.consumed += 1
+            return chr(0)
+        self._pos += 1
+        self.consumed += 1
+        return self._data[self._pos - 1]
+
+    def skip(self, count: int):
+        for _ in range(count):
+            self.read()
+
+
+class SessionResult(NamedTuple):
+    status: str  # HALTED, INPUT_IS_OVER or LIMIT
+    instr: int
+    ticks: int
+
+
+def run_until(control_unit, instr_limit: int) -> str | None:
+    # the reason the machine stops for before the limit, None at the limit; StopIteration cannot leave a coroutine
+    try:
+        control_unit.run(instr_limit)
+    except InputPending:
+        return WAITING
+    except StopIteration:
+        return HALTED
+    except EOFError:
+        return INPUT_IS_OVER
+    return None
+
+
+def run_slice(instructions: Sequence[Instruction], memory: Sequence[int], engine: str, memory_capacity: int,
+              snapshot: bytes, input_data: str, input_closed: bool, input_terminated: bool,
+              instr_limit: int) -> tuple[bytes, str, str | None]:  # fmt: skip
+    """Slice of a session executed by a worker process: the snapshot of the state is continued with the input
+    not consumed before it and the state of the input port, the snapshot after the slice is returned with
+    the output and the reason of the stop.
+    The snapshots carry no output and count only the input consumed in the slice.
+    """
+    input_port = AsyncInputPort()
+    input_port.feed(input_data)
+    if input_closed:
+        input_port.close()
+    input_port.terminated = input_terminated
+    data_path = DataPath(memory, memory_capacity, input_port, output_port=BufferOutputPort())
+    control_unit = ENGINES[engine](instructions, data_path)
+    restore_snapshot(control_unit, Snapshot.from_bytes(snapshot))
+    stop = run_until(control_unit, instr_limit)
+    result = take_snapshot(control_unit, memory)._replace(output='')
+    return result.to_bytes(), data_path.output_port.getvalue(), stop
+
+
+class StreamingOutputPort:
+    """Output port retaining the output until the session sends it to the async sink, after every slice."""
+
+    def __init__(self):
+        self.buffer: list[str] = []
+
+    def write(self, data: str):
+        self.buffer.append(data)
+
+    def flush(self):
+        pass
+
+    def getvalue(self) -> str:
+        return ''
+
+    def take(self) -> str:
+        data, self.buffer = ''.join(self.buffer), []
+        return data
+
+
+class Session:
+    """Program run by slices of `slice_size` instructions, returning to the event loop between them.
+
+    IN with no input buffered awaits `read_input`, the next chunk of the input, '' when the input is over,
+    the output is awaited by `write_output` after every slice and before the waits for the input.
+    With an executor, a session executing `offload_after` instructions without waiting for the input goes
+    to its worker processes, which continue the snapshots of its state by `pool_slice` instructions.
+    """
+
+    def __init__(self, instructions: Sequence[Instruction], memory: Sequence[int],
+                 read_input: Callable[[], Awaitable[str]], write_output: Callable[[str], Awaitable[None]],
+                 engine: str = 'fast', memory_capacity: int = 1000, instr_limit: int = 60000,
+                 slice_size: int = SLICE, executor: Executor | None = None, offload_after: int = OFFLOAD_AFTER,
+                 pool_slice: int = POOL_SLICE):  # fmt: skip
+        assert engine in ENGINES, f'Unknown engine: {engine}'
+        assert slice_size > 0, 'Slice size must be positive'
+        self.instructions = instructions
+        self.memory = memory
+        self.read_input = read_input
+        self.write_output = write_output
+        self.engine = engine
+        self.memory_capacity = memory_capacity
+        self.instr_limit = instr_limit
+        self.slice_size = slice_size
+        self.executor = executor
+        self.offload_after = offload_after
+        self.pool_slice = pool_slice
+        self.input_port = AsyncInputPort()
+        self.output_port = StreamingOutputPort()
+        data_path = DataPath(memory, memory_capacity, self.input_port, output_port=self.output_port)
+        self.control_unit = ENGINES[engine](instructions, data_path)
+        self.offloaded = False  # the slices are executed by the executor
+        self._snapshot: Snapshot | None = None  # the state of the offloaded session
+        self._busy = 0  # instructions executed since the last wait for the input
+
+    @property
+    def instr_counter(self) -> int:
+        return self._snapshot.instr_counter if self.offloaded else self.control_unit.instr_counter
+
+    async def run(self) -> SessionResult:
+        status = LIMIT
+        while self.instr_counter < self.instr_limit:
+            start = self.instr_counter
+            stop = await self._execute(min(self.instr_limit, start + (self.pool_slice if self.offloaded else self.slice_size)))
+            self._busy += self.instr_counter - start
+            await self._flush()
+            if stop == WAITING:
+                await self._wait_input()
+                continue
+            if stop is not None:
+                status = stop
+                break
+            if self.executor is not None and not self.offloaded and self._busy >= self.offload_after:
+                self.offloaded, self._snapshot = True, take_snapshot(self.control_unit, self.memory)._replace(output='')
+                self.control_unit = None  # the state is the snapshot
+            await asyncio.sleep(0)
+        ticks = self._snapshot.tick if self.offloaded else self.control_unit.current_tick()
+        return SessionResult(status, self.instr_counter, ticks)
+
+    async def _execute(self, instr_limit: int) -> str | None:
+        if not self.offloaded:
+            return run_until(self.control_unit, instr_limit)
+        port, snapshot = self.input_port, self._snapshot._replace(input_consumed=0)
+        arguments = (self.instructions, self.memory, self.engine, self.memory_capacity, snapshot.to_bytes(),
+                     port.pending(), port.closed, port.terminated, instr_limit)  # fmt: skip
+        data, output, stop = await asyncio.get_running_loop().run_in_executor(self.executor, run_slice, *arguments)
+        self._snapshot = Snapshot.from_bytes(data)
+        port.skip(self._snapshot.input_consumed)
+        self.output_port.write(output)
+        return stop
+
+    async def _wait_input(self):
+        self._busy = 0
+        data = await self.read_input()
+        if data:
+            self.input_port.feed(data)
+        else:
+            self.input_port.close()
+
+    async def _flush(self):
+        if data := self.output_port.take():
+            await self.write_output(data)
+
+
+def stream_reader(reader: asyncio.StreamReader, size: int = READ_SIZE) -> Callable[[], Awaitable[str]]:
+    # chunks of the text read from the stream, the utf-8 symbols split between the chunks are decoded whole
+    decoder = codecs.getincrementaldecoder('utf-8')(errors='replace')
+
+    async def read() -> str:
+        while True:
+            data = await reader.read(size)
+            text = decoder.decode(data, final=not data)
+            if text or not data:
+                return text
+
+    return read
+
+
+def stream_writer(writer: asyncio.StreamWriter) -> Callable[[str], Awaitable[None]]:
+    async def write(data: str):
+        writer.write(data.encode())
+        await writer.drain()
+
+    return write
+
+
+async def serve(instructions: Sequence[Instruction], memory: Sequence[int], host: str = 'localhost', port: int = 0,
+                executor: Executor | None = None, **options) -> asyncio.Server:  # fmt: skip
+    # TCP server running a session of the program for every connection, its input and output are the connection's,
+    # the connection is closed when the session ends
+    async def handle(reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        try:
+            session = Session(instructions, memory, stream_reader(reader), stream_writer(writer), executor=executor, **options)
+            result = await session.run()
+            logging.info(f'session {writer.get_extra_info("peername")}: {result}')
+        except (AssertionError, ArithmeticError, IndexError, ValueError) as e:
+            logging.warning(f'session {writer.get_extra_info("peername")}: {e!r}')
+        except ConnectionError:
+            pass
+        finally:
+            writer.close()
+
+    return await asyncio.start_server(handle, host, port)
+
+
+async def run_stdio(instructions: Sequence[Instruction], memory: Sequence[int], **options) -> SessionResult:
+    # a session on the standard input and output, the input is read by lines
+    async def read() -> str:
+        return await asyncio.to_thread(sys.stdin.readline)
+
+    async def write(data: str):
+        sys.stdout.write(data)
+        await asyncio.to_thread(sys.stdout.flush)
+
+    return await Session(instructions, memory, read, write, **options).run()
+
+
+async def main(binary_file: str, host: str, port: int | None, workers: int, **options):
+    instructions, memory = load_binary(binary_file)
+    if port is None:
+        result = await run_stdio(instructions, memory, **options)
+        print(file=sys.stderr)
+        print(f'{result.status}, instr executed: {result.instr}, ticks: {result.ticks}', file=sys.stderr)
+        return
+    with ProcessPoolExecutor(workers) if workers else contextlib.nullcontext() as executor:
+        server = await serve(instructions, memory, host, port, executor, **options)
+        print(f'serving on {", ".join(str(socket.getsockname()) for socket in server.sockets)}', file=sys.stderr)
+        async with server:
+            await server.serve_forever()
+
+
+if __name__ == '__main__':
+    logging.basicConfig(level=logging.INFO)
+    parser = argparse.ArgumentParser(prog='service.py', description='Sessions of the program with the streaming input and output')
+    parser.add_argument('binary_file', help='file with the machine code')
+    parser.add_argument('--host', default='localhost')
+    parser.add_argument('--port', type=int, help='serve a session for every TCP connection, the standard streams if not given')
+    parser.add_argument('--engine', choices=ENGINES, default='fast')
+    parser.add_argument('--slice', dest='slice_size', type=int, default=SLICE, help='instructions between the event loop turns')
+    parser.add_argument('--instr-limit', type=int, default=60000)
+    parser.add_argument('-j', '--workers', type=int, default=0, help='worker processes for the busy sessions, none by default')
+    args = parser.parse_args()
+    options = {'engine': args.engine, 'slice_size': args.slice_size, 'instr_limit': args.instr_limit}
+    with contextlib.suppress(KeyboardInterrupt):
+        asyncio.run(main(args.binary_file, args.host, args.port, args.workers, **options))
@@ -0,0 +1,280 @@
+import argparse
+import json
+import operator
+import sys
+from collections.abc import Sequence
+
+import numpy as np
+
+from .cache import SimulationResult
+from .fast import ALU_OPERATIONS, WORD_MAX, WORD_MIN
+from .isa import JUMP_INSTRUCTIONS, AddressingMode, Instruction, Opcode, basic_block_leaders, instruction_ticks, load_binary
+
+STOPPED = np.iinfo(np.int64).max  # scheduled instruction pointer of the lanes that have stopped
+MAX_SYMBOL = sys.maxunicode
+
+JUMP_CONDITIONS = {
+    Opcode.JMP: None,
+    Opcode.JE: np.equal,
+    Opcode.JNE: np.not_equal,
+    Opcode.JL: np.less,
+    Opcode.JG: np.greater,
+}
+
+
+def _exception(operation, *args) -> Exception | None:
+    # the exception the scalar engines raise on the arguments of the lane
+    try:
+        operation(*args)
+    except Exception as e:
+        return e
+    return None
+
+
+class _Group:
+    """Lanes executing a basic block together and their registers, the instructions and ticks of the block
+    executed so far are accounted to the lanes when they leave the group."""
+
+    __slots__ = ('acc', 'address_reg', 'alu_output', 'instr', 'lanes', 'left', 'reach', 'ticks')
+
+    def __init__(self, machine: 'SIMTMachine', lanes: np.ndarray):
+        self.lanes = lanes
+        self.acc = machine.acc[lanes]
+        self.alu_output = machine.alu_output[lanes]
+        self.address_reg = machine.address_reg[lanes]  # an array, or an int for all the lanes
+        self.left = machine.instr_limit - machine.instr_counter[lanes]  # instructions to the limit
+        self.reach = int(self.left.min(initial=STOPPED))  # instructions of the block before a lane is at the limit
+        self.instr = 0
+        self.ticks = 0
+
+    def select(self, mask: np.ndarray) -> '_Group':
+        group = object.__new__(_Group)
+        group.lanes, group.acc, group.alu_output = self.lanes[mask], self.acc[mask], self.alu_output[mask]
+        group.address_reg = self.address_reg[mask] if np.ndim(self.address_reg) else self.address_reg
+        group.left = self.left[mask]
+        group.reach = int(group.left.min(initial=STOPPED))
+        group.instr, group.ticks = self.instr, self.ticks
+        return group
+
+
+class SIMTMachine:
+    """One program executed over many inputs at once, each input in its own lane of NumPy arrays: the registers,
+    the instruction and tick counters and a row of the memory matrix.
+
+    The lanes at the lowest instruction pointer execute its basic block together, every instruction is one
+    vectorized operation over them. The lanes diverging at a jump are grouped by their instruction pointers
+    and reconverge at the start of a basic block, the lanes that have stopped are masked out.
+    The output, the instruction and tick counts of every lane are the same as `simulation` gives for its input,
+    the lanes stopped by an error have the exception `simulation` raises instead.
+    """
+
+    def __init__(self, instructions: Sequence[Instruction], memory: Sequence[int], inputs: Sequence[str],
+                 memory_capacity: int = 1000, instr_limit: int = 60000):  # fmt: skip
+        assert 0 <= memory_capacity <= 2**31, 'Data memory can consist of a maximum of 2^31 cells'
+        assert len(memory) < memory_capacity, 'Memory capacity exceeded'
+        self.instructions = instructions
+        self.code = [(instr.opcode, instr.argument, instr.addressing_mode, instruction_ticks(instr)) for instr in instructions]
+        self.leaders = basic_block_leaders(instructions)
+        self.memory_capacity = memory_capacity
+        self.instr_limit = instr_limit
+        self.lanes = len(inputs)
+
+        self.memory = np.zeros((self.lanes, memory_capacity), dtype=np.int64)
+        self.memory[:, : len(memory)] = np.asarray(memory, dtype=np.int64)
+        self.acc = np.zeros(self.lanes, dtype=np.int64)
+        self.alu_output = np.zeros(self.lanes, dtype=np.int64)
+        self.address_reg = np.zeros(self.lanes, dtype=np.int64)
+        self.instr_pointer = np.zeros(self.lanes, dtype=np.int64)
+        self.instr_counter = np.zeros(self.lanes, dtype=np.int64)
+        self.ticks = np.zeros(self.lanes, dtype=np.int64)
+        self._scheduled = np.zeros(self.lanes, dtype=np.int64)  # instruction pointers of the lanes, STOPPED if stopped
+
+        # the inputs as by StringInputPort: symbol codes, new lines replaced with 0 and one more 0 terminating them
+        data = [text.replace('\n', chr(0)) + chr(0) for text in inputs]
+        self.input_length = np.array([len(text) for text in data], dtype=np.int64)
+        self.input = np.zeros((self.lanes, max(self.input_length, default=0)), dtype=np.int64)
+        for lane, text in enumerate(data):
+            self.input[lane, : len(text)] = np.frombuffer(text.encode('utf-32-le', 'surrogatepass'), dtype='<u4')
+        self.input_consumed = np.zeros(self.lanes, dtype=np.int64)
+        self.input_is_over = np.zeros(self.lanes, dtype=bool)
+        self.errors: dict[int, Exception] = {}  # lane: the exception that stopped it
+        self._output: list[tuple[np.ndarray, np.ndarray, bool]] = []  # (lanes, values, is_number) of every OUT
+
+    def run(self) -> list[SimulationResult | Exception]:
+        while (instr_pointer := int(self._scheduled.min(initial=STOPPED))) != STOPPED:
+            self._execute_block(_Group(self, np.flatnonzero(self._scheduled == instr_pointer)), instr_pointer)
+        return self.results()
+
+    def _leave(self, group: _Group, mask: np.ndarray | None, instr_pointer, stop: bool = False,
+               error: Exception | list[Exception] | None = None) -> _Group:  # fmt: skip
+        # the lanes of the mask (all by default) leave the group at `instr_pointer`, the instructions and registers
+        # are accounted to them; they stop there if `stop` or with `error`, one for all of them or one per lane;
+        # the rest of the group is returned
+        leaving = group if mask is None else group.select(mask)
+        lanes = leaving.lanes
+        self.acc[lanes], self.alu_output[lanes], self.address_reg[lanes] = leaving.acc, leaving.alu_output, leaving.address_reg
+        self.instr_counter[lanes] += leaving.instr
+        self.ticks[lanes] += leaving.ticks
+        self.instr_pointer[lanes] = instr_pointer
+        self._scheduled[lanes] = STOPPED if stop or error is not None else instr_pointer
+        if isinstance(error, Exception):
+            error = [type(error)(*error.args) for _ in range(len(lanes))]
+        for lane, lane_error in zip(lanes.tolist(), error or ()):
+            self.errors[lane] = lane_error
+        return group.select(np.zeros(len(group.lanes), dtype=bool) if mask is None else ~mask)
+
+    def _execute_block(self, group: _Group, instr_pointer: int):
+        size = len(self.instructions)
+        while True:
+            if group.instr == group.reach:
+                group = self._leave(group, group.left == group.instr, instr_pointer, stop=True)
+                if not len(group.lanes):
+                    return
+            if not -size <= instr_pointer < size:
+                self._leave(group, None, instr_pointer, error=_exception(operator.getitem, self.instructions, instr_pointer))
+                return
+            opcode, arg, mode, cost = self.code[instr_pointer]
+            if opcode is Opcode.HLT:
+                self._leave(group, None, instr_pointer, stop=True)
+                return
+            if opcode in JUMP_INSTRUCTIONS:
+                group.instr, group.ticks = group.instr + 1, group.ticks + cost
+                condition = JUMP_CONDITIONS[opcode]
+                target = arg if condition is None else np.where(condition(group.alu_output, 0), arg, instr_pointer + 1)
+                self._leave(group, None, target)
+                return
+
+            group = self._execute(group, opcode, arg, mode, instr_pointer)
+            if not len(group.lanes):
+                return
+            group.instr, group.ticks = group.instr + 1, group.ticks + cost
+            instr_pointer += 1
+            if instr_pointer in self.leaders:
+                self._leave(group, None, instr_pointer)
+                return
+
+    def _execute(self, group: _Group, opcode: Opcode, arg: int, mode: AddressingMode, instr_pointer: int) -> _Group:  # noqa: C901
+        # execute the instruction on the lanes of the group, the lanes stopped by it leave the group
+        if opcode is Opcode.IN:
+            consumed = self.input_consumed[group.lanes]
+            over = consumed >= self.input_length[group.lanes]
+            if over.any():
+                self.input_is_over[group.lanes[over]] = True
+                group, consumed = self._leave(group, over, instr_pointer, stop=True), consumed[~over]
+            group.acc = group.alu_output = self.input[group.lanes, consumed]
+            self.input_consumed[group.lanes] = consumed + 1
+            return group
+        if opcode is Opcode.OUT or opcode is Opcode.OUTN:
+            if opcode is Opcode.OUT and len(group.lanes) and (group.acc.min() < 0 or group.acc.max() > MAX_SYMBOL):
+                invalid = (group.acc < 0) | (group.acc > MAX_SYMBOL)
+                errors = [_exception(chr, value) for value in group.acc[invalid].tolist()]
+                group = self._leave(group, invalid, instr_pointer, error=errors)
+            self._output.append((group.lanes, group.acc, opcode is Opcode.OUTN))
+            return group
+
+        if opcode is Opcode.LD and mode is AddressingMode.IMMEDIATE:
+            if not WORD_MIN <= arg <= WORD_MAX:
+                return self._leave(group, None, instr_pointer, error=AssertionError(f'Integer overflow: {arg}'))
+            group.acc = group.alu_output = np.full(len(group.lanes), arg, dtype=np.int64)
+            return group
+        if opcode is not Opcode.LD and opcode is not Opcode.ST and mode is AddressingMode.IMMEDIATE:
+            return self._alu(group, opcode, np.int64(arg), instr_pointer)
+
+        group.address_reg = addr = arg
+        if not 0 <= arg < self.memory_capacity:
+            return self._leave(group, None, instr_pointer, error=AssertionError(f'Out of memory: {arg}'))
+        if mode is AddressingMode.INDIRECT and (opcode is Opcode.LD or opcode is Opcode.ST):
+            group.address_reg = addr = self.memory[group.lanes, arg]
+            if len(addr) and (addr.min() < 0 or addr.max() >= self.memory_capacity):
+                invalid = (addr < 0) | (addr >= self.memory_capacity)
+                errors = [AssertionError(f'Out of memory: {value}') for value in addr[invalid].tolist()]
+                group, addr = self._leave(group, invalid, instr_pointer, error=errors), addr[~invalid]
+        if opcode is Opcode.ST:
+            self.memory[group.lanes, addr] = group.alu_output = group.acc
+        elif opcode is Opcode.LD:
+            group.acc = group.alu_output = self.memory[group.lanes, addr]
+        else:
+            group = self._alu(group, opcode, self.memory[group.lanes, addr], instr_pointer)
+        return group
+
+    def _alu(self, group: _Group, opcode: Opcode, right, instr_pointer: int) -> _Group:
+        operation = ALU_OPERATIONS.get(opcode, operator.sub)  # CMP subtracts
+        if opcode is Opcode.DIV or opcode is Opcode.MOD:
+            zero = np.broadcast_to(right == 0, group.lanes.shape)
+            if zero.any():
+                group = self._leave(group, zero, instr_pointer, error=_exception(operation, 1, 0))
+                right = right if np.ndim(right) == 0 else right[~zero]
+        result = operation(group.acc, right)
+        if len(result) and (result.min() < WORD_MIN or result.max() > WORD_MAX):
+            invalid = (result < WORD_MIN) | (result > WORD_MAX)
+            errors = [AssertionError(f'Integer overflow: {value}') for value in result[invalid].tolist()]
+            group, result = self._leave(group, invalid, instr_pointer, error=errors), result[~invalid]
+        group.alu_output = result
+        if opcode is not Opcode.CMP:
+            group.acc = result
+        return group
+
+    def outputs(self) -> list[str]:
+        # the output of every lane, the values of OUT and OUTN ordered by the lanes, in the order of output
+        outputs = [''] * self.lanes
+        if not self._output:
+            return outputs
+        lanes = np.concatenate([lanes for lanes, _, _ in self._output])
+        values = np.concatenate([values for _, values, _ in self._output])
+        numbers = np.concatenate([np.full(len(lanes), is_number) for lanes, _, is_number in self._output])
+        order = np.argsort(lanes, kind='stable')
+        lanes, values, numbers = lanes[order], values[order].tolist(), numbers[order]
+        bounds = np.searchsorted(lanes, np.arange(self.lanes + 1)).tolist()
+        for lane, (start, end) in enumerate(zip(bounds, bounds[1:])):
+            if numbers[start:end].any():
+                flags = numbers[start:end].tolist()
+                outputs[lane] = ''.join(
+                    str(value) if is_number else chr(value) for value, is_number in zip(values[start:end], flags)
+                )
+            else:
+                outputs[lane] = ''.join(map(chr, values[start:end]))
+        return outputs
+
+    def results(self) -> list[SimulationResult | Exception]:
+        outputs, instr, ticks, input_is_over = (
+            self.outputs(),
+            self.instr_counter.tolist(),
+            self.ticks.tolist(),
+            self.input_is_over,
+        )
+        return [
+            self.errors[lane]
+            if lane in self.errors
+            else SimulationResult(outputs[lane], instr[lane], ticks[lane], bool(input_is_over[lane]))
+            for lane in range(self.lanes)
+        ]
+
+
+def simt_simulation(instructions: Sequence[Instruction], memory: Sequence[int], inputs: Sequence[str],
+                    memory_capacity: int = 1000, instr_limit: int = 60000) -> list[SimulationResult | Exception]:  # fmt: skip
+    # the result of `simulation` for every input, or the exception it raises
+    return SIMTMachine(instructions, memory, inputs, memory_capacity, instr_limit).run()
+
+
+def main(binary_file: str, input_files: list[str], memory_capacity: int = 1000, instr_limit: int = 60000):
+    instructions, memory = load_binary(binary_file)
+    inputs = []
+    for input_file in input_files:
+        with open(input_file, encoding='utf-8') as f:
+            inputs.append(f.read())
+    for input_file, result in zip(input_files, simt_simulation(instructions, memory, inputs, memory_capacity, instr_limit)):
+        if isinstance(result, Exception):
+            report = {'input': input_file, 'output': None, 'instr': None, 'ticks': None, 'error': repr(result)}
+        else:
+            report = {'input': input_file, 'output': result.output, 'instr': result.instr, 'ticks': result.ticks, 'error': None}
+        print(json.dumps(report, ensure_ascii=False), flush=True)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(prog='simt.py', description='Run the program over many inputs in lockstep')
+    parser.add_argument('binary_file', help='file with the machine code')
+    parser.add_argument('input_files', nargs='+', help='files with the input data, a lane for each')
+    parser.add_argument('--memory-capacity', type=int, default=1000)
+    parser.add_argument('--instr-limit', type=int, default=60000)
+    args = parser.parse_args()
+    main(args.binary_file, args.input_files, args.memory_capacity, args.instr_limit)
@@ -0,0 +1,101 @@
+import struct
+import sys
+import zlib
+from array import array
+from collections.abc import Callable, Sequence
+from typing import NamedTuple
+
+from .memory import dirty_pages, write_pages
+
+MAGIC = b'CSA3'
+HEADER = struct.Struct('>4s8qQI')  # magic, registers and counters, output size, number of pages
+PAGE_HEADER = struct.Struct('>II')  # page number, number of cells
+
+
+class Snapshot(NamedTuple):
+    """State of the machine between two instructions.
+
+    The data memory is stored as the pages that differ from the initial image, so a snapshot is restored
+    onto a machine created for the same program and memory image.
+    """
+
+    instr_pointer: int
+    instr_counter: int
+    tick: int
+    acc: int
+    alu_output: int  # source of the flags
+    address_reg: int
+    memory_output: int
+    input_consumed: int  # symbols read from the input port
+    output: str  # output retained by the output port
+    pages: dict[int, array]  # page number: cells
+
+    def to_bytes(self) -> bytes:
+        # compressed big-endian image of the snapshot
+        output = self.output.encode()
+        parts = [HEADER.pack(MAGIC, *self[:8], len(output), len(self.pages)), output]
+        for number, cells in sorted(self.pages.items()):
+            cells = array('i', cells)
+            if sys.byteorder == 'little':
+                cells.byteswap()
+            parts += [PAGE_HEADER.pack(number, len(cells)), cells.tobytes()]
+        return zlib.compress(b''.join(parts))
+
+    @classmethod
+    def from_bytes(cls, data: bytes) -> 'Snapshot':
+        data = zlib.decompress(data)
+        magic, *registers, output_size, page_count = HEADER.unpack_from(data)
+        assert magic == MAGIC, 'The snapshot is invalid'
+        offset = HEADER.size + output_size
+        output = data[HEADER.size : offset].decode()
+        pages = {}
+        for _ in range(page_count):
+            number, size = PAGE_HEADER.unpack_from(data, offset)
+            offset += PAGE_HEADER.size
+            cells = pages[number] = array('i', data[offset : offset + size * 4])
+            if sys.byteorder == 'little':
+                cells.byteswap()
+            offset += size * 4
+        return cls(*registers, output, pages)
+
+
+def take_snapshot(control_unit, image: Sequence[int]) -> Snapshot:
+    # `image` is the initial data memory of the program
+    data_path = control_unit.data_path
+    return Snapshot(
+        control_unit.instr_pointer,
+        control_unit.instr_counter,
+        control_unit.current_tick(),
+        data_path.acc,
+        data_path.alu_output,
+        data_path.address_reg,
+        data_path.memory_output,
+        data_path.input_port.consumed,
+        data_path.output_port.getvalue(),
+        dirty_pages(data_path.memory, image),
+    )
+
+
+def restore_snapshot(control_unit, snapshot: Snapshot):
+    # continue the snapshot on a new control unit of any engine, the input symbols consumed before
+    # the snapshot are skipped and its output is written to the output port first
+    data_path = control_unit.data_path
+    write_pages(data_path.memory, snapshot.pages)
+    data_path.acc, data_path.alu_output = snapshot.acc, snapshot.alu_output
+    data_path.address_reg, data_path.memory_output = snapshot.address_reg, snapshot.memory_output
+    data_path.input_port.skip(snapshot.input_consumed)
+    data_path.output_port.write(snapshot.output)
+    if data_path.tracer is not None:
+        data_path.tracer.output_size = len(snapshot.output)
+    control_unit.instr_pointer, control_unit.instr_counter = snapshot.instr_pointer, snapshot.instr_counter
+    control_unit.set_tick(snapshot.tick)
+
+
+def run_with_checkpoints(control_unit, run: Callable[[int], None], instr_limit: int, image: Sequence[int],
+                         checkpoint_every: int, on_checkpoint: Callable[[Snapshot], None]):  # fmt: skip
+    # run the control unit by slices ending at the multiples of `checkpoint_every` executed instructions
+    # and at the instruction limit, the snapshot after every slice is passed to `on_checkpoint`
+    assert checkpoint_every > 0, 'Checkpoint interval must be positive'
+    while control_unit.instr_counter < instr_limit:
+        run(min(instr_limit, (control_unit.instr_counter // checkpoint_every + 1) * checkpoint_every))
+        on_checkpoint(take_snapshot(control_unit, image))
@@ -0,0 +1,92 @@
+import heapq
+from collections import deque
+from collections.abc import Iterator, Sequence
+
+from .isa import Instruction
+
+TRACE_WINDOW = 500  # executed instructions whose states are recorded
+TRACE_CAPACITY = 2**16  # input and output events kept by the ring buffer
+
+# kinds of the trace events, every event starts with its number in the trace: (number, kind, *values)
+STATE = 0  # (number, STATE, tick, instr_pointer, address_reg, memory_output, alu_output, acc)
+INPUT = 1  # (number, INPUT, symbol)
+OUTPUT = 2  # (number, OUTPUT, output_size, output), output_size - number of symbols written before
+WINDOW_END = 3  # (number, WINDOW_END)
+DROPPED = 4  # only reported by `messages`, the number of events pushed out of the ring buffer
+
+
+class Tracer:
+    """Records the trace of the machine as raw tuples.
+
+    Nothing is formatted while the program runs, the messages are built by `messages` when the trace is dumped.
+    The states of the first `window` executed instructions are recorded (of all of them if `window` is None)
+    and all kept, input and output events are recorded all the time into a ring buffer of `capacity` events,
+    so a long run drops its oldest input and output, not the states of the window. Without a window the states
+    are kept by a ring buffer of `capacity` events too.
+    """
+
+    def __init__(self, instructions: Sequence[Instruction], window: int | None = TRACE_WINDOW,
+                 capacity: int = TRACE_CAPACITY):  # fmt: skip
+        self.instructions = instructions
+        self.window = window
+        self.states: deque[tuple] = deque(maxlen=capacity if window is None else None)  # STATE and WINDOW_END events
+        self.events: deque[tuple] = deque(maxlen=capacity)  # INPUT and OUTPUT events
+        self.recorded = 0  # events recorded, including the dropped ones
+        self.output_size = 0
+
+    def trace_instruction(self, control_unit, instr_counter: int):
+        # record the state after `instr_counter` executed instructions
+        if self.window is None or instr_counter < self.window:
+            data_path = control_unit.data_path
+            self.states.append((
+                self.recorded,
+                STATE,
+                control_unit.current_tick(),
+                control_unit.instr_pointer,
+                data_path.address_reg,
+                data_path.memory_output,
+                data_path.alu_output,
+                data_path.acc,
+            ))
+            self.recorded += 1
+        elif instr_counter == self.window:
+            self.states.append((self.recorded, WINDOW_END))
+            self.recorded += 1
+
+    def record_input(self, symbol: str):
+        self.events.append((self.recorded, INPUT, symbol))
+        self.recorded += 1
+
+    def record_output(self, output: str):
+        self.events.append((self.recorded, OUTPUT, self.output_size, output))
+        self.recorded += 1
+        self.output_size += len(output)
+
+    def messages(self, output: str = '') -> Iterator[tuple[int, str]]:
+        # yield (kind, message) of the recorded events, `output` is the output retained by the output port
+        dropped = self.recorded - len(self.states) - len(self.events)
+        if dropped:
+            yield DROPPED, f'{dropped} earlier trace events were dropped'
+        prefix = ''  # output before the current output event, taken from `output` part by part
+        for _, kind, *values in heapq.merge(self.states, self.events):
+            if kind == STATE:
+                tick, instr_pointer, address_reg, memory_output, alu_output, acc = values
+                instr = self.instructions[instr_pointer] if 0 <= instr_pointer < len(self.instructions) else ''
+                message = (
+                    f'TICK: {tick:5} '
+                    f'IP: {instr_pointer:5} '
+                    f'ADDR: {address_reg:5} '
+                    f'MEM_OUT: {memory_output:5} '
+                    f'ALU_OUT: {alu_output:5} '
+                    f'ACC: {acc:5} '
+                    f'{instr}'
+                )
+                yield kind, message
+            elif kind == INPUT:
+                yield kind, f'input: {values[0]!r}'
+            elif kind == OUTPUT:
+                output_size, symbols = values
+                prefix += output[len(prefix) : output_size]
+                yield kind, f'output: {prefix!r} << {symbols!r}'
+            else:
+                yield kind, f'To see more than {self.window} executed instructions, purchase the paid version of the program!'
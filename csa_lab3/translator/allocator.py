@@ -0,0 +1,61 @@
+from .syntax import Assignment, If, Input, Name, Position, Statement, String, While
+
+
+class StringCapacities:
+    """Capacity of every string variable, the longest string it can hold: the longest literal or string variable
+    assigned to it, or the maximum length if it is input. Variables are resolved by the scopes of the blocks,
+    as the translator does, and identified by the position of the assignment declaring them.
+
+    The capacities of the variables assigned to each other grow together, so they are computed as a fixed point,
+    which takes at most the maximum length of rounds.
+    """
+
+    def __init__(self, max_length: int):
+        self.max_length = max_length
+        self.scopes: list[dict[str, tuple[type, Position]]] = [{}]  # name: (type, declaration) of every open block
+        self.sources: list[tuple[Position, int | Position]] = []  # (declaration, length or declaration assigned to it)
+
+    def _find(self, name: str) -> tuple[type, Position] | None:
+        return next((scope[name] for scope in reversed(self.scopes) if name in scope), None)
+
+    def _visit(self, statements: list[Statement]):
+        for statement in statements:
+            if type(statement) is Assignment:
+                self._visit_assignment(statement)
+            elif type(statement) is Input and (var := self._find(statement.name)) is not None:
+                self.sources.append((var[1], self.max_length))
+            elif type(statement) in (If, While):
+                self.scopes.append({})
+                self._visit(statement.body)
+                self.scopes.pop()
+
+    def _visit_assignment(self, statement: Assignment):
+        value, source = statement.value, None
+        if type(value) is String:
+            var_type, source = str, len(value.value)
+        elif type(value) is Name and (value_var := self._find(value.name)) is not None:
+            var_type, source = value_var[0], value_var[1] if value_var[0] is str else None
+        else:
+            var_type = int
+        var = self._find(statement.name)
+        if var is None:
+            var = self.scopes[-1][statement.name] = (var_type, statement.pos)
+        if var[0] is str and source is not None:
+            self.sources.append((var[1], source))
+
+    def compute(self, statements: list[Statement]) -> dict[Position, int]:
+        self._visit(statements)
+        capacities = {declaration: 0 for declaration, _ in self.sources}
+        changed = True
+        while changed:
+            changed = False
+            for declaration, source in self.sources:
+                length = source if type(source) is int else capacities.get(source, 0)
+                if length > capacities[declaration]:
+                    capacities[declaration], changed = length, True
+        return capacities
+
+
+def string_capacities(statements: list[Statement], max_length: int) -> dict[Position, int]:
+    # declaration of the string variable: its capacity
+    return StringCapacities(max_length).compute(statements)
@@ -0,0 +1,96 @@
+import argparse
+import contextlib
+import json
+import multiprocessing
+import sys
+from collections.abc import Iterable, Iterator
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from typing import NamedTuple
+
+from .cache import DEFAULT_MAX_SIZE, TranslationCache
+from .translator import translate_file, write_artifacts
+
+DEFAULT_CACHE_DIR = '.translator-cache'
+
+
+class Job(NamedTuple):
+    source_file: str
+    target_file: str
+    target_debug_file: str
+    source_map_file: str | None = None
+
+
+def translate_job(job: Job, opt_level: int, cache: TranslationCache) -> dict:
+    result = {'source': job.source_file, 'target': job.target_file}
+    try:
+        _, hit = translate_file(job.source_file, job.target_file, job.target_debug_file, opt_level, cache, job.source_map_file)
+        result.update(cached=hit, error=None)
+    except (AssertionError, RecursionError, OSError, UnicodeError) as e:  # a failed job does not stop the batch
+        result.update(cached=False, error=repr(e))
+    return result
+
+
+def _cached_job(job: Job, opt_level: int, cache: TranslationCache) -> dict | None:
+    # write the artifacts of the job if they are cached, None if the job has to be translated
+    try:
+        with open(job.source_file, encoding='utf-8') as f:
+            artifacts = cache.get(cache.key(f.read(), opt_level=opt_level))
+        if artifacts is None:
+            return None
+        write_artifacts(artifacts, job.target_file, job.target_debug_file, job.source_map_file)
+    except (OSError, UnicodeError):
+        return None  # the error is reported by the worker
+    return {'source': job.source_file, 'target': job.target_file, 'cached': True, 'error': None}
+
+
+def _translate_chunk(jobs: list[Job], opt_level: int, cache_dir: str, max_size: int) -> list[dict]:
+    cache = TranslationCache(cache_dir, max_size)
+    return [translate_job(job, opt_level, cache) for job in jobs]
+
+
+def run_batch(jobs: Iterable[Job], opt_level: int = 0, cache_dir: str = DEFAULT_CACHE_DIR, max_size: int = DEFAULT_MAX_SIZE,
+              workers: int | None = None, chunksize: int = 4) -> Iterator[dict]:  # fmt: skip
+    # translate the jobs writing through the cache, results are yielded in completion order
+    # cache hits are served by the current process, only the rest of the jobs are sent to a process pool
+    cache = TranslationCache(cache_dir, max_size)
+    misses = []
+    for job in map(Job._make, jobs):
+        if (result := _cached_job(job, opt_level, cache)) is not None:
+            yield result
+        else:
+            misses.append(job)
+    if not misses:
+        return
+
+    methods = multiprocessing.get_all_start_methods()
+    context = multiprocessing.get_context('fork' if 'fork' in methods else None)
+    with ProcessPoolExecutor(workers, context) as executor:
+        futures = [
+            executor.submit(_translate_chunk, misses[i : i + chunksize], opt_level, cache_dir, max_size)
+            for i in range(0, len(misses), chunksize)
+        ]
+        for future in as_completed(futures):
+            yield from future.result()
+
+
+def main(argv: list[str]):
+    parser = argparse.ArgumentParser(prog='batch.py', description='Translate many source files through the cache')
+    parser.add_argument(
+        'jobs_file',
+        help='file with a `<source_file> <target_file> <target_debug_file> [source_map_file]` per line, `-` for stdin',
+    )
+    parser.add_argument('-O', dest='opt_level', type=int, choices=(0, 1, 2), default=0, help='optimization level')
+    parser.add_argument('-j', '--workers', type=int, default=None, help='number of worker processes')
+    parser.add_argument('--chunksize', type=int, default=4, help='jobs sent to a worker at once')
+    parser.add_argument('--cache-dir', default=DEFAULT_CACHE_DIR)
+    parser.add_argument('--cache-size', type=int, default=DEFAULT_MAX_SIZE, help='cache size limit in bytes')
+    args = parser.parse_args(argv)
+
+    with open(args.jobs_file, encoding='utf-8') if args.jobs_file != '-' else contextlib.nullcontext(sys.stdin) as f:
+        jobs = [Job(*line.split()) for line in f if line.strip()]
+    for result in run_batch(jobs, args.opt_level, args.cache_dir, args.cache_size, args.workers, args.chunksize):
+        print(json.dumps(result, ensure_ascii=False), flush=True)
+
+
+if __name__ == '__main__':
+    main(sys.argv[1:])
@@ -0,0 +1,83 @@
+import functools
+import hashlib
+import os
+import struct
+from pathlib import Path
+from typing import NamedTuple
+
+from machine.cache import evict_least_recently_used, write_atomically
+
+HEADER = struct.Struct('>IIII')  # sizes of the binary, the debug listing, the summary and the source map
+DEFAULT_MAX_SIZE = 64 * 2**20  # bytes
+ENTRY_SUFFIX = '.entry'
+
+
+class Artifacts(NamedTuple):
+    binary: bytes
+    debug: str  # listing written to the debug file
+    summary: str  # statistics printed by the translator
+    source_map: str  # JSON of the source line map
+
+
+@functools.cache
+def translator_version() -> str:
+    # hash of the translator sources and of the binary format, any change of them invalidates the cache
+    digest = hashlib.sha256()
+    package_dir = Path(__file__).parent
+    for path in [*sorted(package_dir.glob('*.py')), package_dir.parent / 'machine' / 'isa.py']:
+        digest.update(path.name.encode())
+        digest.update(path.read_bytes())
+    return digest.hexdigest()
+
+
+class TranslationCache:
+    """Content-addressed on-disk cache of the translation artifacts.
+
+    An entry is keyed by the hash of the source code, the translator version and the options, and is stored
+    in a single file written by `write_atomically`, so several processes can share the directory. The modification
+    time of an entry is its last use: when the entries take more than `max_size` bytes,
+    `evict_least_recently_used` deletes the least recently used ones.
+    """
+
+    def __init__(self, directory: str | os.PathLike, max_size: int = DEFAULT_MAX_SIZE):
+        self.directory = Path(directory)
+        self.max_size = max_size
+        self.hits = 0
+        self.misses = 0
+        self.directory.mkdir(parents=True, exist_ok=True)
+
+    @staticmethod
+    def key(source_code: str, **options) -> str:
+        digest = hashlib.sha256(translator_version().encode())
+        digest.update(repr(sorted(options.items())).encode())
+        digest.update(source_code.encode('utf-8'))
+        return digest.hexdigest()
+
+    def _path(self, key: str) -> Path:
+        return self.directory / (key + ENTRY_SUFFIX)
+
+    def get(self, key: str) -> Artifacts | None:
+        path = self._path(key)
+        try:
+            data = path.read_bytes()
+            os.utime(path)
+        except OSError:
+            self.misses += 1
+            return None
+        sizes = HEADER.unpack_from(data) if len(data) >= HEADER.size else (len(data), 0, 0, 0)
+        if HEADER.size + sum(sizes) != len(data):  # truncated or foreign file
+            path.unlink(missing_ok=True)
+            self.misses += 1
+            return None
+        ends = [HEADER.size]
+        for size in sizes:
+            ends.append(ends[-1] + size)
+        self.hits += 1
+        binary, *texts = (data[start:end] for start, end in zip(ends, ends[1:]))
+        return Artifacts(binary, *(text.decode() for text in texts))
+
+    def put(self, key: str, artifacts: Artifacts):
+        texts = [text.encode() for text in artifacts[1:]]
+        header = HEADER.pack(len(artifacts.binary), *map(len, texts))
+        write_atomically(self._path(key), [header, artifacts.binary, *texts])
+        evict_least_recently_used(self.directory, ENTRY_SUFFIX, self.max_size)
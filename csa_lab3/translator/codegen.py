@@ -0,0 +1,115 @@
+from collections.abc import Mapping
+
+from machine.isa import AddressingMode, Instruction, Opcode
+
+from .syntax import BOOLEAN_OPERATORS, COMPARISON_OPERATORS, Binary, Expression, Name, Number, String, Unary, located
+
+BIN_OPCODES = {'+': Opcode.ADD, '-': Opcode.SUB, '*': Opcode.MUL, '/': Opcode.DIV, '%': Opcode.MOD}
+
+
+class AccumulatorCodegen:
+    """Generates the code which evaluates an expression tree into the accumulator.
+
+    Operands that need no evaluation (constants and variables) are used directly, as `ADD #c` or `CMP var`.
+    A right operand that has to be evaluated is computed first and spilled to a temporary cell, then the left
+    one is computed into the accumulator. The operands are evaluated in the same order as by the stack lowering,
+    so the program stops with the same error, if any.
+    """
+
+    def __init__(self, instructions: list[Instruction], variables: Mapping, temp_addr: int):
+        self.instructions = instructions
+        self.variables = variables  # name: variable with `addr`
+        self.temp_addr = temp_addr  # first free cell for the spilled operands
+
+    def _append(self, opcode: Opcode, argument: int = 0, mode: AddressingMode = AddressingMode.DIRECT):
+        self.instructions.append(Instruction(opcode, argument, mode))
+
+    @staticmethod
+    def _is_operand(node: Expression) -> bool:
+        return type(node) in (Number, String, Name)
+
+    def _operand(self, node: Expression) -> tuple[int, AddressingMode]:
+        if type(node) is Name:
+            var = self.variables.get(node.name)
+            assert var, located(f'Cannot find variable {node.name}', node.pos)
+            return var.addr, AddressingMode.DIRECT
+        if type(node) is String:
+            return len(node.value), AddressingMode.IMMEDIATE
+        assert -(2**31) <= node.value <= 2**31 - 1, located('Numbers must be between -2^31 and 2^31-1', node.pos)
+        return node.value, AddressingMode.IMMEDIATE
+
+    def emit(self, node: Expression):
+        if self._is_operand(node):
+            self._append(Opcode.LD, *self._operand(node))
+        elif type(node) is Unary:
+            self.emit(node.operand)
+            if node.op == '-':
+                self._append(Opcode.MUL, -1, AddressingMode.IMMEDIATE)
+            elif node.op == '!':
+                self._emit_boolean(Opcode.JE)
+        elif node.op in COMPARISON_OPERATORS:
+            self._emit_compare(node)
+        elif node.op in BOOLEAN_OPERATORS:
+            self._emit_bool_op(node)
+        else:
+            self._emit_operation(BIN_OPCODES[node.op], node.left, node.right)
+
+    def _emit_operation(self, opcode: Opcode, left: Expression, right: Expression):
+        # acc = left OP right
+        if self._is_operand(right):
+            self.emit(left)
+            self._append(opcode, *self._operand(right))
+        elif self._is_operand(left) and opcode in {Opcode.ADD, Opcode.MUL}:
+            self.emit(right)
+            self._append(opcode, *self._operand(left))
+        else:
+            self.emit(right)
+            right_operand = self._spill_acc()
+            self.emit(left)
+            self.temp_addr -= 1
+            self._append(opcode, *right_operand)
+
+    def _emit_compare(self, node: Binary):
+        self._emit_operation(Opcode.CMP, node.left, node.right)
+        op = node.op
+        if op in ('<', '<='):
+            self._append(Opcode.JL, len(self.instructions) + 3 + (op == '<='))
+        elif op in ('>', '>='):
+            self._append(Opcode.JG, len(self.instructions) + 3 + (op == '>='))
+        if op in ('==', '<=', '>='):
+            self._append(Opcode.JE, len(self.instructions) + 3)
+        elif op == '!=':
+            self._append(Opcode.JNE, len(self.instructions) + 3)
+        self._emit_boolean(None)
+
+    def _spill_acc(self) -> tuple[int, AddressingMode]:
+        # store the accumulator to a temporary cell, which stays reserved until `temp_addr` is decremented
+        self._append(Opcode.ST, self.temp_addr)
+        self.temp_addr += 1
+        return self.temp_addr - 1, AddressingMode.DIRECT
+
+    def _emit_boolean(self, jump_if_true: Opcode | None):
+        # acc = 1 if the jump (already emitted if None) is taken, else 0
+        if jump_if_true is not None:
+            self._append(jump_if_true, len(self.instructions) + 3)
+        self._append(Opcode.LD, 0, AddressingMode.IMMEDIATE)
+        self._append(Opcode.JMP, len(self.instructions) + 2)
+        self._append(Opcode.LD, 1, AddressingMode.IMMEDIATE)
+
+    def _emit_bool_op(self, node: Binary):
+        # both operands are evaluated (there are no short circuits), left to right, the result is 0 or 1
+        jump = Opcode.JE if node.op == '&&' else Opcode.JNE  # jumps if the value decides the result
+        if self._is_operand(node.left):
+            self.emit(node.right)
+            left = self._operand(node.left)
+        else:
+            self.emit(node.left)
+            left = self._spill_acc()
+            self.emit(node.right)
+            self.temp_addr -= 1
+        self._append(jump, len(self.instructions) + 5)
+        self._append(Opcode.LD, *left)
+        self._append(jump, len(self.instructions) + 3)
+        self._append(Opcode.LD, int(node.op == '&&'), AddressingMode.IMMEDIATE)
+        self._append(Opcode.JMP, len(self.instructions) + 2)
+        self._append(Opcode.LD, int(node.op == '||'), AddressingMode.IMMEDIATE)
@@ -0,0 +1,323 @@
+import itertools
+from collections.abc import Callable, Iterator
+
+from machine.isa import AddressingMode, Instruction, Opcode, instruction_ticks
+
+from .optimizer import fold_operation
+from .simplifier import simplify
+from .syntax import (
+    BOOLEAN_OPERATORS,
+    Assignment,
+    Binary,
+    Expression,
+    If,
+    Input,
+    Name,
+    Number,
+    Output,
+    Statement,
+    String,
+    Unary,
+    While,
+)
+
+HIDDEN_PREFIX = '$'  # names of the variables added by the pass, no name of the source code starts with it
+MIRRORED_COMPARISONS = {'<': '>', '<=': '>=', '>': '<', '>=': '<='}
+
+# a reduced multiplication `LD i; MUL #c` becomes `LD var`, and `LD var; ADD #c; ST var` updates the variable
+MUL_TICKS = instruction_ticks(Instruction(Opcode.MUL, 0, AddressingMode.IMMEDIATE))
+UPDATE_TICKS = sum(
+    instruction_ticks(instr)
+    for instr in (Instruction(Opcode.LD, 0), Instruction(Opcode.ADD, 0, AddressingMode.IMMEDIATE), Instruction(Opcode.ST, 0))
+)
+
+
+def evaluation_order(node: Expression) -> Iterator[Expression]:
+    # the nodes in the order the codegens evaluate them: the right operand of an arithmetic operation
+    # or a comparison goes first, the operands of `&&` and `||` go left to right, there are no short circuits
+    if type(node) is Unary:
+        yield from evaluation_order(node.operand)
+    elif type(node) is Binary and node.op in BOOLEAN_OPERATORS:
+        yield from evaluation_order(node.left)
+        yield from evaluation_order(node.right)
+    elif type(node) is Binary:
+        yield from evaluation_order(node.right)
+        yield from evaluation_order(node.left)
+    yield node
+
+
+def expression_key(node: Expression) -> tuple:
+    # the expression without the positions, the same for the same computations
+    if type(node) is Unary:
+        return node.op, expression_key(node.operand)
+    if type(node) is Binary:
+        return node.op, expression_key(node.left), expression_key(node.right)
+    return type(node).__name__, node[0]
+
+
+def is_safe_operation(node: Expression) -> bool:
+    # the node itself cannot stop the machine with an error, its operands computed
+    if type(node) is Number:
+        return -(2**31) <= node.value <= 2**31 - 1
+    if type(node) is Unary:
+        return node.op in ('+', '!')
+    if type(node) is Binary:
+        return node.op in BOOLEAN_OPERATORS
+    return True
+
+
+def is_safe(node: Expression) -> bool:
+    return all(is_safe_operation(child) for child in evaluation_order(node))
+
+
+def replace(node: Expression, function: Callable[[Expression], Expression]) -> Expression:
+    # apply the function to the nodes from the leaves up
+    if type(node) is Unary:
+        node = node._replace(operand=replace(node.operand, function))
+    elif type(node) is Binary:
+        node = node._replace(left=replace(node.left, function), right=replace(node.right, function))
+    return function(node)
+
+
+def replace_in_statements(statements: list[Statement], function: Callable[[Expression], Expression]) -> list[Statement]:
+    result = []
+    for statement in statements:
+        if type(statement) in (Assignment, Output) and type(statement.value) in (Unary, Binary):
+            statement = statement._replace(value=replace(statement.value, function))
+        elif type(statement) in (If, While):
+            statement = statement._replace(
+                condition=replace(statement.condition, function), body=replace_in_statements(statement.body, function)
+            )
+        result.append(statement)
+    return result
+
+
+def assigned_names(statements: list[Statement]) -> list[str]:
+    # names assigned or input in the statements and their blocks, once per statement
+    result = []
+    for statement in statements:
+        if type(statement) in (Assignment, Input):
+            result.append(statement.name)
+        elif type(statement) in (If, While):
+            result += assigned_names(statement.body)
+    return result
+
+
+class InvariantCodeMotion:
+    """Replaces the invariant subexpressions of a loop by the variables computed before the loop.
+
+    An expression is invariant if its variables are declared before the loop and not assigned in it. It is
+    computed before the loop if its evaluation cannot fail, or if it is evaluated on every iteration before
+    any output and anything that may fail or stop the program, so the program prints the same and stops with
+    the same error, if any. The latter
+    are computed only if the loop condition holds, which `needs_guard` tells.
+    """
+
+    def __init__(self, invariants: set[str], new_variable: Callable[[], str]):
+        self.invariants = invariants
+        self.new_variable = new_variable
+        self.variables: dict[tuple, str] = {}  # expression key: variable with its value
+        self.computations: list[Assignment] = []  # assignments of the variables, in the order of the evaluation
+        self.needs_guard = False
+        self.failing = False  # something evaluated before in the iteration may fail or stop the program
+        self.conditional = 0  # depth of the blocks the evaluation is in
+
+    def is_invariant(self, node: Expression) -> bool:
+        if type(node) not in (Unary, Binary):
+            return False
+        nodes = list(evaluation_order(node))
+        names = {child.name for child in nodes if type(child) is Name}
+        numbers_fit = all(is_safe_operation(child) for child in nodes if type(child) is Number)
+        return bool(names) and names <= self.invariants and numbers_fit
+
+    def rewrite(self, node: Expression) -> Expression:
+        # the subexpressions are visited in the order of the evaluation
+        if self.is_invariant(node):
+            key = expression_key(node)
+            if key not in self.variables and (is_safe(node) or not (self.failing or self.conditional)):
+                self.variables[key] = self.new_variable()
+                self.computations.append(Assignment(self.variables[key], node, node.pos))
+                self.needs_guard |= not is_safe(node)
+            if key in self.variables:
+                return Name(self.variables[key], node.pos)
+        if type(node) is Unary:
+            node = node._replace(operand=self.rewrite(node.operand))
+        elif type(node) is Binary and node.op in BOOLEAN_OPERATORS:
+            left = self.rewrite(node.left)
+            node = node._replace(left=left, right=self.rewrite(node.right))
+        elif type(node) is Binary:
+            right = self.rewrite(node.right)
+            node = node._replace(left=self.rewrite(node.left), right=right)
+        self.failing |= not is_safe_operation(node)
+        return node
+
+    def rewrite_statements(self, statements: list[Statement]) -> list[Statement]:
+        result = []
+        for statement in statements:
+            if type(statement) in (Assignment, Output) and type(statement.value) in (Unary, Binary):
+                statement = statement._replace(value=self.rewrite(statement.value))
+            if type(statement) is Output:
+                self.failing = True  # the output is printed before a later error
+            elif type(statement) is Input:
+                self.failing = True  # the input may be over
+            elif type(statement) in (If, While):
+                condition = self.rewrite(statement.condition)
+                self.conditional += 1
+                statement = statement._replace(condition=condition, body=self.rewrite_statements(statement.body))
+                self.conditional -= 1
+                self.failing |= type(statement) is While  # the loop may not end
+            result.append(statement)
+        return result
+
+
+class LoopOptimizer:
+    """Moves the invariant expressions out of the `while` loops and reduces the multiplications of the induction
+    variables to additions, the inner loops first.
+
+    The loop condition then compares with the variables computed before the loop. A multiplication `i * c` is
+    reduced if the only assignment of `i` in the loop is `i = i + k` in its body, the condition compares `i`
+    with a constant, `i` is assigned a constant right before the loop, none of the values of `i` and `i * c`
+    overflows, and the reduced multiplications save more ticks than the update of the variable takes.
+    The output and the error of the program stay the same.
+    """
+
+    def __init__(self):
+        self.counter = itertools.count(1)
+        self.hoisted = 0  # expressions computed before the loops
+        self.reduced = 0  # multiplications replaced by the additions
+
+    def new_variable(self) -> str:
+        return f'{HIDDEN_PREFIX}{next(self.counter)}'
+
+    @staticmethod
+    def _simplify(statement: Statement) -> Statement:
+        # a value simplified to a variable is kept, the translator would take a string variable for a string
+        if type(statement) in (Assignment, Output) and type(statement.value) in (Unary, Binary):
+            value = simplify(statement.value)
+            return statement if type(value) is Name else statement._replace(value=value)
+        if type(statement) in (If, While) and type(statement.condition) in (Unary, Binary):
+            return statement._replace(condition=simplify(statement.condition))
+        return statement
+
+    def optimize(self, statements: list[Statement], variables: dict[str, type] | None = None) -> list[Statement]:
+        # variables: types of the variables declared before the statements
+        variables = {} if variables is None else dict(variables)
+        result, previous = [], None
+        for statement in map(self._simplify, statements):
+            if type(statement) is Assignment and statement.name not in variables:
+                value = statement.value
+                variables[statement.name] = (
+                    str if type(value) is String else variables.get(value.name) if type(value) is Name else int
+                )
+            if type(statement) is If:
+                result.append(statement._replace(body=self.optimize(statement.body, variables)))
+            elif type(statement) is While:
+                loop = statement._replace(body=self.optimize(statement.body, variables))
+                loop_statements = self.optimize_loop(loop, variables, previous)
+                variables.update((name, int) for name in assigned_names(loop_statements[:-1]))
+                result += loop_statements
+            else:
+                result.append(statement)
+            previous = statement
+        return result
+
+    def optimize_loop(self, loop: While, variables: dict[str, type], previous: Statement | None) -> list[Statement]:
+        reductions, loop = self.reduce_strength(loop, variables, previous)
+        motion = InvariantCodeMotion(set(variables) - set(assigned_names(loop.body)), self.new_variable)
+        condition = motion.rewrite(loop.condition)
+        preheader = motion.computations[:]  # the condition is evaluated before any iteration
+        motion.failing = False  # the guard evaluates the condition before the body
+        loop = loop._replace(condition=condition, body=motion.rewrite_statements(loop.body))
+        body_computations = motion.computations[len(preheader) :]
+        self.hoisted += len(motion.computations)
+        if motion.needs_guard and body_computations:
+            return [*reductions, *preheader, If(condition, [*body_computations, loop], loop.pos)]
+        return [*reductions, *preheader, *body_computations, loop]
+
+    @staticmethod
+    def _induction(loop: While, variables: dict[str, type], previous: Statement | None) -> tuple[str, int, int, int] | None:
+        # (name, first value, step, last value) of the induction variable bounded by the loop condition
+        condition = loop.condition
+        if type(condition) is not Binary or condition.op not in MIRRORED_COMPARISONS:
+            return None
+        op, variable, bound = condition.op, condition.left, condition.right
+        if type(variable) is Number:
+            op, variable, bound = MIRRORED_COMPARISONS[op], bound, variable
+        if type(variable) is not Name or type(bound) is not Number or variables.get(variable.name) is not int:
+            return None
+        name = variable.name
+        if type(previous) is not Assignment or previous.name != name or type(previous.value) is not Number:
+            return None
+        increments = [statement for statement in loop.body if type(statement) is Assignment and statement.name == name]
+        if len(increments) != 1 or assigned_names(loop.body).count(name) != 1:
+            return None
+        value = increments[0].value
+        if type(value) is not Binary or value.op not in ('+', '-'):
+            return None
+        if type(value.left) is Name and value.left.name == name and type(value.right) is Number:
+            step = value.right.value if value.op == '+' else -value.right.value
+        elif value.op == '+' and type(value.right) is Name and value.right.name == name and type(value.left) is Number:
+            step = value.left.value
+        else:
+            return None
+
+        # the loop ends at the first value beyond the bound, `i <= b` is `i < b + 1`
+        first, bound = previous.value.value, bound.value + {'<=': 1, '>=': -1}.get(op, 0)
+        if step == 0 or (op in ('<', '<=')) != (step > 0):
+            return None
+        distance = bound - first if step > 0 else first - bound
+        if distance <= 0:  # no iterations
+            return None
+        last = first + -(-distance // abs(step)) * step
+        if not all(-(2**31) <= value <= 2**31 - 1 for value in (first, last, step)):
+            return None
+        return name, first, step, last
+
+    def reduce_strength(self, loop: While, variables: dict[str, type],  # noqa: C901
+                        previous: Statement | None) -> tuple[list[Statement], While]:  # fmt: skip
+        # the assignments before the loop and the loop with the reduced multiplications
+        induction = self._induction(loop, variables, previous)
+        if induction is None:
+            return [], loop
+        name, first, step, last = induction
+
+        def factor(node: Expression) -> int | None:
+            # c of `i * c` or `c * i`
+            if type(node) is not Binary or node.op != '*':
+                return None
+            for variable, constant in ((node.left, node.right), (node.right, node.left)):
+                if type(variable) is Name and variable.name == name and type(constant) is Number:
+                    return constant.value
+            return None
+
+        uses: dict[int, int] = {}  # factor: number of the multiplications
+
+        def count(node: Expression) -> Expression:
+            if factor(node) is not None:
+                uses[factor(node)] = uses.get(factor(node), 0) + 1
+            return node
+
+        replace_in_statements([loop], count)
+        reduced = {
+            constant: self.new_variable()
+            for constant, number in uses.items()
+            if number * MUL_TICKS > UPDATE_TICKS
+            and all(fold_operation(Opcode.MUL, value, constant) is not None for value in (first, last, step))
+        }
+        if not reduced:
+            return [], loop
+        self.reduced += sum(uses[constant] for constant in reduced)
+
+        def reduce(node: Expression) -> Expression:
+            return Name(reduced[factor(node)], node.pos) if factor(node) in reduced else node
+
+        [loop] = replace_in_statements([loop], reduce)
+        body = []
+        for statement in loop.body:
+            body.append(statement)
+            if type(statement) is Assignment and statement.name == name:
+                pos = statement.pos
+                for constant, var in reduced.items():
+                    body.append(Assignment(var, Binary('+', Name(var, pos), Number(step * constant, pos), pos), pos))
+        initial = [Assignment(var, Number(first * constant, loop.pos), loop.pos) for constant, var in reduced.items()]
+        return initial, loop._replace(body=body)
@@ -0,0 +1,426 @@
+import heapq
+from collections.abc import Callable, Sequence
+from typing import NamedTuple
+
+from machine.isa import (
+    ADDRESS_INSTRUCTIONS,
+    JUMP_INSTRUCTIONS,
+    AddressingMode,
+    Instruction,
+    Opcode,
+    basic_block_leaders,
+    instruction_ticks,
+)
+
+DIRECT, INDIRECT, IMMEDIATE = AddressingMode.DIRECT, AddressingMode.INDIRECT, AddressingMode.IMMEDIATE
+ALU_INSTRUCTIONS = {Opcode.ADD, Opcode.SUB, Opcode.MUL, Opcode.DIV, Opcode.MOD, Opcode.CMP}
+ACC_OPERATIONS: dict[Opcode, Callable[[int, int], int]] = {
+    Opcode.ADD: int.__add__,
+    Opcode.SUB: int.__sub__,
+    Opcode.MUL: int.__mul__,
+    Opcode.DIV: int.__floordiv__,
+    Opcode.MOD: int.__mod__,
+}
+JUMP_CONDITIONS: dict[Opcode, Callable[[int], bool]] = {
+    Opcode.JMP: lambda _: True,
+    Opcode.JE: lambda alu: alu == 0,
+    Opcode.JNE: lambda alu: alu != 0,
+    Opcode.JL: lambda alu: alu < 0,
+    Opcode.JG: lambda alu: alu > 0,
+}
+
+MAX_ROUNDS = 20  # safety limit, the known values cross the whole program in one round, so a few rounds converge
+
+
+def fold_operation(opcode: Opcode, left: int, right: int) -> int | None:
+    # result of `acc OP right` the way the ALU computes it, None if the ALU would stop the machine with an error
+    if opcode in {Opcode.DIV, Opcode.MOD} and right == 0:
+        return None
+    result = ACC_OPERATIONS[opcode](left, right)
+    return result if -(2**31) <= result <= 2**31 - 1 else None
+
+
+def successors(instr: Instruction, addr: int) -> list[int]:
+    # addresses the instruction at `addr` may pass the control to
+    if instr.opcode is Opcode.HLT:
+        return []
+    if instr.opcode is Opcode.JMP:
+        return [instr.argument]
+    if instr.opcode in JUMP_INSTRUCTIONS:
+        return [instr.argument, addr + 1]
+    return [addr + 1]
+
+
+def feasible_successors(instr: Instruction, addr: int, alu: int | None) -> list[int]:
+    # successors of the instruction at `addr` when the flags are set by the `alu` value, if known
+    if instr.opcode in JUMP_INSTRUCTIONS and alu is not None:
+        return [instr.argument if JUMP_CONDITIONS[instr.opcode](alu) else addr + 1]
+    return successors(instr, addr)
+
+
+def alu_is_acc_after(instr: Instruction, alu_is_acc: bool) -> bool:
+    # whether the flags are set by the accumulator value after the instruction
+    if instr.opcode is Opcode.CMP:
+        return instr[1:] == (0, IMMEDIATE)
+    return alu_is_acc or instr.opcode in ADDRESS_INSTRUCTIONS or instr.opcode is Opcode.IN
+
+
+class OptimizationReport(NamedTuple):
+    instructions_before: int
+    instructions_after: int
+    ticks_before: int  # sum of the instruction ticks over the code, every instruction counted once
+    ticks_after: int
+
+    def __str__(self):
+        return (
+            f'optimized instr: {self.instructions_before} -> {self.instructions_after}, '
+            f'static ticks: {self.ticks_before} -> {self.ticks_after}'
+        )
+
+
+class LiveCells(NamedTuple):
+    # set of the memory cells, if `complement` is set - of all the cells except the given ones
+    complement: bool
+    cells: frozenset
+
+    def __contains__(self, addr: int) -> bool:
+        return (addr not in self.cells) if self.complement else (addr in self.cells)
+
+    def add(self, addr: int) -> 'LiveCells':
+        return LiveCells(self.complement, self.cells - {addr} if self.complement else self.cells | {addr})
+
+    def remove(self, addr: int) -> 'LiveCells':
+        return LiveCells(self.complement, self.cells | {addr} if self.complement else self.cells - {addr})
+
+    def union(self, other: 'LiveCells') -> 'LiveCells':
+        if self.complement and other.complement:
+            return LiveCells(True, self.cells & other.cells)
+        if self.complement or other.complement:
+            cells, excluded = (other.cells, self.cells) if self.complement else (self.cells, other.cells)
+            return LiveCells(True, excluded - cells)
+        return LiveCells(False, self.cells | other.cells)
+
+
+NO_CELLS, ALL_CELLS = LiveCells(False, frozenset()), LiveCells(True, frozenset())
+
+
+class KnownValues(NamedTuple):
+    # values known at compile time before an instruction
+    acc: int | None  # value of the accumulator, if known
+    cells: dict[int, int]  # memory cells with known values
+    acc_cells: frozenset[int]  # memory cells holding the same value as the accumulator
+    alu_is_acc: bool  # the flags are set by the accumulator value
+    alu: int | None  # value the flags are set by, if known
+
+    def meet(self, other: 'KnownValues') -> 'KnownValues':
+        # values known on both paths
+        return KnownValues(
+            self.acc if self.acc == other.acc else None,
+            {cell: value for cell, value in self.cells.items() if other.cells.get(cell) == value},
+            self.acc_cells & other.acc_cells,
+            self.alu_is_acc and other.alu_is_acc,
+            self.alu if self.alu == other.alu else None,
+        )
+
+
+ENTRY = KnownValues(None, {}, frozenset(), True, None)  # both the accumulator and the flags are 0 when the machine starts
+UNKNOWN = KnownValues(None, {}, frozenset(), False, None)
+
+
+class PeepholeOptimizer:
+    """Simplifies the translated program without changing its output, instruction-level side effects are dropped.
+
+    Every round runs the local pass (redundant loads and stores, constant memory operands folded into immediate ones,
+    `LD #c; OP #d` folded into a single load), the dead store elimination and the jump threading, until nothing changes.
+    The local pass starts every basic block with the values known on all the paths to it, found by a dataflow
+    over the blocks before the pass, so the constants cross the jumps and the loops in one round.
+    `addr_map` maps the original instruction addresses to the optimized ones, so tables indexed by the address
+    can follow the program. The optimizer relies on the program fitting into the data memory: a removed store
+    to a cell out of the memory would have stopped the original program. Programs with jumps out of the code
+    are left as they are.
+    """
+
+    def __init__(self, instructions: Sequence[Instruction]):
+        self.instructions = list(instructions)
+        self.addr_map = list(range(len(self.instructions) + 1))
+
+    def optimize(self) -> list[Instruction]:
+        size = len(self.instructions)
+        if any(instr.opcode in JUMP_INSTRUCTIONS and not 0 <= instr.argument <= size for instr in self.instructions):
+            return self.instructions
+        for _ in range(MAX_ROUNDS):
+            before = self.instructions
+            self._rewrite(self._local_pass())
+            self._rewrite(self._dead_store_pass())
+            self._rewrite(self._dead_load_pass())
+            self._rewrite(self._jump_pass())
+            if self.instructions == before:
+                break
+        return self.instructions
+
+    def follow(self, table: Sequence) -> list:
+        # the table indexed by the original addresses reindexed by the optimized ones,
+        # an instruction kept by the optimizer takes its own value, not the ones of the instructions removed before it
+        result = [None] * len(self.instructions)
+        for addr, value in zip(self.addr_map, table):
+            if addr < len(result):
+                result[addr] = value
+        return result
+
+    def _rewrite(self, replacements: list[Instruction | None]):
+        # replace the instructions, None removes the instruction, jumps to it lead to the next kept one
+        new_addrs, new_addr = [], 0
+        for replacement in replacements:
+            new_addrs.append(new_addr)
+            new_addr += replacement is not None
+        new_addrs.append(new_addr)
+
+        self.instructions = [
+            instr._replace(argument=new_addrs[instr.argument]) if instr.opcode in JUMP_INSTRUCTIONS else instr
+            for instr in replacements
+            if instr is not None
+        ]
+        self.addr_map = [new_addrs[addr] for addr in self.addr_map]
+
+    def _local_pass(self) -> list[Instruction | None]:
+        # forward pass over every basic block, starting from the values known on all the paths to the block
+        result: list[Instruction | None] = list(self.instructions)
+        leaders = sorted(basic_block_leaders(self.instructions))
+        known_before = self._known_values_before(leaders)
+        for start, end in zip(leaders, leaders[1:]):
+            self._block_pass(start, end, known_before.get(start, UNKNOWN), result)  # unreachable blocks know nothing
+        return result
+
+    def _known_values_before(self, leaders: list[int]) -> dict[int, KnownValues]:
+        # values known at the start of every reachable basic block, on all the paths to it; a worklist over the leaders
+        # meets the values at the end of the predecessors until nothing changes, the paths cut off by the jumps
+        # resolved with the known flags do not count
+        size = len(self.instructions)
+        block_ends = dict(zip(leaders, leaders[1:]))
+        scratch: list[Instruction | None] = list(self.instructions)  # the rewrites are not needed here
+        known_before = {0: ENTRY} if self.instructions else {}
+        worklist, queued = list(known_before), set(known_before)
+        while worklist:
+            start = heapq.heappop(worklist)  # in the address order, so the forward jumps are met before the blocks
+            queued.remove(start)
+            end = block_ends[start]
+            known = self._block_pass(start, end, known_before[start], scratch)
+            for succ in feasible_successors(self.instructions[end - 1], end - 1, known.alu):
+                if succ >= size:
+                    continue
+                merged = known_before[succ].meet(known) if succ in known_before else known
+                if merged != known_before.get(succ):
+                    known_before[succ] = merged
+                    if succ not in queued:
+                        heapq.heappush(worklist, succ)
+                        queued.add(succ)
+        return known_before
+
+    def _block_pass(self, start: int, end: int, known: KnownValues, result: list[Instruction | None]) -> KnownValues:  # noqa: C901
+        # forward pass over the basic block, tracking the values known at compile time, rewrites go to `result`;
+        # returns the values known at the end of the block
+        acc, cells, acc_cells = known.acc, dict(known.cells), set(known.acc_cells)
+        alu_is_acc, alu = known.alu_is_acc, known.alu
+        load_addr = None  # address of the previous instruction, if it is a kept `LD #c`
+
+        for addr in range(start, end):
+            instr = self.instructions[addr]
+            prev_load_addr, load_addr = load_addr, None
+            opcode, arg, mode = instr
+
+            if opcode is Opcode.LD and mode is DIRECT and arg in cells:
+                instr = result[addr] = Instruction(Opcode.LD, cells[arg], IMMEDIATE)
+            elif opcode in ALU_INSTRUCTIONS and mode is DIRECT and arg in cells:
+                instr = result[addr] = Instruction(opcode, cells[arg], IMMEDIATE)
+            opcode, arg, mode = instr
+
+            if opcode in {Opcode.LD, Opcode.ST} and mode is DIRECT and alu_is_acc and arg in acc_cells:
+                result[addr] = None  # the accumulator already holds the cell value
+            elif opcode is Opcode.LD and mode is IMMEDIATE and alu_is_acc and acc == arg:
+                result[addr] = None
+            elif opcode is Opcode.CMP and mode is IMMEDIATE and arg == 0 and alu_is_acc:
+                result[addr] = None  # the flags are already set by the accumulator
+            elif opcode in JUMP_INSTRUCTIONS and alu is not None:
+                target = self._thread_jump(addr, alu)
+                result[addr] = None if target == addr + 1 else Instruction(Opcode.JMP, target)
+            elif opcode is Opcode.LD:
+                acc = arg if mode is IMMEDIATE else cells.get(arg) if mode is DIRECT else None
+                acc_cells = {cell for cell, value in cells.items() if value == acc}
+                if mode is DIRECT:
+                    acc_cells.add(arg)
+                alu_is_acc, alu = True, acc
+                load_addr = addr if mode is IMMEDIATE else None
+            elif opcode is Opcode.ST:
+                if mode is DIRECT:
+                    cells.pop(arg, None)
+                    if acc is not None:
+                        cells[arg] = acc
+                    acc_cells.add(arg)
+                else:  # any cell may be written, but only with the accumulator value
+                    cells = {cell: value for cell, value in cells.items() if value == acc}
+                alu_is_acc, alu = True, acc
+            elif opcode is Opcode.CMP:
+                alu_is_acc = mode is IMMEDIATE and arg == 0
+                alu = None if acc is None or mode is not IMMEDIATE else fold_operation(Opcode.SUB, acc, arg)
+            elif opcode in ALU_INSTRUCTIONS:
+                right = arg if mode is IMMEDIATE else None
+                folded = None if acc is None or right is None else fold_operation(opcode, acc, right)
+                if prev_load_addr is not None and folded is not None:
+                    result[prev_load_addr] = None
+                    result[addr] = Instruction(Opcode.LD, folded, IMMEDIATE)
+                    load_addr = addr
+                acc = folded
+                acc_cells = {cell for cell, value in cells.items() if value == acc}
+                alu_is_acc, alu = True, acc
+            elif opcode is Opcode.IN:
+                acc, acc_cells, alu_is_acc, alu = None, set(), True, None
+        return KnownValues(acc, cells, frozenset(acc_cells), alu_is_acc, alu)
+
+    def _thread_jump(self, addr: int, alu: int) -> int:
+        # address the jump at `addr` passes the control to, when the flags are set by the known `alu` value,
+        # following the jumps at the target, as they do not change the flags
+        target, visited = addr, set()
+        while target < len(self.instructions) and target not in visited:
+            instr = self.instructions[target]
+            if instr.opcode not in JUMP_INSTRUCTIONS:
+                break
+            visited.add(target)
+            target = instr.argument if JUMP_CONDITIONS[instr.opcode](alu) else target + 1
+        return target
+
+    def _predecessors(self) -> list[list[int]]:
+        predecessors = [[] for _ in self.instructions]
+        for addr, instr in enumerate(self.instructions):
+            for succ in successors(instr, addr):
+                if succ < len(self.instructions):
+                    predecessors[succ].append(addr)
+        return predecessors
+
+    def _alu_is_acc_before(self) -> list[bool]:
+        # whether the flags are set by the accumulator value before every instruction, on all the paths to it
+        predecessors = self._predecessors()
+        before = [True] * len(self.instructions)  # both are 0 when the machine starts
+        changed = True
+        while changed:
+            changed = False
+            for addr in range(len(self.instructions)):  # the entry point also meets the jumps back to it
+                value = all(alu_is_acc_after(self.instructions[pred], before[pred]) for pred in predecessors[addr])
+                if value != before[addr]:
+                    before[addr], changed = value, True
+        return before
+
+    def _live_registers(self) -> list[tuple[bool, bool]]:
+        # whether the accumulator and the flags may be read after every instruction, before being overwritten
+        size = len(self.instructions)
+        live_in = [(False, False)] * size
+        live_out = [(False, False)] * size
+        changed = True
+        while changed:
+            changed = False
+            for addr in reversed(range(size)):
+                acc_live = flags_live = False
+                for succ in successors(self.instructions[addr], addr):
+                    succ_acc_live, succ_flags_live = live_in[succ] if succ < size else (True, True)
+                    acc_live, flags_live = acc_live or succ_acc_live, flags_live or succ_flags_live
+                live_out[addr] = acc_live, flags_live
+
+                opcode = self.instructions[addr].opcode
+                if opcode in JUMP_INSTRUCTIONS and opcode is not Opcode.JMP:
+                    flags_live = True
+                elif opcode in ADDRESS_INSTRUCTIONS or opcode is Opcode.IN:
+                    flags_live = False
+                if opcode in {Opcode.LD, Opcode.IN}:
+                    acc_live = False
+                elif opcode in ADDRESS_INSTRUCTIONS or opcode in {Opcode.OUT, Opcode.OUTN}:
+                    acc_live = True
+                if (acc_live, flags_live) != live_in[addr]:
+                    live_in[addr], changed = (acc_live, flags_live), True
+        return live_out
+
+    def _live_cells(self) -> list[LiveCells]:
+        # memory cells that may be read after every instruction, before being overwritten
+        size = len(self.instructions)
+        live_in = [NO_CELLS] * size
+        live_out = [NO_CELLS] * size
+        changed = True
+        while changed:
+            changed = False
+            for addr in reversed(range(size)):
+                live = NO_CELLS
+                for succ in successors(self.instructions[addr], addr):
+                    live = live.union(live_in[succ] if succ < size else ALL_CELLS)  # running out of the code
+                live_out[addr] = live
+
+                opcode, arg, mode = self.instructions[addr]
+                if opcode is Opcode.ST and mode is DIRECT:
+                    live = live.remove(arg)
+                elif opcode is Opcode.LD and mode is INDIRECT:
+                    live = ALL_CELLS
+                elif opcode in ADDRESS_INSTRUCTIONS and mode is not IMMEDIATE:
+                    live = live.add(arg)
+                if live != live_in[addr]:
+                    live_in[addr], changed = live, True
+        return live_out
+
+    def _dead_store_pass(self) -> list[Instruction | None]:
+        # remove the direct stores to the cells which are never read afterwards, if the flags stay the same
+        result: list[Instruction | None] = list(self.instructions)
+        live_out = self._live_cells()
+        for addr, (instr, alu_is_acc) in enumerate(zip(self.instructions, self._alu_is_acc_before())):
+            if (
+                instr.opcode is Opcode.ST
+                and instr.addressing_mode is DIRECT
+                and alu_is_acc
+                and instr.argument not in live_out[addr]
+            ):
+                result[addr] = None
+        return result
+
+    def _dead_load_pass(self) -> list[Instruction | None]:
+        # remove the loads whose value is overwritten before being used
+        result: list[Instruction | None] = list(self.instructions)
+        for addr, (instr, live) in enumerate(zip(self.instructions, self._live_registers())):
+            if instr.opcode is Opcode.LD and instr.addressing_mode is not INDIRECT and live == (False, False):
+                result[addr] = None
+        return result
+
+    def _jump_pass(self) -> list[Instruction | None]:
+        # thread the jumps to jumps, remove the jumps to the next instruction and the unreachable code
+        result: list[Instruction | None] = list(self.instructions)
+        size = len(self.instructions)
+        for addr, instr in enumerate(self.instructions):
+            if instr.opcode not in JUMP_INSTRUCTIONS:
+                continue
+            target, visited = instr.argument, {addr}
+            while target < size and target not in visited:
+                next_instr = self.instructions[target]
+                if next_instr.opcode is not Opcode.JMP and next_instr.opcode is not instr.opcode:
+                    break  # the same condition holds at the target, as jumps do not change the flags
+                visited.add(target)
+                target = next_instr.argument
+            result[addr] = instr._replace(argument=target)
+
+        reachable, stack = set(), [0]
+        while stack:
+            addr = stack.pop()
+            if addr < size and addr not in reachable:
+                reachable.add(addr)
+                stack.extend(successors(result[addr], addr))
+        for addr, instr in enumerate(result):
+            if addr not in reachable or (instr.opcode in JUMP_INSTRUCTIONS and instr.argument == addr + 1):
+                result[addr] = None
+        return result
+
+
+def compare(instructions: Sequence[Instruction], optimized: Sequence[Instruction]) -> OptimizationReport:
+    return OptimizationReport(
+        len(instructions),
+        len(optimized),
+        sum(instruction_ticks(instr) for instr in instructions),
+        sum(instruction_ticks(instr) for instr in optimized),
+    )
+
+
+def optimize(instructions: Sequence[Instruction]) -> tuple[list[Instruction], OptimizationReport]:
+    optimized = PeepholeOptimizer(instructions).optimize()
+    return optimized, compare(instructions, optimized)
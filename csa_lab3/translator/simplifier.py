@@ -0,0 +1,117 @@
+from machine.isa import Opcode
+
+from .codegen import BIN_OPCODES
+from .optimizer import fold_operation
+from .syntax import BOOLEAN_OPERATORS, COMPARISON_OPERATORS, Binary, Expression, Name, Number, String, Unary
+
+COMPARISONS = {
+    '==': lambda diff: diff == 0,
+    '!=': lambda diff: diff != 0,
+    '<': lambda diff: diff < 0,
+    '<=': lambda diff: diff <= 0,
+    '>': lambda diff: diff > 0,
+    '>=': lambda diff: diff >= 0,
+}
+INVERTED_COMPARISONS = {'==': '!=', '!=': '==', '<': '>=', '<=': '>', '>': '<=', '>=': '<'}
+
+
+class ExpressionSimplifier:
+    """Folds the constant subexpressions and drops the identities, keeping the results the machine computes.
+
+    Operations that would stop the machine with an error (overflow, division by zero) and constants out of
+    the machine word are not folded, and an operand is dropped only if its evaluation cannot fail.
+    String constants are replaced by their lengths, as the translator does.
+    """
+
+    @staticmethod
+    def _value(node: Expression) -> int | None:
+        if type(node) is Number and -(2**31) <= node.value <= 2**31 - 1:
+            return node.value
+        return None
+
+    @classmethod
+    def _is_safe(cls, node: Expression) -> bool:
+        # the evaluation of the node cannot fail
+        if type(node) in (Name, Number):
+            return cls._value(node) is not None or type(node) is Name
+        if type(node) is Unary and node.op in ('!', '+'):
+            return cls._is_safe(node.operand)
+        if type(node) is Binary and node.op in BOOLEAN_OPERATORS:
+            return cls._is_safe(node.left) and cls._is_safe(node.right)
+        return False
+
+    @staticmethod
+    def _is_boolean(node: Expression) -> bool:
+        # the node is evaluated to 0 or 1
+        if type(node) is Binary:
+            return node.op in COMPARISONS or node.op in BOOLEAN_OPERATORS
+        return type(node) is Unary and node.op == '!'
+
+    @classmethod
+    def _to_boolean(cls, node: Expression) -> Expression:
+        return node if cls._is_boolean(node) else Binary('!=', node, Number(0, node.pos), node.pos)
+
+    def visit(self, node: Expression) -> Expression:
+        if type(node) is String:
+            return Number(len(node.value), node.pos)
+        if type(node) is Unary:
+            return self.visit_unary(node._replace(operand=self.visit(node.operand)))
+        if type(node) is Binary:
+            node = node._replace(left=self.visit(node.left), right=self.visit(node.right))
+            if node.op in COMPARISON_OPERATORS:
+                return self.visit_compare(node)
+            if node.op in BOOLEAN_OPERATORS:
+                return self.visit_bool_op(node)
+            return self.visit_bin_op(node)
+        return node
+
+    def visit_unary(self, node: Unary) -> Expression:
+        operand, value = node.operand, self._value(node.operand)
+        if node.op == '+':
+            return operand
+        if node.op == '-' and value is not None and fold_operation(Opcode.MUL, value, -1) is not None:
+            return Number(-value, node.pos)
+        if node.op == '!':
+            if value is not None:
+                return Number(int(value == 0), node.pos)
+            if type(operand) is Binary and operand.op in COMPARISONS:
+                return operand._replace(op=INVERTED_COMPARISONS[operand.op])
+            if type(operand) is Unary and operand.op == '!' and self._is_boolean(operand.operand):
+                return operand.operand
+        return node
+
+    def visit_bin_op(self, node: Binary) -> Expression:
+        opcode = BIN_OPCODES[node.op]
+        left, right = self._value(node.left), self._value(node.right)
+        if left is not None and right is not None:
+            result = fold_operation(opcode, left, right)
+            return node if result is None else Number(result, node.pos)
+        if (right == 0 and opcode in {Opcode.ADD, Opcode.SUB}) or (right == 1 and opcode in {Opcode.MUL, Opcode.DIV}):
+            return node.left
+        if (left == 0 and opcode is Opcode.ADD) or (left == 1 and opcode is Opcode.MUL):
+            return node.right
+        if (left == 0 or right == 0) and opcode is Opcode.MUL and self._is_safe(node.left) and self._is_safe(node.right):
+            return Number(0, node.pos)
+        if right == 1 and opcode is Opcode.MOD and self._is_safe(node.left):
+            return Number(0, node.pos)
+        return node
+
+    def visit_compare(self, node: Binary) -> Expression:
+        left, right = self._value(node.left), self._value(node.right)
+        diff = None if left is None or right is None else fold_operation(Opcode.SUB, left, right)
+        return node if diff is None else Number(int(COMPARISONS[node.op](diff)), node.pos)
+
+    def visit_bool_op(self, node: Binary) -> Expression:
+        # the constant operand decides the result (if the other one is safe to drop) or the other operand does
+        for constant, other in ((node.left, node.right), (node.right, node.left)):
+            value = self._value(constant)
+            if value is None:
+                continue
+            if (value != 0) == (node.op == '||'):
+                return Number(int(value != 0), node.pos) if self._is_safe(other) else node
+            return Number(int(self._value(other) != 0), node.pos) if self._value(other) is not None else self._to_boolean(other)
+        return node
+
+
+def simplify(node: Expression) -> Expression:
+    return ExpressionSimplifier().visit(node)
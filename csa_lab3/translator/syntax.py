@@ -0,0 +1,270 @@
+import re
+from typing import NamedTuple, Union
+
+KEYWORDS = ('var', 'if', 'while')
+
+# kinds of the tokens
+NAME = 'name'
+NUMBER = 'number'
+STRING = 'string'
+OPERATOR = 'operator'
+NEWLINE = 'newline'
+END = 'end'
+
+TOKEN_PATTERN = re.compile(
+    r"[ \t\r\f\v]*+(?:(?P<name>[_a-zA-Z]\w*)|(?P<number>\d+)|(?P<string>'[^'\n]*')"
+    r'|(?P<operator>==|!=|<=|>=|&&|\|\||[-+*/%<>=!():;])|(?P<error>.))'
+)
+
+UNARY_OPERATORS = ('-', '+', '!')
+ARITHMETIC_OPERATORS = ('+', '-', '*', '/', '%')
+COMPARISON_OPERATORS = ('==', '!=', '<', '<=', '>', '>=')
+BOOLEAN_OPERATORS = ('&&', '||')
+
+COMPARISON_PRECEDENCE = 3
+BINARY_PRECEDENCE = {
+    '||': 1,
+    '&&': 2,
+    **dict.fromkeys(COMPARISON_OPERATORS, COMPARISON_PRECEDENCE),
+    '+': 4,
+    '-': 4,
+    '*': 5,
+    '/': 5,
+    '%': 5,
+}
+MAX_NESTING = 200  # levels of the blocks and the expressions, the parser and the translator passes recurse over them
+
+
+class Position(NamedTuple):
+    line: int
+    column: int
+
+    def __str__(self):
+        return f'line {self.line}, column {self.column}'
+
+
+class Token(NamedTuple):
+    kind: str
+    text: str
+    pos: Position
+
+
+class Number(NamedTuple):
+    value: int
+    pos: Position
+
+
+class String(NamedTuple):
+    value: str
+    pos: Position
+
+
+class Name(NamedTuple):
+    name: str
+    pos: Position
+
+
+class Unary(NamedTuple):
+    op: str  # one of UNARY_OPERATORS
+    operand: 'Expression'
+    pos: Position
+
+
+class Binary(NamedTuple):
+    op: str  # one of ARITHMETIC_OPERATORS, COMPARISON_OPERATORS or BOOLEAN_OPERATORS
+    left: 'Expression'
+    right: 'Expression'
+    pos: Position
+
+
+Expression = Union[Number, String, Name, Unary, Binary]
+
+
+class Assignment(NamedTuple):
+    name: str
+    value: Expression
+    pos: Position
+
+
+class Output(NamedTuple):
+    value: Expression
+    pos: Position
+
+
+class Input(NamedTuple):
+    name: str
+    pos: Position
+
+
+class If(NamedTuple):
+    condition: Expression
+    body: list['Statement']
+    pos: Position
+
+
+class While(NamedTuple):
+    condition: Expression
+    body: list['Statement']
+    pos: Position
+
+
+Statement = Union[Assignment, Output, Input, If, While]
+
+
+def located(message: str, pos: Position) -> str:
+    # the message of an error in the source code, shared by the parser and the translator
+    return f'{message} ({pos})'
+
+
+def describe(token: Token) -> str:
+    return {NEWLINE: 'the end of the line', END: 'the end of the code'}.get(token.kind, f'`{token.text}`')
+
+
+def tokenize(code: str) -> list[Token]:
+    # the tokens of the code, new lines are kept as they separate the statements
+    tokens = []
+    for line, text in enumerate(code.split('\n'), 1):
+        for match in TOKEN_PATTERN.finditer(text):
+            kind = match.lastgroup
+            pos = Position(line, match.start(kind) + 1)
+            assert kind != 'error', located(f'Unexpected symbol `{match.group(kind)}`', pos)
+            tokens.append(Token(kind, match.group(kind), pos))
+        tokens.append(Token(NEWLINE, '\n', Position(line, len(text) + 1)))
+    tokens[-1] = Token(END, '', tokens[-1].pos)
+    return tokens
+
+
+class Parser:
+    """Recursive descent parser of the statements with a Pratt parser of the expressions.
+
+    The code is tokenized once and every token is looked at a constant number of times, so the parsing takes
+    linear time. The operators are the ones of Python (`&&` and `||` being `and` and `or`), except for `!`,
+    which binds as tightly as the unary minus. Syntax errors are reported by assert with their positions,
+    as is the nesting of the blocks and the expressions deeper than `MAX_NESTING` levels.
+    """
+
+    def __init__(self, code: str):
+        self.tokens = tokenize(code)
+        self.index = 0
+        self.depth = 0  # levels of the blocks and the expressions around the current token
+
+    def _check_depth(self, levels: int, token: Token):
+        assert levels <= MAX_NESTING, located(f'Nesting deeper than {MAX_NESTING} levels', token.pos)
+
+    def _enter(self, token: Token):
+        # a block, parentheses, an operator or its right operand opened by the token
+        self.depth += 1
+        self._check_depth(self.depth, token)
+
+    def _peek(self, offset: int = 0) -> Token:
+        return self.tokens[self.index + offset]
+
+    def _next(self) -> Token:
+        token = self._peek()
+        self.index += 1
+        return token
+
+    def _expect(self, kind: str, text: str | None = None) -> Token:
+        token = self._next()
+        expected = f'`{text}`' if text is not None else {NAME: 'a variable name', NEWLINE: 'the end of the line'}[kind]
+        message = located(f'Expected {expected}, got {describe(token)}', token.pos)
+        assert token.kind == kind, message
+        assert text in (None, token.text), message
+        return token
+
+    def _end_statement(self, statement: Statement) -> Statement:
+        if self._peek().kind != END:
+            self._expect(NEWLINE)
+        return statement
+
+    def parse(self) -> list[Statement]:
+        return self._block(None)
+
+    def _block(self, header: Token | None) -> list[Statement]:
+        # the statements up to the `;` closing the block (up to the end of the code if there is no header)
+        statements = []
+        while (token := self._peek()).kind != END:
+            if token.kind == NEWLINE:
+                self._next()
+            elif token.text == ';' and token.kind == OPERATOR:
+                assert header is not None, located('Unexpected ;', token.pos)
+                self._next()
+                self._end_statement(None)
+                return statements
+            else:
+                statements.append(self._statement())
+        assert header is None, located(f'Unclosed `{header.text}` block', header.pos)
+        return statements
+
+    def _statement(self) -> Statement:
+        token, following = self._peek(), self._peek(1)
+        if token.kind == NAME and following.text == '=':
+            assert token.text not in KEYWORDS, located(f'{token.text} cannot be used as a variable name', token.pos)
+            self.index += 2
+            return self._end_statement(Assignment(token.text, self.expression(), token.pos))
+        if token.kind == NAME and token.text in ('if', 'while'):
+            self._next()
+            condition = self.expression()
+            self._expect(OPERATOR, ':')
+            self._end_statement(None)
+            self._enter(token)
+            body = self._block(token)
+            self.depth -= 1
+            return (If if token.text == 'if' else While)(condition, body, token.pos)
+        if token.kind == OPERATOR and token.text == '>':
+            self._next()
+            return self._end_statement(Output(self.expression(), token.pos))
+        # system commands, `/` is followed by the name of the command without spaces
+        is_command = token.text == '/' and following.kind == NAME and following.pos == (token.pos.line, token.pos.column + 1)
+        assert is_command, located('Invalid statement', token.pos)
+        assert following.text in ('in', 'out'), located(f'Unknown command /{following.text}', token.pos)
+        self.index += 2
+        if following.text == 'out':
+            return self._end_statement(Output(self.expression(), token.pos))
+        return self._end_statement(Input(self._expect(NAME).text, token.pos))
+
+    def expression(self, min_precedence: int = 0) -> Expression:
+        # the operations binding tighter than `min_precedence`, all the binary operations are left-associative
+        return self._expression(min_precedence)[0]
+
+    def _expression(self, min_precedence: int) -> tuple[Expression, int]:
+        # the expression with the levels it takes, a chain of operations grows deeper to the left after the parsing
+        left, levels = self._operand()
+        while (token := self._peek()).kind == OPERATOR and BINARY_PRECEDENCE.get(token.text, 0) > min_precedence:
+            self._next()
+            precedence = BINARY_PRECEDENCE[token.text]
+            self._enter(token)
+            right, right_levels = self._expression(precedence)
+            self.depth -= 1
+            left, levels = Binary(token.text, left, right, token.pos), max(levels, right_levels) + 1
+            self._check_depth(self.depth + levels, token)
+            if precedence == COMPARISON_PRECEDENCE:
+                following = self._peek()
+                is_chained = following.kind == OPERATOR and following.text in COMPARISON_OPERATORS
+                assert not is_chained, located('Multiple comparisons are not allowed', following.pos)
+        return left, levels
+
+    def _operand(self) -> tuple[Expression, int]:
+        token = self._next()
+        if token.kind == NAME:
+            return Name(token.text, token.pos), 1
+        if token.kind == NUMBER:
+            assert token.text == '0' or token.text[0] != '0', located(f'Invalid number {token.text}', token.pos)
+            return Number(int(token.text), token.pos), 1
+        if token.kind == STRING:
+            return String(token.text[1:-1], token.pos), 1
+        is_nested = token.kind == OPERATOR and (token.text in UNARY_OPERATORS or token.text == '(')
+        assert is_nested, located(f'Expected an expression, got {describe(token)}', token.pos)
+        self._enter(token)
+        if token.text in UNARY_OPERATORS:
+            operand, levels = self._operand()
+            expression = Unary(token.text, operand, token.pos)
+        else:
+            expression, levels = self._expression(0)
+            self._expect(OPERATOR, ')')
+        self.depth -= 1
+        return expression, levels + 1
+
+
+def parse(code: str) -> list[Statement]:
+    return Parser(code).parse()
@@ -1,11 +1,33 @@
-import re
-import sys
-from _ast import *  # noqa: F403
-from typing import Literal, NamedTuple
-
-from machine.isa import AddressingMode, Instruction, Opcode, machine2binary
-
-from .expression_parser import ExpressionParser
+import argparse
+from typing import NamedTuple
+
+from machine.isa import ADDRESS_INSTRUCTIONS, AddressingMode, Instruction, Opcode, SourceMap, machine2binary, source_map2json
+
+from .allocator import string_capacities
+from .cache import Artifacts, TranslationCache
+from .codegen import BIN_OPCODES, AccumulatorCodegen
+from .loops import LoopOptimizer
+from .optimizer import OptimizationReport, PeepholeOptimizer, compare
+from .simplifier import simplify
+from .syntax import (
+    BOOLEAN_OPERATORS,
+    STRING,
+    Assignment,
+    Binary,
+    Expression,
+    If,
+    Input,
+    Name,
+    Number,
+    Output,
+    Parser,
+    Position,
+    Statement,
+    String,
+    Unary,
+    While,
+    located,
+)
 
 
 class Variable(NamedTuple):
@@ -13,32 +35,69 @@ class Variable(NamedTuple):
     addr: int
 
 
-class Block(NamedTuple):
-    type: Literal['while', 'if']
-    jump_addr: int
-    start_addr: int = None  # for loops only
+class RoutineCells(NamedTuple):
+    # memory cells of the string routines: the arguments, the working cells and the return address
+    ret: int  # number of the call site to return to
+    src: int  # address of the source string, the pointer to the current symbol while the routine runs
+    dest: int  # address of the destination string, the same for it
+    end: int  # address the pointer stops at
+    char: int  # symbol read by `/in`
+
+
+def postfix(node: Expression, tokens: list[Expression] | None = None) -> list[Expression]:
+    # the reverse polish notation of the expression, the right operand of an arithmetic operation or a comparison
+    # goes first, the operands of `&&` and `||` go left to right
+    tokens = [] if tokens is None else tokens
+    if type(node) is Unary:
+        postfix(node.operand, tokens)
+    elif type(node) is Binary and node.op in BOOLEAN_OPERATORS:
+        postfix(node.left, tokens)
+        postfix(node.right, tokens)
+    elif type(node) is Binary:
+        postfix(node.right, tokens)
+        postfix(node.left, tokens)
+    tokens.append(node)
+    return tokens
 
 
 class Translator:
-    KEYWORDS = ('var', 'if', 'while')
     STR_MAX_LENGTH = 63
-
-    def __init__(self):
+    CODEGENS = ('stack', 'accumulator')
+
+    def __init__(self, opt_level: int = 0, codegen: str | None = None, string_routines: bool | None = None,
+                 reuse_memory: bool | None = None, optimize_loops: bool | None = None):  # fmt: skip
+        # 0 - no optimizations, 1 - expression simplification, peephole optimizations, the memory reuse
+        # and the loop optimizations, 2 - the same with the accumulator expression codegen and the string routines
+        # by default; with the memory reuse the cells of a block are reused after it and a string takes its capacity
+        # only, the loop optimizations move the invariant expressions out of the loops and reduce the multiplications
+        self.opt_level = opt_level
+        self.codegen = codegen or ('accumulator' if opt_level >= 2 else 'stack')
+        assert self.codegen in self.CODEGENS, f'Unknown codegen: {self.codegen}'
+        self.string_routines = opt_level >= 2 if string_routines is None else string_routines
+        self.reuse_memory = opt_level >= 1 if reuse_memory is None else reuse_memory
+        self.optimize_loops = opt_level >= 1 if optimize_loops is None else optimize_loops
+        self.loop_optimizer: LoopOptimizer | None = None
+        self.optimization_report: OptimizationReport | None = None
         self.instructions: list[Instruction] = []
+        self.source_lines: list[int] = []  # source line of every instruction, 0 for the final HLT
         self.string_literal_mem: list[int] = []  # string literals zone in memory: size1, chars1[], size2, chars2[]...
         self.string_literal_pointers: dict[str, int] = {}  # string literal: addr
         self.mem_pointer: int = 0  # points to the cell in variables zone after the last declared variable
         self.variables: dict[str, Variable] = {}  # name: Variable(type, addr)
-        self.blocks: list[Block] = []
+        self.string_capacities: dict[Position, int] = {}  # declaration of a string variable: capacity, with the reuse
+        self.data_memory_size = 0  # cells of the data memory the program uses: literals, variables and temporaries
         self.block_variables: list[list[str]] = [[]]
+        self.routine_cells: RoutineCells | None = None  # allocated by the first call of a string routine
+        self.routine_calls: dict[str, list[int]] = {}  # routine name: addresses of the jumps calling it
 
-    def _save_variable(self, name: str, var_type: type[str | int], value_addr: int) -> int:
+    def _save_variable(self, name: str, var_type: type[str | int], value_addr: int, pos: Position) -> int:
         var = self.variables.get(name)
         if var is None:
             var = self.variables[name] = Variable(var_type, self.mem_pointer)
             self.mem_pointer += 1
             if var_type is str:
-                self.mem_pointer += self.STR_MAX_LENGTH
+                self.mem_pointer += self.string_capacities.get(pos, self.STR_MAX_LENGTH)
+            self.data_memory_size = max(self.data_memory_size, self.mem_pointer)
             self.block_variables[-1].append(name)
         if var_type is int:
             self.instructions.append(Instruction(Opcode.LD, value_addr))
@@ -48,6 +107,9 @@ class Translator:
         return var.addr
 
     def _copy_string(self, src_addr: int, dest_addr: int):
+        if self.string_routines:
+            self._call_routine('copy', src=src_addr, dest=dest_addr)
+            return
         self.instructions.append(Instruction(Opcode.LD, 0, AddressingMode.IMMEDIATE))  # p = 0
         self.instructions.append(Instruction(Opcode.ST, dest_addr))  # s1_length = p
 
@@ -68,37 +130,154 @@ class Translator:
         self.instructions.append(Instruction(Opcode.LD, dest_addr))  # p = s1_length
         self.instructions.append(Instruction(Opcode.JMP, len(self.instructions) - 14))
 
-    def _handle_expression(self, expression: str) -> int:  # noqa: C901
+    def _call_routine(self, name: str, **arguments: int):
+        # store the arguments and the number of the call site, then jump to the routine, the jump is patched
+        # when the routines are emitted after the program
+        if self.routine_cells is None:
+            self._allocate_routine_cells()
+        calls = self.routine_calls.setdefault(name, [])
+        for cell, value in (*arguments.items(), ('ret', len(calls))):
+            self.instructions.append(Instruction(Opcode.LD, value, AddressingMode.IMMEDIATE))
+            self.instructions.append(Instruction(Opcode.ST, getattr(self.routine_cells, cell)))
+        calls.append(len(self.instructions))
+        self.instructions.append(Instruction(Opcode.JMP))
+
+    def _allocate_routine_cells(self):
+        self.routine_cells = RoutineCells(*range(self.mem_pointer, self.mem_pointer + len(RoutineCells._fields)))
+        self.mem_pointer += len(RoutineCells._fields)
+        self.data_memory_size = max(self.data_memory_size, self.mem_pointer)
+
+    def _emit_routines(self):
+        emitters = {'copy': self._emit_copy_routine, 'input': self._emit_input_routine, 'output': self._emit_output_routine}
+        for name, calls in self.routine_calls.items():
+            for call in calls:
+                self.instructions[call] = self.instructions[call]._replace(argument=len(self.instructions))
+            emitters[name](self.routine_cells)
+            self._emit_return([call + 1 for call in calls], 0, len(calls))
+
+    def _emit_return(self, sites: list[int], first: int, last: int):
+        # jump to the call site by the number in the `ret` cell, binary search over the call sites [first, last)
+        if last - first == 1:
+            self.instructions.append(Instruction(Opcode.JMP, sites[first]))
+            return
+        if (first, last) == (0, len(sites)):
+            self.instructions.append(Instruction(Opcode.LD, self.routine_cells.ret))
+        middle = (first + last) // 2
+        self.instructions.append(Instruction(Opcode.CMP, middle, AddressingMode.IMMEDIATE))
+        if middle - first == 1:
+            self.instructions.append(Instruction(Opcode.JL, sites[first]))
+            self._emit_return(sites, middle, last)
+            return
+        self.instructions.append(Instruction(Opcode.JL))
+        jump_addr = len(self.instructions) - 1
+        self._emit_return(sites, middle, last)
+        self.instructions[jump_addr] = self.instructions[jump_addr]._replace(argument=len(self.instructions))
+        self._emit_return(sites, first, middle)
+
+    def _emit_copy_routine(self, cells: RoutineCells):
+        # dest_length = 0 first, as in the inline copy, so a string copied to itself becomes empty
+        self.instructions.append(Instruction(Opcode.LD, 0, AddressingMode.IMMEDIATE))
+        self.instructions.append(Instruction(Opcode.ST, cells.dest, AddressingMode.INDIRECT))
+        self.instructions.append(Instruction(Opcode.LD, cells.src, AddressingMode.INDIRECT))  # dest_length = src_length
+        self.instructions.append(Instruction(Opcode.ST, cells.dest, AddressingMode.INDIRECT))
+        self.instructions.append(Instruction(Opcode.ADD, cells.src))  # end = src + src_length
+        self.instructions.append(Instruction(Opcode.ST, cells.end))
+
+        self.instructions.append(Instruction(Opcode.LD, cells.src))  # while src != end:
+        self.instructions.append(Instruction(Opcode.CMP, cells.end))
+        self.instructions.append(Instruction(Opcode.JE, len(self.instructions) + 9))
+        self.instructions.append(Instruction(Opcode.ADD, 1, AddressingMode.IMMEDIATE))  # src += 1
+        self.instructions.append(Instruction(Opcode.ST, cells.src))
+        self.instructions.append(Instruction(Opcode.LD, cells.dest))  # dest += 1
+        self.instructions.append(Instruction(Opcode.ADD, 1, AddressingMode.IMMEDIATE))
+        self.instructions.append(Instruction(Opcode.ST, cells.dest))
+        self.instructions.append(Instruction(Opcode.LD, cells.src, AddressingMode.INDIRECT))  # *dest = *src
+        self.instructions.append(Instruction(Opcode.ST, cells.dest, AddressingMode.INDIRECT))
+        self.instructions.append(Instruction(Opcode.JMP, len(self.instructions) - 10))
+
+    def _emit_input_routine(self, cells: RoutineCells):
+        self.instructions.append(Instruction(Opcode.LD, cells.dest))  # src = dest, the last symbol written
+        self.instructions.append(Instruction(Opcode.ST, cells.src))
+        self.instructions.append(Instruction(Opcode.ADD, self.STR_MAX_LENGTH, AddressingMode.IMMEDIATE))  # end
+        self.instructions.append(Instruction(Opcode.ST, cells.end))
+
+        self.instructions.append(Instruction(Opcode.IN))  # while (char = input) != 0:
+        self.instructions.append(Instruction(Opcode.JE, len(self.instructions) + 10))
+        self.instructions.append(Instruction(Opcode.ST, cells.char))
+        self.instructions.append(Instruction(Opcode.LD, cells.src))  # src += 1
+        self.instructions.append(Instruction(Opcode.ADD, 1, AddressingMode.IMMEDIATE))
+        self.instructions.append(Instruction(Opcode.ST, cells.src))
+        self.instructions.append(Instruction(Opcode.LD, cells.char))  # *src = char
+        self.instructions.append(Instruction(Opcode.ST, cells.src, AddressingMode.INDIRECT))
+        self.instructions.append(Instruction(Opcode.LD, cells.src))  # until src == end
+        self.instructions.append(Instruction(Opcode.CMP, cells.end))
+        self.instructions.append(Instruction(Opcode.JNE, len(self.instructions) - 10))
+
+        self.instructions.append(Instruction(Opcode.LD, cells.src))  # dest_length = src - dest
+        self.instructions.append(Instruction(Opcode.SUB, cells.dest))
+        self.instructions.append(Instruction(Opcode.ST, cells.dest, AddressingMode.INDIRECT))
+
+    def _emit_output_routine(self, cells: RoutineCells):
+        self.instructions.append(Instruction(Opcode.LD, cells.src, AddressingMode.INDIRECT))  # end = src + src_length
+        self.instructions.append(Instruction(Opcode.ADD, cells.src))
+        self.instructions.append(Instruction(Opcode.ST, cells.end))
+
+        self.instructions.append(Instruction(Opcode.LD, cells.src))  # while src != end:
+        self.instructions.append(Instruction(Opcode.CMP, cells.end))
+        self.instructions.append(Instruction(Opcode.JE, len(self.instructions) + 6))
+        self.instructions.append(Instruction(Opcode.ADD, 1, AddressingMode.IMMEDIATE))  # src += 1
+        self.instructions.append(Instruction(Opcode.ST, cells.src))
+        self.instructions.append(Instruction(Opcode.LD, cells.src, AddressingMode.INDIRECT))  # /out *src
+        self.instructions.append(Instruction(Opcode.OUT))
+        self.instructions.append(Instruction(Opcode.JMP, len(self.instructions) - 7))
+
+    def _mark_lines(self, line: int):
+        # attribute the instructions emitted since the last call to the source line
+        self.source_lines += [line] * (len(self.instructions) - len(self.source_lines))
+
+    def _find_variable(self, name: str, pos) -> Variable:
+        var = self.variables.get(name)
+        assert var, located(f'Cannot find variable {name}', pos)
+        return var
+
+    def _handle_expression(self, expression: Expression) -> int:  # noqa: C901
+        # the value is stored to `mem_pointer` and left in the accumulator
+        if self.opt_level >= 1:
+            expression = simplify(expression)
+        if self.codegen == 'accumulator':
+            AccumulatorCodegen(self.instructions, self.variables, self.mem_pointer + 1).emit(expression)
+            self.instructions.append(Instruction(Opcode.ST, self.mem_pointer))
+            return self.mem_pointer
+
         stack_pointer = self.mem_pointer
-        for node in ExpressionParser(expression).parse():
+        for node in postfix(expression):
             node_type = type(node)
             if node_type is Name:
-                var = self.variables.get(node.id)
-                assert var, f'Cannot find variable {node.id}'
+                var = self._find_variable(node.name, node.pos)
                 self.instructions.append(Instruction(Opcode.LD, var.addr))
                 self.instructions.append(Instruction(Opcode.ST, stack_pointer))
                 stack_pointer += 1
-            elif node_type is Constant:
-                constant_value = node.value
-                if type(constant_value) is str:
-                    constant_value = len(constant_value)
+            elif node_type in (Number, String):
+                if node_type is String:
+                    constant_value = len(node.value)
                 else:
-                    assert -(2**31) <= constant_value <= 2**31 - 1, 'Numbers must be between -2^31 and 2^31-1'
+                    constant_value = node.value
+                    assert -(2**31) <= constant_value <= 2**31 - 1, located('Numbers must be between -2^31 and 2^31-1', node.pos)
                 self.instructions.append(Instruction(Opcode.LD, constant_value, AddressingMode.IMMEDIATE))
                 self.instructions.append(Instruction(Opcode.ST, stack_pointer))
                 stack_pointer += 1
-            elif node_type is UAdd:
+            elif node_type is Unary and node.op == '+':
                 pass
-            elif node_type is USub:
+            elif node_type is Unary and node.op == '-':
                 self.instructions.append(Instruction(Opcode.MUL, -1, AddressingMode.IMMEDIATE))
                 self.instructions.append(Instruction(Opcode.ST, stack_pointer - 1))
-            elif node_type is Not:
+            elif node_type is Unary and node.op == '!':
                 self.instructions.append(Instruction(Opcode.JE, len(self.instructions) + 3))
                 self.instructions.append(Instruction(Opcode.LD, 0, AddressingMode.IMMEDIATE))
                 self.instructions.append(Instruction(Opcode.JMP, len(self.instructions) + 2))
                 self.instructions.append(Instruction(Opcode.LD, 1, AddressingMode.IMMEDIATE))
                 self.instructions.append(Instruction(Opcode.ST, stack_pointer - 1))
-            elif node_type is Or:
+            elif node.op == '||':
                 self.instructions.append(Instruction(Opcode.JNE, len(self.instructions) + 5))
                 self.instructions.append(Instruction(Opcode.LD, stack_pointer - 2))
                 self.instructions.append(Instruction(Opcode.JNE, len(self.instructions) + 3))
@@ -107,7 +286,7 @@ class Translator:
                 self.instructions.append(Instruction(Opcode.LD, 1, AddressingMode.IMMEDIATE))
                 self.instructions.append(Instruction(Opcode.ST, stack_pointer - 2))
                 stack_pointer -= 1
-            elif node_type is And:
+            elif node.op == '&&':
                 self.instructions.append(Instruction(Opcode.JE, len(self.instructions) + 5))
                 self.instructions.append(Instruction(Opcode.LD, stack_pointer - 2))
                 self.instructions.append(Instruction(Opcode.JE, len(self.instructions) + 3))
@@ -116,24 +295,19 @@ class Translator:
                 self.instructions.append(Instruction(Opcode.LD, 0, AddressingMode.IMMEDIATE))
                 self.instructions.append(Instruction(Opcode.ST, stack_pointer - 2))
                 stack_pointer -= 1
-            elif node_type in (Add, Sub, Mult, Div, Mod, And, Or):
-                self.instructions.append(Instruction({Add: Opcode.ADD,
-                                                      Sub: Opcode.SUB,
-                                                      Mult: Opcode.MUL,
-                                                      Div: Opcode.DIV,
-                                                      Mod: Opcode.MOD}[node_type],
-                                         stack_pointer - 2))  # fmt: skip
+            elif node.op in BIN_OPCODES:
+                self.instructions.append(Instruction(BIN_OPCODES[node.op], stack_pointer - 2))
                 self.instructions.append(Instruction(Opcode.ST, stack_pointer - 2))
                 stack_pointer -= 1
-            elif node_type in (Eq, NotEq, Lt, LtE, Gt, GtE):
+            else:  # comparison
                 self.instructions.append(Instruction(Opcode.CMP, stack_pointer - 2))
-                if node_type in (Lt, LtE):
-                    self.instructions.append(Instruction(Opcode.JL, len(self.instructions) + 3 + (node_type is LtE)))
-                elif node_type in (Gt, GtE):
-                    self.instructions.append(Instruction(Opcode.JG, len(self.instructions) + 3 + (node_type is GtE)))
-                if node_type in (Eq, LtE, GtE):
+                if node.op in ('<', '<='):
+                    self.instructions.append(Instruction(Opcode.JL, len(self.instructions) + 3 + (node.op == '<=')))
+                elif node.op in ('>', '>='):
+                    self.instructions.append(Instruction(Opcode.JG, len(self.instructions) + 3 + (node.op == '>=')))
+                if node.op in ('==', '<=', '>='):
                     self.instructions.append(Instruction(Opcode.JE, len(self.instructions) + 3))
-                elif node_type is NotEq:
+                elif node.op == '!=':
                     self.instructions.append(Instruction(Opcode.JNE, len(self.instructions) + 3))
                 self.instructions.append(Instruction(Opcode.LD, 0, AddressingMode.IMMEDIATE))
                 self.instructions.append(Instruction(Opcode.JMP, len(self.instructions) + 2))
@@ -143,78 +317,45 @@ class Translator:
 
         return self.mem_pointer
 
-    def process_variable_assignment(self, statement: str) -> bool:
-        if (parsed := re.match(r'([_a-zA-Z]\w*) *= *(.+)', statement)) is None:  # (?:var +)?
-            return False
-
-        var_name, expression = parsed.groups()
-        assert var_name not in self.KEYWORDS, f'{var_name} cannot be used as a variable name'
-
-        if re.match(r"'([^']*)'$", expression):  # string literal
-            string_literal_addr = self.string_literal_pointers[expression[1:-1]]
-            self._save_variable(var_name, str, string_literal_addr)
-        elif re.match(r'[_a-zA-Z]\w*$', expression):  # single variable
-            value_var = self.variables.get(expression)
-            assert value_var, f'Cannot find variable {expression}'
-            self._save_variable(var_name, value_var.type, value_var.addr)
+    def translate_assignment(self, statement: Assignment):
+        value = statement.value
+        if type(value) is String:  # string literal
+            self._save_variable(statement.name, str, self.string_literal_pointers[value.value], statement.pos)
+        elif type(value) is Name:  # single variable
+            value_var = self._find_variable(value.name, value.pos)
+            self._save_variable(statement.name, value_var.type, value_var.addr, statement.pos)
         else:  # expression
-            value_addr = self._handle_expression(expression)
-            self._save_variable(var_name, int, value_addr)
-
-        return True
-
-    def process_if_statement(self, statement: str) -> bool:  # TODO add ELSE
-        if (parsed := re.match(r'if +(.+) *:$', statement)) is None:
-            return False
-
-        expression = parsed.group(1)
-        self._handle_expression(expression)
-        self.instructions.append(Instruction(Opcode.CMP, 0, AddressingMode.IMMEDIATE))
-        self.instructions.append(Instruction(Opcode.JE))  # jump address will be set later, after `;`
-        self.blocks.append(Block('if', len(self.instructions) - 1))
-        self.block_variables.append([])
-
-        return True
-
-    def process_while_statement(self, statement: str) -> bool:
-        if (parsed := re.match(r'while +(.+) *:$', statement)) is None:
-            return False
-
-        expression = parsed.group(1)
+            value_addr = self._handle_expression(value)
+            self._save_variable(statement.name, int, value_addr, statement.pos)
 
+    def translate_block(self, statement: If | While):  # TODO add ELSE
         block_start_addr = len(self.instructions)
-        self._handle_expression(expression)
+        self._handle_expression(statement.condition)
         self.instructions.append(Instruction(Opcode.CMP, 0, AddressingMode.IMMEDIATE))
-        self.instructions.append(Instruction(Opcode.JE))  # jump address will be set later, after `;`
-        self.blocks.append(Block('while', len(self.instructions) - 1, block_start_addr))
+        self.instructions.append(Instruction(Opcode.JE))  # jump address will be set later, after the block
+        jump_addr = len(self.instructions) - 1
         self.block_variables.append([])
+        block_mem_pointer = self.mem_pointer
+        self._mark_lines(statement.pos.line)
 
-        return True
+        self.translate_statements(statement.body)
 
-    def process_block_closure(self, statement: str) -> bool:
-        if statement != ';':
-            return False
-        assert len(self.blocks) > 0, 'Unexpected ;'
-
-        block = self.blocks.pop()
-        if block.type == 'while':
-            self.instructions.append(Instruction(Opcode.JMP, block.start_addr))
-        self.instructions[block.jump_addr] = self.instructions[block.jump_addr]._replace(argument=len(self.instructions))
+        if type(statement) is While:
+            self.instructions.append(Instruction(Opcode.JMP, block_start_addr))
+        self.instructions[jump_addr] = self.instructions[jump_addr]._replace(argument=len(self.instructions))
 
         # clear the block, deleting all the variables declared in it
         for block_var in self.block_variables.pop():
             self.variables.pop(block_var)
+        if self.reuse_memory:
+            self.mem_pointer = block_mem_pointer
 
-        return True
-
-    def process_input_command(self, statement: str) -> bool:
-        if (parsed := re.match(r'/in +([_a-zA-Z]\w*)', statement)) is None:
-            return False
-
-        var_name = parsed.group(1)
-        var = self.variables.get(var_name)
-        assert var, f'Cannot find variable {var_name}'
-        assert var.type is str, f'Cannot input variable {var_name}, must have str type'
+    def translate_input(self, statement: Input):
+        var = self._find_variable(statement.name, statement.pos)
+        assert var.type is str, located(f'Cannot input variable {statement.name}, must have str type', statement.pos)
+        if self.string_routines:
+            self._call_routine('input', dest=var.addr)
+            return
 
         self.instructions.append(Instruction(Opcode.LD, 0, AddressingMode.IMMEDIATE))
         self.instructions.append(Instruction(Opcode.ST, var.addr))
@@ -235,28 +376,24 @@ class Translator:
         self.instructions.append(Instruction(Opcode.JE, len(self.instructions) + 2))
         self.instructions.append(Instruction(Opcode.JMP, len(self.instructions) - 14))
 
-        return True
-
-    def process_output_command(self, statement: str) -> bool:
-        if (parsed := re.match(r'(?:/out |>) *(.+)', statement)) is None:
-            return False
-
-        expression = parsed.group(1)
-        if re.match(r"'([^']*)'$", expression):  # string literal
-            data_addr = self.string_literal_pointers[expression[1:-1]]
+    def translate_output(self, statement: Output):
+        value = statement.value
+        if type(value) is String:  # string literal
+            data_addr = self.string_literal_pointers[value.value]
             data_type = str
-        elif re.match(r'[_a-zA-Z]\w*$', expression):  # single variable
-            var = self.variables.get(expression)
-            assert var, f'Cannot find variable {expression}'
+        elif type(value) is Name:  # single variable
+            var = self._find_variable(value.name, value.pos)
             data_addr = var.addr
             data_type = var.type
         else:  # expression
-            data_addr = self._handle_expression(expression)
+            data_addr = self._handle_expression(value)
             data_type = int
 
         if data_type is int:
             self.instructions.append(Instruction(Opcode.LD, data_addr))
             self.instructions.append(Instruction(Opcode.OUTN))
+        elif self.string_routines:
+            self._call_routine('output', src=data_addr)
         else:
             self.instructions.append(Instruction(Opcode.LD, 0, AddressingMode.IMMEDIATE))  # p = 0
             self.instructions.append(Instruction(Opcode.ST, self.mem_pointer))
@@ -271,69 +408,141 @@ class Translator:
             self.instructions.append(Instruction(Opcode.LD, self.mem_pointer))
             self.instructions.append(Instruction(Opcode.JMP, len(self.instructions) - 9))
 
-        return True
+    def translate_statements(self, statements: list[Statement]):
+        handlers = {
+            Assignment: self.translate_assignment,
+            If: self.translate_block,
+            While: self.translate_block,
+            Input: self.translate_input,
+            Output: self.translate_output,
+        }
+        for statement in statements:
+            handlers[type(statement)](statement)
+            self._mark_lines(statement.pos.line)
 
     def translate(self, code: str):
-        code = code.strip().replace('\t', ' ' * 4).replace('\n\n', '\n')
+        parser = Parser(code)
 
         # store string literals
-        for string in re.findall(r"'([^'\n]*)'", code):
-            assert (
-                len(string) <= self.STR_MAX_LENGTH
-            ), f'The length of `{string}` string is greater than {self.STR_MAX_LENGTH} characters'
+        for token in parser.tokens:
+            if token.kind != STRING:
+                continue
+            string = token.text[1:-1]
+            assert len(string) <= self.STR_MAX_LENGTH, located(
+                f'The length of `{string}` string is greater than {self.STR_MAX_LENGTH} characters', token.pos
+            )
             self.string_literal_pointers[string] = len(self.string_literal_mem)
             self.string_literal_mem += [len(string)] + [ord(char) for char in string]
         self.mem_pointer = len(self.string_literal_mem)
 
+        statements = parser.parse()
+        if self.optimize_loops:
+            self.loop_optimizer = LoopOptimizer()
+            statements = self.loop_optimizer.optimize(statements)
+        if self.reuse_memory:
+            self.string_capacities = string_capacities(statements, self.STR_MAX_LENGTH)
+            if self.string_routines and self.string_literal_mem:  # the cells of the routines are not reused
+                self._allocate_routine_cells()
+
         # translate code
-        for line in code.split('\n'):
-            statement = line.strip()
-            if not statement:
-                continue
-            statement_executed = (
-                self.process_variable_assignment(statement)
-                or self.process_if_statement(statement)
-                or self.process_while_statement(statement)
-                or self.process_block_closure(statement)
-                or self.process_output_command(statement)
-                or self.process_input_command(statement)
-            )
-            assert statement_executed, 'Invalid code: ' + statement
-        assert self.blocks == [], 'Unclosed blocks'
+        self.translate_statements(statements)
         self.instructions.append(Instruction(Opcode.HLT))
-
-
-def code2machine(code: str) -> tuple[list[Instruction], list[int]]:
-    translator = Translator()
+        self._emit_routines()
+        self._mark_lines(0)
+
+        if self.opt_level >= 1:
+            optimizer = PeepholeOptimizer(self.instructions)
+            optimized = optimizer.optimize()
+            self.optimization_report = compare(self.instructions, optimized)
+            self.instructions, self.source_lines = optimized, optimizer.follow(self.source_lines)
+
+        # the temporaries are the cells above the variables addressed by the instructions
+        addresses = (
+            instr.argument + 1
+            for instr in self.instructions
+            if instr.opcode in ADDRESS_INSTRUCTIONS and instr.addressing_mode is not AddressingMode.IMMEDIATE
+        )
+        self.data_memory_size = max(self.data_memory_size, len(self.string_literal_mem), *addresses)
+
+
+def code2machine(code: str, opt_level: int = 0, codegen: str | None = None,
+                 string_routines: bool | None = None) -> tuple[list[Instruction], list[int]]:  # fmt: skip
+    translator = Translator(opt_level, codegen, string_routines)
     translator.translate(code)
     return translator.instructions, translator.string_literal_mem
 
 
-def main(source_file: str, target_file: str, target_debug_file: str):
+def build(source_code: str, opt_level: int = 0) -> Artifacts:
+    # the binary image, the debug listing and the statistics of the translation
+    translator = Translator(opt_level)
+    translator.translate(source_code)
+    instructions, memory = translator.instructions, translator.string_literal_mem
+    binary = machine2binary(instructions, memory)
+
+    debug = ['~~~~~ INSTRUCTIONS ~~~~~', f'{"address":<10}{"hexcode":<15}mnemonic']
+    for i, instr in enumerate(instructions):
+        debug.append(f'{i:<10}{binary[i * 5 : i * 5 + 5].hex():<15}{instr}')
+    debug += ['~~~~~ MEMORY ~~~~~', f'{"address":<10}int']
+    for i, value in enumerate(memory):
+        debug.append(f'{i:<10}{value}')
+
+    source_lines = source_code.count('\n') + 1
+    summary = [
+        f'source LoC: {source_lines}',
+        f'code instr: {len(instructions)}',
+        f'code bytes: {len(instructions) * 5}',  # machine instr word consist of 5 bytes
+        f'data memory: {translator.data_memory_size} cells',
+    ]
+    if translator.optimization_report is not None:
+        summary.append(str(translator.optimization_report))
+    source_map = source_map2json(SourceMap(translator.source_lines, source_code.split('\n')))
+    return Artifacts(bytes(binary), '\n'.join(debug), '\n'.join(summary), source_map)
+
+
+def write_artifacts(artifacts: Artifacts, target_file: str, target_debug_file: str, source_map_file: str | None = None):
+    with open(target_file, 'wb') as f:
+        f.write(artifacts.binary)
+    with open(target_debug_file, 'w', encoding='utf-8') as f:
+        f.write(artifacts.debug)
+    if source_map_file is not None:
+        with open(source_map_file, 'w', encoding='utf-8') as f:
+            f.write(artifacts.source_map)
+
+
+def translate_file(source_file: str, target_file: str, target_debug_file: str, opt_level: int = 0,
+                   cache: TranslationCache | None = None,
+                   source_map_file: str | None = None) -> tuple[Artifacts, bool]:  # fmt: skip
+    # write the artifacts of the source file, taking them from the cache if it has them; returns (artifacts, hit)
     with open(source_file, encoding='utf-8') as f:
         source_code = f.read()
-    instructions, memory = code2machine(source_code)
+    key = artifacts = None
+    if cache is not None:
+        key = cache.key(source_code, opt_level=opt_level)
+        artifacts = cache.get(key)
+    hit = artifacts is not None
+    if not hit:
+        artifacts = build(source_code, opt_level)
+        if cache is not None:
+            cache.put(key, artifacts)
 
-    binary = machine2binary(instructions, memory)
-    with open(target_file, 'wb') as f:
-        f.write(binary)
+    write_artifacts(artifacts, target_file, target_debug_file, source_map_file)
+    return artifacts, hit
 
-    with open(target_debug_file, 'w', encoding='utf-8') as f:
-        f.write('~~~~~ INSTRUCTIONS ~~~~~')
-        f.write(f'\n{"address":<10}{"hexcode":<15}mnemonic')
-        for i, instr in enumerate(instructions):
-            f.write(f'\n{i:<10}{binary[i * 5 : i * 5 + 5].hex():<15}{instr}')
-        f.write('\n~~~~~ MEMORY ~~~~~')
-        f.write(f'\n{"address":<10}int')
-        for i, value in enumerate(memory):
-            f.write(f'\n{i:<10}{value}')
 
-    print('source LoC:', source_code.count('\n') + 1)
-    print('code instr:', len(instructions))
-    print('code bytes:', len(instructions) * 5)  # machine instr word consist of 5 bytes
+def main(source_file: str, target_file: str, target_debug_file: str, opt_level: int = 0, cache_dir: str | None = None,
+         source_map_file: str | None = None):  # fmt: skip
+    cache = TranslationCache(cache_dir) if cache_dir is not None else None
+    artifacts, _ = translate_file(source_file, target_file, target_debug_file, opt_level, cache, source_map_file)
+    print(artifacts.summary)
 
 
 if __name__ == '__main__':
-    assert len(sys.argv) == 4, 'Wrong arguments: translator.py <source_file> <target_file> <target_debug_file>'
-    _, source_file, target_file, target_debug_file = sys.argv
-    main(source_file, target_file, target_debug_file)
+    parser = argparse.ArgumentParser(prog='translator.py')
+    parser.add_argument('source_file')
+    parser.add_argument('target_file')
+    parser.add_argument('target_debug_file')
+    parser.add_argument('-O', dest='opt_level', type=int, choices=(0, 1, 2), default=0, help='optimization level')
+    parser.add_argument('--cache-dir', help='directory of the translation cache, disabled by default')
+    parser.add_argument('--source-map', help='file to write the source line of every instruction to (JSON)')
+    args = parser.parse_args()
+    main(args.source_file, args.target_file, args.target_debug_file, args.opt_level, args.cache_dir, args.source_map)
@@ -0,0 +1,43 @@
+import json
+
+import pytest
+from benchmark import benchmark
+from machine import machine
+from translator import translator
+
+
+@pytest.mark.parametrize('engine', machine.ENGINES)
+@pytest.mark.parametrize('workload', benchmark.WORKLOADS)
+def test_workloads(workload, engine):
+    workload = benchmark.WORKLOADS[workload](0.05)
+    instructions, memory = translator.code2machine(workload.code)
+    assert machine.simulation(instructions, memory, workload.input, engine=engine)[0] == workload.expected_output
+
+
+def test_benchmark_suite(tmp_path, capsys):
+    baseline_file, results_file = tmp_path / 'baseline.json', tmp_path / 'results.json'
+    assert benchmark.main(['--scale', '0.02', '--repeat', '1', '--engine', 'fast', '-o', str(baseline_file)]) == 0
+    baseline = json.loads(baseline_file.read_text(encoding='utf-8'))
+    assert list(baseline['benchmarks']) == [
+        *(f'{workload}/fast' for workload in benchmark.WORKLOADS),
+        'translate/O0',
+        'translate/O2',
+        'binary_store',
+        'binary_load',
+    ]
+    assert baseline['benchmarks']['cat/fast']['instr_per_second'] > 0
+    assert 'arithmetic/fast' in capsys.readouterr().out
+
+    # the throughputs falling or the memory growing beyond the threshold are regressions
+    results = {'benchmarks': {'cat/fast': {'instr_per_second': 70, 'ticks_per_second': 90, 'peak_memory': 130, 'ticks': 1}}}
+    baseline = {'benchmarks': {'cat/fast': {'instr_per_second': 100, 'ticks_per_second': 100, 'peak_memory': 100, 'ticks': 2}}}
+    assert benchmark.compare(results, baseline, threshold=0.2) == [
+        ('cat/fast', 'instr_per_second', 100, 70, True),
+        ('cat/fast', 'ticks_per_second', 100, 90, False),
+        ('cat/fast', 'peak_memory', 100, 130, True),
+    ]
+    baseline_file.write_text(json.dumps(baseline), encoding='utf-8')
+    argv = ['--scale', '0.02', '--repeat', '1', '--engine', 'fast', '--workload', 'cat', '-o', str(results_file)]
+    assert benchmark.main([*argv, '--compare', str(baseline_file), '--threshold', '1e9']) == 0
+    assert benchmark.main([*argv, '--compare', str(results_file), '--threshold', '-1']) == 1
+    assert 'REGRESSION' in capsys.readouterr().out
@@ -0,0 +1,61 @@
+import json
+import re
+
+from fuzz import fuzz
+from machine import machine
+from machine.fast import FastControlUnit
+from machine.isa import Opcode
+from translator import translator
+
+
+def test_generated_programs():
+    for seed in range(8):
+        case = fuzz.generate(seed)
+        assert case == fuzz.generate(seed)
+        translator.code2machine(case.code)
+        assert fuzz.check(case) == []
+
+
+def test_generated_programs_compare_levels():
+    # a program taking more cells than the default capacity at O0 only is no mismatch of the levels
+    code = '\n'.join(f"s{i} = 'x'\n> s{i}" for i in range(20))
+    translator_ = translator.Translator(0)
+    translator_.translate(code)
+    assert translator_.data_memory_size > 1000
+    assert fuzz.check(fuzz.Case(code, '')) == []
+
+    # an int variable is never assigned a string, which would be copied over the cells after it
+    for seed in range(300):
+        assert not re.search(r"^ *v\d+ = (s\d+|'[^']*')$", fuzz.generate(seed).code, re.MULTILINE)
+
+
+def broken_engine(instructions, data_path):
+    # the fast engine multiplying by addition
+    instructions = [instr._replace(opcode=Opcode.ADD) if instr.opcode is Opcode.MUL else instr for instr in instructions]
+    return FastControlUnit(instructions, data_path)
+
+
+def test_minimize(monkeypatch):
+    monkeypatch.setitem(machine.ENGINES, 'broken', broken_engine)
+    code = "x = 3\ns = 'abc'\ny = 0\nwhile y < 2:\n  > s\n  if x > 1:\n    > x * 2\n  ;\n  /in s\n  y = y + 1\n;\n> x + 1"
+    case = fuzz.Case(code, 'a\nbb\nccc')
+    mismatch = fuzz.check(case)[0]
+    assert mismatch.kind == 'O0/broken'
+    assert (mismatch.expected.output, mismatch.actual.output) == ('abc6a64', 'abc5a54')
+
+    minimized = fuzz.minimize(case, lambda case: any(mismatch.kind == 'O0/broken' for mismatch in fuzz.check(case)))
+    assert minimized == fuzz.Case('x = 3\n> x * 2', '')
+
+    # a program that is not valid does not fail
+    assert fuzz.check(fuzz.Case('> x * 2', '')) == []
+
+
+def test_fuzz_main(monkeypatch, tmp_path):
+    monkeypatch.setitem(machine.ENGINES, 'broken', broken_engine)
+    reports_file = tmp_path / 'reports.jsonl'
+    assert fuzz.main(['--cases', '4', '-j', '1', '--no-minimize', '-o', str(reports_file)]) == 1
+    reports = [json.loads(line) for line in reports_file.read_text(encoding='utf-8').splitlines()]
+    assert reports
+    for report in reports:
+        assert report['kind'].endswith('/broken')
+        assert report['expected'] != report['actual']
@@ -33,3 +33,37 @@ def test_translator_and_machine(golden, caplog):
             assert file.read() == golden.out['out_code']
         assert stdout.getvalue() == golden.out['out_stdout']
         assert caplog.text == golden.out['out_log']
+
+
+@pytest.mark.golden_test('golden/*.yml')
+@pytest.mark.parametrize('engine', machine.ENGINES)
+def test_machine_engines(golden, engine):
+    with tempfile.TemporaryDirectory() as tmpdir:
+        source_file = os.path.join(tmpdir, 'source.code')
+        with open(source_file, 'w', encoding='utf-8') as file:
+            file.write(golden['in_source'])
+
+        input_file = os.path.join(tmpdir, 'input.txt')
+        with open(input_file, 'w', encoding='utf-8') as file:
+            file.write(golden['in_stdin'])
+
+        target_file = os.path.join(tmpdir, 'target.bin')
+        target_debug_file = os.path.join(tmpdir, 'target.debug')
+        with contextlib.redirect_stdout(io.StringIO()):
+            translator.main(source_file, target_file, target_debug_file)
+        with contextlib.redirect_stdout(io.StringIO()) as stdout:
+            machine.main(target_file, input_file, engine)
+
+        assert stdout.getvalue() == golden.out['out_stdout'].split('=' * 60 + '\n')[1]
+
+
+@pytest.mark.golden_test('golden/*.yml')
+def test_optimized_translation(golden):
+    instructions, memory = translator.code2machine(golden['in_source'])
+    optimized, _ = translator.code2machine(golden['in_source'], opt_level=1)
+    output, _, ticks = machine.simulation(instructions, memory, golden['in_stdin'])
+    optimized_output, _, optimized_ticks = machine.simulation(optimized, memory, golden['in_stdin'])
+
+    assert optimized_output == output
+    assert len(optimized) < len(instructions)
+    assert optimized_ticks < ticks
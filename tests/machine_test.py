@@ -0,0 +1,658 @@
+import asyncio
+import contextlib
+import io
+import json
+import logging
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+
+import pytest
+from machine import analysis, batch, cache, debugger, machine, service
+from machine.isa import AddressingMode, Instruction, Opcode, SourceMap, load_binary, machine2binary
+from machine.memory import MEMORY_BACKENDS, PAGE_SIZE, MemoryStats, SparseMemory, memory_stats
+from machine.ports import StreamInputPort, StreamOutputPort, StringInputPort
+from machine.profiler import Profiler
+from machine.snapshot import Snapshot
+from machine.tracing import DROPPED, OUTPUT, STATE, WINDOW_END, Tracer
+from translator import translator
+
+IMMEDIATE, INDIRECT = AddressingMode.IMMEDIATE, AddressingMode.INDIRECT
+
+PROGRAMS = {
+    'overflow': [Instruction(Opcode.LD, 2**31 - 1, IMMEDIATE), Instruction(Opcode.ADD, 1, IMMEDIATE), Instruction(Opcode.HLT)],
+    'out_of_memory': [Instruction(Opcode.LD, 5000), Instruction(Opcode.HLT)],
+    'indirect_out_of_memory': [
+        Instruction(Opcode.LD, -1, IMMEDIATE),
+        Instruction(Opcode.ST, 0),
+        Instruction(Opcode.LD, 0, INDIRECT),
+        Instruction(Opcode.HLT),
+    ],
+    'division_by_zero': [Instruction(Opcode.LD, 1, IMMEDIATE), Instruction(Opcode.DIV, 0, IMMEDIATE), Instruction(Opcode.HLT)],
+    'empty_input': [Instruction(Opcode.IN), Instruction(Opcode.OUT), Instruction(Opcode.JMP, 0)],
+    'infinite_loop': [Instruction(Opcode.LD, 1, IMMEDIATE), Instruction(Opcode.ST, 2), Instruction(Opcode.JMP, 0)],
+    'out_of_code': [Instruction(Opcode.LD, 1, IMMEDIATE), Instruction(Opcode.ST, 3)],
+}
+
+
+def run(instructions, engine, **kwargs):
+    try:
+        return machine.simulation(instructions, [7, 8], 'ab', **kwargs, engine=engine)
+    except (AssertionError, ArithmeticError, IndexError) as e:
+        return repr(e)
+
+
+@pytest.mark.parametrize('engine', machine.ENGINES)
+@pytest.mark.parametrize('program', PROGRAMS)
+def test_engine_errors(program, engine):
+    instructions = PROGRAMS[program]
+    expected = run(instructions, 'signal', memory_capacity=10, instr_limit=100)
+    assert run(instructions, engine, memory_capacity=10, instr_limit=100) == expected
+
+
+@pytest.mark.parametrize('engine', machine.ENGINES)
+def test_engine_instruction_limit(engine):
+    instructions, memory = translator.code2machine('n = 0\nwhile n < 50:\n  n = n + 1\n  > n\n;')
+    for instr_limit in range(0, 200, 7):
+        expected = machine.simulation(instructions, memory, '', instr_limit=instr_limit)
+        assert machine.simulation(instructions, memory, '', instr_limit=instr_limit, engine=engine) == expected
+
+
+def simulation_result(instructions, memory, input_stream, **kwargs):
+    try:
+        return machine.simulation(instructions, memory, input_stream, **kwargs)
+    except (AssertionError, ArithmeticError, IndexError) as e:
+        return repr(e)
+
+
+@pytest.mark.parametrize('opt_level', [0, 1])
+def test_simt(opt_level):
+    simt = pytest.importorskip('machine.simt')
+    inputs = ['ab', '', 'hello\nworld', 'ёж\n' * 20, 'x' * 70, 'nop', 'zzz\n']
+    programs = [(instructions, [7, 8], 10, 100) for instructions in PROGRAMS.values()]
+    # the lanes diverge at the loops and the jumps and stop by the end of the input, HLT, the limit and the errors
+    code = "s = ' '\nn = 0\nwhile s:\n  /in s\n  if s > 'm':\n    n = n + 1\n  ;\n  > s\n;\n> 100 / (n - 3)\n> n"
+    instructions, memory = translator.code2machine(code, opt_level, string_routines=True)
+    programs += [(instructions, memory, 1000, instr_limit) for instr_limit in (0, 17, 500, 60000)]
+    for instructions, memory, memory_capacity, instr_limit in programs:
+        results = simt.simt_simulation(instructions, memory, inputs, memory_capacity, instr_limit)
+        for input_stream, result in zip(inputs, results):
+            with batch.capture_warnings() as warnings:
+                expected = simulation_result(instructions, memory, input_stream, memory_capacity=memory_capacity,
+                                             instr_limit=instr_limit)  # fmt: skip
+            if isinstance(result, Exception):
+                assert repr(result) == expected
+            else:
+                assert (result.output, result.instr, result.ticks) == expected
+                assert result.input_is_over == ('Input buffer is empty!' in warnings)
+
+
+def machine_state(control_unit):
+    data_path = control_unit.data_path
+    registers = (data_path.acc, data_path.alu_output, data_path.address_reg, data_path.memory_output)
+    counters = (control_unit.instr_pointer, control_unit.instr_counter, control_unit.current_tick())
+    return counters, registers, list(data_path.memory), data_path.output_port.getvalue()
+
+
+def reference_states(instructions, memory, input_stream='', memory_capacity=10):
+    # states of ControlUnit after every number of executed instructions, until it stops
+    control_unit = machine.ControlUnit(instructions, machine.DataPath(memory, memory_capacity, input_stream))
+    states = [machine_state(control_unit)]
+    with contextlib.suppress(StopIteration, EOFError, AssertionError):
+        while True:
+            control_unit.decode_and_execute_instruction()
+            control_unit.instr_counter += 1
+            states.append(machine_state(control_unit))
+    return states
+
+
+def limited_states(instructions, memory, engine, states, input_stream='', memory_capacity=10):
+    # the engine stopped by every instruction limit matches the reference state
+    for instr_limit in range(len(states) + 1):
+        control_unit = machine.ENGINES[engine](instructions, machine.DataPath(memory, memory_capacity, input_stream))
+        with contextlib.suppress(StopIteration, EOFError, AssertionError):
+            control_unit.run(instr_limit)
+        assert machine_state(control_unit) == states[min(instr_limit, len(states) - 1)], instr_limit
+
+
+def test_fused_instructions():
+    instructions = [
+        Instruction(Opcode.LD, 1),
+        Instruction(Opcode.ST, 2),
+        Instruction(Opcode.LD, 5, IMMEDIATE),
+        Instruction(Opcode.ST, 3),
+        Instruction(Opcode.ADD, 2, IMMEDIATE),
+        Instruction(Opcode.ST, 4),
+        Instruction(Opcode.ST, 5),
+        Instruction(Opcode.LD, 0),
+        Instruction(Opcode.CMP, 0, IMMEDIATE),
+        Instruction(Opcode.JE, 12),
+        Instruction(Opcode.LD, 2),
+        Instruction(Opcode.JMP, 13),
+        Instruction(Opcode.HLT),
+        Instruction(Opcode.MUL, 1000000, IMMEDIATE),  # overflows in the second iteration
+        Instruction(Opcode.ST, 1),
+        Instruction(Opcode.JMP, 0),
+    ]
+    control_unit = machine.ENGINES['fast'](instructions, machine.DataPath([7, 8], 10, ''))
+    assert sorted(control_unit.fused) == [0, 2, 4, 6, 8, 10, 13]
+
+    # the state is exact after any number of instructions, the limit stops the machine inside the fused pairs
+    limited_states(instructions, [7, 8], 'fast', reference_states(instructions, [7, 8]))
+
+    # the simulation continues from the second instruction of a pair
+    snapshots = []
+    expected = run(instructions, 'signal', memory_capacity=10)
+    assert run(instructions, 'fast', memory_capacity=10, checkpoint_every=3, on_checkpoint=snapshots.append) == expected
+    for snapshot in snapshots:
+        assert run(instructions, 'fast', memory_capacity=10, snapshot=snapshot) == expected
+
+
+@pytest.mark.parametrize('opt_level', [0, 2])
+def test_string_routines(opt_level):
+    code = "s = 'routines'\nt = ' '\nn = 0\nwhile n < 2:\n  t = s\n  s = s\n  > t\n  /in t\n  > t\n  n = n + 1\n;"
+    instructions, memory = translator.code2machine(code, opt_level, string_routines=True)
+    control_unit = machine.ENGINES['fast'](instructions, machine.DataPath(memory, 200, ''))
+    assert len(control_unit.bulk) == 2  # the copy and the output loops
+
+    # the bulk copies and outputs stop at any instruction limit with the state of the machine executing them
+    text = 'abc\n\n'
+    limited_states(instructions, memory, 'fast', reference_states(instructions, memory, text, 200), text, 200)
+    for memory_backend in MEMORY_BACKENDS:
+        result = machine.simulation(instructions, memory, text, 200, engine='fast', memory_backend=memory_backend)
+        assert result == machine.simulation(instructions, memory, text, 200)
+
+
+def test_binary_round_trip(tmp_path):
+    instructions = [instr for program in PROGRAMS.values() for instr in program]
+    memory = [0, -1, 2**31 - 1, -(2**31), 42]
+    binary_file = tmp_path / 'program.bin'
+    binary_file.write_bytes(machine2binary(instructions, memory))
+
+    loaded_instructions, loaded_memory = load_binary(str(binary_file))
+    assert list(loaded_instructions) == instructions
+    assert loaded_instructions[3] == instructions[3]
+    assert loaded_memory.tolist() == memory
+
+
+@pytest.mark.parametrize('engine', machine.ENGINES)
+@pytest.mark.parametrize('memory_backend', MEMORY_BACKENDS)
+def test_memory_backends(memory_backend, engine):
+    instructions, memory = translator.code2machine("s = 'abc'\nn = 0\nwhile n < 3:\n  > s\n  n = n + 1\n;")
+    expected = machine.simulation(instructions, memory, '')
+    assert machine.simulation(instructions, memory, '', engine=engine, memory_backend=memory_backend) == expected
+    assert machine.simulation(instructions, memory, '', 2**31, engine=engine, memory_backend='sparse') == expected
+
+
+def test_sparse_memory_stats():
+    memory = SparseMemory([3, 0, 5], capacity=2**31)
+    memory[2**31 - 1] = -7
+    memory[2**31 - 2] = 0
+    assert (memory[0], memory[1], memory[2**31 - 1], memory[12345]) == (3, 0, -7, 0)
+    assert memory_stats(memory) == MemoryStats(touched_pages=2, resident_cells=2 * PAGE_SIZE, peak_resident_cells=2 * PAGE_SIZE)
+    with pytest.raises(OverflowError):
+        memory[10] = 2**31
+
+
+def test_batch(tmp_path):
+    sources = {
+        'cat': "s = ' '\nwhile s:\n  /in s\n  > s\n;",
+        'sum': 'n = 0\nwhile n < 100:\n  n = n + 1\n;\n> n',
+        'div': '> 1 / 0',
+    }
+    jobs, expected = [], {}
+    for name, source in sources.items():
+        binary_file = str(tmp_path / f'{name}.bin')
+        instructions, memory = translator.code2machine(source)
+        (tmp_path / f'{name}.bin').write_bytes(machine2binary(instructions, memory))
+        for i in range(5):
+            input_file = str(tmp_path / f'{name}{i}.txt')
+            (tmp_path / f'{name}{i}.txt').write_text(f'input #{i}', encoding='utf-8')
+            jobs.append(batch.Job(binary_file, input_file))
+            if name != 'div':
+                expected[binary_file, input_file] = machine.simulation(instructions, memory, f'input #{i}')
+    broken_input = str(tmp_path / 'broken.txt')  # not UTF-8, fails only its own job
+    (tmp_path / 'broken.txt').write_bytes(b'\xff\xfe')
+    jobs.insert(0, batch.Job(str(tmp_path / 'cat.bin'), broken_input))
+
+    results = list(batch.run_batch(jobs, workers=2, chunksize=2))
+    assert len(results) == len(jobs)
+    for result in results:
+        if result['input'] == broken_input:
+            assert result['error'].startswith('UnicodeDecodeError(')
+        elif result['binary'].endswith('div.bin'):
+            assert result['error'] == "ZeroDivisionError('integer division or modulo by zero')"
+        else:
+            assert (result['output'], result['instr'], result['ticks']) == expected[result['binary'], result['input']]
+            assert result['warnings'] == ([] if result['binary'].endswith('sum.bin') else ['Input buffer is empty!'])
+
+
+def test_simulation_cache(tmp_path, caplog, capsys, monkeypatch):
+    instructions, memory = translator.code2machine("s = ' '\nwhile s:\n  /in s\n  > s\n;")
+    program = cache.program_digest(machine2binary(instructions, memory))
+    memo = cache.SimulationCache(max_entries=2, directory=tmp_path / 'results')
+    expected = machine.simulation(instructions, memory, 'abc')
+    caplog.clear()
+    for engine in machine.ENGINES:
+        assert machine.cached_simulation(memo, instructions, memory, 'abc', engine=engine) == expected
+        assert caplog.messages == ['Input buffer is empty!']
+        caplog.clear()
+    assert (memo.hits, memo.disk_hits, memo.misses) == (2, 0, 1)
+
+    # the options are a part of the key, the instruction limit exceeded is remembered
+    limited = machine.cached_simulation(memo, instructions, memory, 'abc', instr_limit=10, program=program)
+    assert limited == machine.simulation(instructions, memory, 'abc', instr_limit=10)
+    caplog.clear()
+    assert machine.cached_simulation(memo, instructions, memory, 'abc', instr_limit=10, program=program) == limited
+    assert caplog.messages == ['Instruction limit exceeded!']
+    assert (memo.hits, memo.disk_hits, memo.misses) == (3, 0, 2)
+
+    # the least recently used results leave the memory and are found on disk
+    machine.cached_simulation(memo, instructions, memory, 'de', program=program)
+    assert machine.cached_simulation(memo, instructions, memory, 'abc', program=program) == expected
+    assert (memo.hits, memo.disk_hits, memo.misses) == (3, 1, 3)
+    other = cache.SimulationCache(directory=tmp_path / 'results')
+    expected_de = cache.SimulationResult(*machine.simulation(instructions, memory, 'de'), input_is_over=True)
+    assert other.get(other.key(program, 'de', 1000, 60000)) == expected_de
+    assert other.get(other.key(program, 'fgh', 1000, 60000)) is None
+    assert (other.hits, other.disk_hits, other.misses) == (0, 1, 1)
+
+    # the files are deleted when they take more than the maximum size
+    small = cache.SimulationCache(directory=tmp_path / 'small', max_size=100)
+    for i in range(10):
+        machine.cached_simulation(small, instructions, memory, f'input #{i}', program=program)
+    assert 0 < sum(path.stat().st_size for path in (tmp_path / 'small').iterdir()) <= 100
+
+    # the simulations of the main are memoized by the digest of the binary file
+    binary_file, input_file = tmp_path / 'cat.bin', tmp_path / 'input.txt'
+    binary_file.write_bytes(machine2binary(instructions, memory))
+    input_file.write_text('abc', encoding='utf-8')
+    machine.main(str(binary_file), str(input_file), 'fast', cache_dir=str(tmp_path / 'results'))
+    assert capsys.readouterr().out == f"output: 'abc'\ninstr executed: {expected[1]}\nticks: {expected[2]}\n"
+
+    # a loaded program is encoded once for its digest, then the hits do not depend on its size
+    store, store_memory = load_binary(str(binary_file))
+    assert cache.image_digest(store, store_memory) == program
+    monkeypatch.setattr(cache, 'machine2binary', None)
+    assert machine.cached_simulation(memo, store, store_memory, 'abc') == expected
+    assert cache.image_digest(store, store_memory) == program
+
+
+@pytest.mark.parametrize('engine', machine.ENGINES)
+def test_stream_ports(engine):
+    instructions, memory = translator.code2machine("s = ' '\nwhile s:\n  /in s\n  > s\n;")
+    text = 'Streaming\nports\n' * 20
+    expected_output, *expected_counts = machine.simulation(instructions, memory, text)
+
+    sink = io.StringIO()
+    input_port = StreamInputPort(io.StringIO(text), chunk_size=7)
+    output, *counts = machine.simulation(instructions, memory, input_port, engine=engine, output_port=StreamOutputPort(sink, 5))
+    assert (output, counts, input_port.consumed) == ('', expected_counts, len(text) + 1)
+    assert sink.getvalue() == expected_output
+
+
+def test_tracer(caplog):
+    instructions, memory = translator.code2machine("n = 0\nwhile n < 5:\n  n = n + 1\n  > n\n;\n> '!'")
+    tracer = Tracer(instructions, window=3)
+    output, *_ = machine.simulation(instructions, memory, '', tracer=tracer)
+    kinds = [kind for kind, _ in tracer.messages(output)]
+    assert kinds == [STATE] * 3 + [WINDOW_END] + [OUTPUT] * 6
+    assert list(tracer.messages(output))[-1] == (OUTPUT, "output: '12345' << '!'")
+
+    # the input and output events do not push the states of the window out, the output is followed after a drop
+    tracer = Tracer(instructions, window=3, capacity=2)
+    machine.simulation(instructions, memory, '', tracer=tracer)
+    messages = list(tracer.messages(output))
+    assert [kind for kind, _ in messages] == [DROPPED] + [STATE] * 3 + [WINDOW_END] + [OUTPUT] * 2
+    assert messages[0] == (DROPPED, '4 earlier trace events were dropped')
+    assert messages[-2:] == [(OUTPUT, "output: '1234' << '5'"), (OUTPUT, "output: '12345' << '!'")]
+
+    tracer = Tracer(instructions, window=None, capacity=10)
+    machine.simulation(instructions, memory, '', tracer=tracer)
+    messages = list(tracer.messages(output))
+    assert len(tracer.states) == 10
+    assert messages[0] == (DROPPED, f'{tracer.recorded - 10 - len(tracer.events)} earlier trace events were dropped')
+    assert messages[-1][1].endswith(' HLT')
+
+    # the trace is dumped to the log by an error too
+    caplog.set_level(logging.DEBUG)
+    assert run(PROGRAMS['overflow'], 'signal') == "AssertionError('Integer overflow: 2147483648')"
+    assert [record.funcName for record in caplog.records] == ['simulation'] * 2
+    assert caplog.records[-1].getMessage().endswith(' ADD #1')
+
+
+@pytest.mark.parametrize('engine', machine.ENGINES)
+def test_snapshots(engine):
+    code = "s = ' '\nn = 0\nwhile s:\n  /in s\n  n = n + s\n  > s\n;\n> n"
+    instructions, memory = translator.code2machine(code)
+    expected = machine.simulation(instructions, memory, 'checkpoint')
+    snapshots = []
+    result = machine.simulation(instructions, memory, 'checkpoint', engine=engine, checkpoint_every=10,
+                                on_checkpoint=snapshots.append)  # fmt: skip
+    assert result == expected
+    assert [snapshot.instr_counter for snapshot in snapshots] == list(range(10, expected[1], 10))
+
+    # a snapshot is continued by any engine, the input consumed before it is skipped
+    for snapshot in snapshots:
+        snapshot = Snapshot.from_bytes(snapshot.to_bytes())
+        for resume_engine in machine.ENGINES:
+            assert machine.simulation(instructions, memory, 'checkpoint', engine=resume_engine, snapshot=snapshot) == expected
+
+    # the simulation stopped by the instruction limit is continued with a larger one
+    limited = []
+    machine.simulation(instructions, memory, 'checkpoint', instr_limit=55, engine=engine, checkpoint_every=100,
+                       on_checkpoint=limited.append)  # fmt: skip
+    assert (len(limited), limited[0].instr_counter) == (1, 55)
+    assert machine.simulation(instructions, memory, 'checkpoint', engine=engine, snapshot=limited[0]) == expected
+
+    # continuations with other inputs from the same state
+    snapshot = next(snapshot for snapshot in snapshots if snapshot.input_consumed == 3)
+    expected = machine.simulation(instructions, memory, 'check')
+    assert machine.simulation(instructions, memory, StringInputPort('check'), engine=engine, snapshot=snapshot) == expected
+    with pytest.raises(EOFError):
+        machine.simulation(instructions, memory, 'c', engine=engine, snapshot=snapshot)
+
+
+def test_snapshot_pages():
+    instructions, memory = translator.code2machine("s = 'abc'\nn = 0\nwhile n < 3:\n  > s\n  n = n + 1\n;")
+    snapshots = []
+    machine.simulation(instructions, memory, '', 2**31, memory_backend='sparse', checkpoint_every=20,
+                       on_checkpoint=snapshots.append)  # fmt: skip
+    # only the page of the variables is saved, the rest of the memory is as in the image
+    assert list(snapshots[-1].pages) == [0]
+    assert len(snapshots[-1].to_bytes()) < PAGE_SIZE
+
+
+def reference_executions(instructions, memory, input_stream, instr_limit):
+    control_unit = machine.ControlUnit(instructions, machine.DataPath(memory, 1000, input_stream))
+    executions = [0] * len(instructions)
+    with contextlib.suppress(EOFError, StopIteration, AssertionError, ArithmeticError):
+        while control_unit.instr_counter < instr_limit:
+            addr = control_unit.instr_pointer
+            control_unit.decode_and_execute_instruction()
+            control_unit.instr_counter += 1
+            executions[addr] += 1
+    return executions
+
+
+@pytest.mark.parametrize('opt_level', [0, 1, 2])
+def test_profiler(opt_level, tmp_path):
+    code = "s = ' '\nn = 0\nwhile s:\n  /in s\n  if n < 100:\n    n = n + s\n  ;\n  > s\n;\n> n"
+    translator_ = translator.Translator(opt_level, string_routines=False)  # the string loops belong to their lines
+    translator_.translate(code)
+    instructions, memory = translator_.instructions, translator_.string_literal_mem
+    for instr_limit in [*range(0, 120, 7), 60000]:
+        profiler = Profiler(instructions)
+        result = machine.simulation(instructions, memory, 'profile', instr_limit=instr_limit, engine='fast', profiler=profiler)
+        assert result == machine.simulation(instructions, memory, 'profile', instr_limit=instr_limit)
+        assert profiler.executions() == reference_executions(instructions, memory, 'profile', instr_limit)
+        assert (sum(profiler.executions()), sum(profiler.ticks())) == result[1:]
+
+    source_map = SourceMap(translator_.source_lines, code.split('\n'))
+    profile = profiler.to_json(source_map)
+    jumps = {row['addr']: row for row in profile['jumps']}
+    assert all(row['taken'] + row['not_taken'] == profile['instructions'][addr]['count'] for addr, row in jumps.items())
+    lines = {row['line']: row for row in profile['lines']}
+    assert sum(row['ticks'] for row in lines.values()) == result[2]
+    assert lines[4]['source'] == '  /in s'
+    assert lines[10]['count'] == 0 < lines[8]['count']  # the input is over before the loop ends
+
+    report = profiler.report(source_map, top=3).split('\n')
+    assert report[0] == f'instr executed: {result[1]}, ticks: {result[2]}'
+    assert report[1:4] == ['', 'source lines:', '  line       ticks       %       instr  source']
+    assert report[4].endswith('  /in s')
+    profiler.dump(tmp_path / 'profile.json', source_map)
+    assert json.loads((tmp_path / 'profile.json').read_text(encoding='utf-8')) == profile
+
+
+def test_control_flow_graph():
+    code = 'n = 0\nwhile n < 3:\n  m = 0\n  while m < n:\n    > m\n    m = m + 1\n  ;\n  n = n + 1\n;\n> n'
+    instructions, memory = translator.code2machine(code)
+    cfg = analysis.ControlFlowGraph(instructions)
+    assert [(loop.depth, len(loop.latches)) for loop in cfg.loops] == [(1, 1), (2, 1)]
+    outer, inner = cfg.loops
+    assert set(inner.blocks) < set(outer.blocks)
+    assert all(cfg.dominates(loop.header, block) for loop in cfg.loops for block in loop.blocks)
+    assert cfg.unreachable == []
+    assert cfg.out_of_range == []
+
+    # the ticks of the blocks are those ControlUnit spends executing them
+    profiler = Profiler(instructions)
+    output, _, ticks = machine.simulation(instructions, memory, '', engine='fast', profiler=profiler)
+    assert output == '0013'
+    executions = profiler.executions()
+    assert sum(executions[start] * block.ticks for start, block in cfg.blocks.items()) == ticks
+
+    # the unreachable code and the jumps and fall-throughs out of the program
+    cfg = analysis.ControlFlowGraph([
+        Instruction(Opcode.LD, 1, IMMEDIATE),
+        Instruction(Opcode.JMP, 3),
+        Instruction(Opcode.OUT),
+        Instruction(Opcode.JE, 10),
+        Instruction(Opcode.ADD, 1, IMMEDIATE),
+    ])
+    assert [(block.start, block.ticks, block.successors) for block in cfg.blocks.values()] == [
+        (0, 2, [3]),
+        (2, 1, [3]),
+        (3, 1, [4]),
+        (4, 1, []),
+    ]
+    assert cfg.unreachable == [2]
+    assert cfg.out_of_range == [(3, 10), (4, 5)]
+    assert cfg.idom == {0: 0, 3: 0, 4: 3}
+
+    graph = json.loads(json.dumps(cfg.to_json()))
+    assert graph['unreachable'] == [2]
+    assert graph['blocks'][1] == {
+        'start': 2, 'end': 3, 'ticks': 1, 'successors': [3], 'idom': None, 'loop_depth': 0, 'reachable': False,
+        'instructions': ['OUT 0'],
+    }  # fmt: skip
+    dot = cfg.to_dot()
+    assert dot.startswith('digraph cfg {')
+    assert '  b3 -> out10 [color=red];' in dot
+    assert 'unreachable blocks: 2' in cfg.report()
+
+
+def test_profiler_snapshot():
+    # the profile of a resumed simulation covers the instructions executed after the snapshot
+    instructions, memory = translator.code2machine('n = 0\nwhile n < 50:\n  n = n + 1\n  > n\n;')
+    snapshots = []
+    machine.simulation(instructions, memory, '', instr_limit=101, engine='fast', checkpoint_every=101,
+                       on_checkpoint=snapshots.append)  # fmt: skip
+    profiler = Profiler(instructions)
+    _, instr, _ = machine.simulation(instructions, memory, '', engine='fast', snapshot=snapshots[0], profiler=profiler)
+    executions = reference_executions(instructions, memory, '', instr)
+    before = reference_executions(instructions, memory, '', 101)
+    assert profiler.executions() == [total - count for total, count in zip(executions, before)]
+
+
+def debugger_state(debugger_):
+    return debugger_.where(), debugger_.read_memory(0, 10), debugger_.output
+
+
+def test_debugger():
+    code = "n = 0\nwhile n < 5:\n  n = n + 1\n  > n\n;\n> 'x'"
+    translator_ = translator.Translator()
+    translator_.translate(code)
+    instructions, memory, n = translator_.instructions, translator_.string_literal_mem, translator_.variables['n'].addr
+    source_map = SourceMap(translator_.source_lines, code.split('\n'))
+    expected = machine.simulation(instructions, memory, '')
+
+    # without breakpoints the program runs to the end as in the simulation
+    debugger_ = debugger.Debugger(instructions, memory, '', source_map=source_map, snapshot_every=7)
+    assert debugger_.continue_() == debugger.HALTED
+    assert (debugger_.output, debugger_.control_unit.instr_counter, debugger_.control_unit.current_tick()) == expected
+    assert debugger_.step() == debugger.HALTED
+
+    debugger_ = debugger.Debugger(instructions, memory, '', source_map=source_map, snapshot_every=7)
+    addr = debugger_.add_line_breakpoint(4)
+    assert debugger_.continue_() == debugger.BREAKPOINT
+    assert (debugger_.control_unit.instr_pointer, debugger_.line(), debugger_.output) == (addr, 4, '')
+    assert debugger_.where().endswith('\n    4  > n')
+    assert debugger_.continue_() == debugger.BREAKPOINT
+    assert debugger_.output == '1'
+    assert debugger_.step(2) == debugger.STEP
+    assert debugger_.output == '12'
+
+    # a watchpoint stops after the instruction changing the cell, the breakpoint is removed
+    debugger_.remove(addr)
+    debugger_.add_watchpoint(n)
+    assert debugger_.continue_() == debugger.WATCHPOINT
+    assert (debugger_.read_memory(n), debugger_.line()) == ([3], 4)  # stopped after the last instruction of line 3
+    debugger_.remove(n)
+    debugger_.add_watchpoint(debugger.ACC)
+    acc = debugger_.data_path.acc
+    assert debugger_.continue_() == debugger.WATCHPOINT
+    assert debugger_.data_path.acc != acc
+
+    # reverse steps restore the state of the program executed that far
+    for count in (1, 5, 13):
+        instr_counter = debugger_.control_unit.instr_counter
+        assert debugger_.reverse_step(count) == debugger.STEP
+        reference = debugger.Debugger(instructions, memory, '', source_map=source_map)
+        reference.step(instr_counter - count)
+        assert debugger_.control_unit.instr_counter == instr_counter - count
+        assert debugger_state(debugger_) == debugger_state(reference)
+
+    debugger_.remove(debugger.ACC)
+    assert debugger_.continue_() == debugger.HALTED
+    assert debugger_.output == expected[0]
+    with pytest.raises(AssertionError, match='No instructions on line 5'):
+        debugger_.add_line_breakpoint(5)
+
+
+def test_debugger_shell():
+    instructions, memory = translator.code2machine("s = 'ab'\n> s")
+    stdout = io.StringIO()
+    shell = debugger.DebuggerShell(debugger.Debugger(instructions, memory, ''), stdout=stdout)
+    commands = ['break 26', 'watch acc', 'info', 'c', 'delete acc', 's 3', 'rs 2', 'memory 0 3', 'c', 'c', 'output']
+    for command in [*commands, 'delete 26', 'c', 'output', 'b x']:
+        assert not shell.onecmd(command)
+    assert shell.onecmd('quit')
+    lines = stdout.getvalue().split('\n')
+    assert lines[:4] == [
+        'breakpoints: 26',
+        'watchpoints: acc=0',
+        'stopped: watchpoint',
+        'INSTR: 5 TICK: 6 IP: 5 ACC: 1 ADDR: 0 ST 3',
+    ]
+    stops = [line.removeprefix('stopped: ') for line in lines if line.startswith('stopped: ')]
+    assert stops == ['watchpoint', 'step', 'step', 'breakpoint', 'breakpoint', 'halted']
+    assert lines[8:11] == ['     0: 2', '     1: 97', '     2: 98']
+    assert [line for line in lines if line.startswith("'")] == ["'a'", "'ab'"]
+    assert lines[-2].startswith('error: invalid literal')
+
+
+CAT_CODE = "s = ' '\nwhile s:\n  /in s\n  > s\n;\n> 'end'"
+
+
+def session_io(chunks, events):
+    # the input by the chunks, the reads and the writes are recorded in the events
+    chunks = iter(chunks)
+
+    async def read_input():
+        await asyncio.sleep(0)
+        events.append(('read', chunk := next(chunks, '')))
+        return chunk
+
+    async def write_output(data):
+        await asyncio.sleep(0)
+        events.append(('write', data))
+
+    return read_input, write_output
+
+
+@pytest.mark.parametrize('engine', machine.ENGINES)
+def test_service_session(engine):
+    instructions, memory = translator.code2machine(CAT_CODE)
+    chunks = ['hel', 'lo\nwor', 'ld\n', 'ёж\n\n']
+    expected = machine.simulation(instructions, memory, ''.join(chunks))
+    events = []
+    session = service.Session(instructions, memory, *session_io(chunks, events), engine=engine)
+    assert asyncio.run(session.run()) == (service.HALTED, *expected[1:])
+    # the output of a line is written before the next line is read
+    assert events == [
+        ('read', 'hel'),
+        ('read', 'lo\nwor'),
+        ('write', 'hello'),
+        ('read', 'ld\n'),
+        ('write', 'world'),
+        ('read', 'ёж\n\n'),
+        ('write', 'ёжend'),
+    ]
+
+    # the output is written after every slice, the input is terminated when the source is over
+    events = []
+    session = service.Session(instructions, memory, *session_io(['ab', 'c'], events), engine=engine, slice_size=7)
+    assert asyncio.run(session.run()) == (service.INPUT_IS_OVER, *machine.simulation(instructions, memory, 'abc')[1:])
+    assert events == [('read', 'ab'), ('read', 'c'), ('read', ''), ('write', 'a'), ('write', 'b'), ('write', 'c')]
+    session = service.Session(instructions, memory, *session_io(chunks, []), engine=engine, instr_limit=100)
+    assert asyncio.run(session.run()) == (
+        service.LIMIT,
+        100,
+        machine.simulation(instructions, memory, 'hello', instr_limit=100)[2],
+    )
+
+
+def test_service_offload():
+    # the busy session continues in the worker processes by snapshots, with the same result
+    instructions, memory = translator.code2machine(CAT_CODE + '\nn = 0\nwhile n < 300:\n  n = n + 1\n;\n> n')
+    chunks = ['hel', 'lo\nwor', 'ld\n', 'ёж\n\n']
+    expected = machine.simulation(instructions, memory, ''.join(chunks), instr_limit=10**6)
+    events = []
+    with ProcessPoolExecutor(1) as executor:
+        session = service.Session(instructions, memory, *session_io(chunks, events), instr_limit=10**6, slice_size=50,
+                                  executor=executor, offload_after=100, pool_slice=1000)  # fmt: skip
+        assert asyncio.run(session.run()) == (service.HALTED, *expected[1:])
+    assert session.offloaded
+    assert ''.join(data for kind, data in events if kind == 'write') == expected[0]
+
+    # the input terminated before the session goes to the pool stays terminated in the workers
+    instructions, memory = translator.code2machine("s = ''\n/in s\nn = 0\nwhile n < 50:\n  n = n + 1\n;\n/in s\n> n")
+    with ThreadPoolExecutor(1) as executor:
+        session = service.Session(instructions, memory, *session_io([], []), slice_size=10, executor=executor,
+                                  offload_after=50)  # fmt: skip
+        assert asyncio.run(session.run()) == (service.INPUT_IS_OVER, *machine.simulation(instructions, memory, '')[1:])
+    assert session.offloaded
+
+
+def test_service_sessions():
+    # many sessions waiting for their input at once in one event loop, and their TCP stand-in
+    instructions, memory = translator.code2machine(CAT_CODE)
+
+    def append(output):
+        async def write(data):
+            await asyncio.sleep(0)
+            output.append(data)
+
+        return write
+
+    async def run_many(count):
+        queues = [asyncio.Queue() for _ in range(count)]
+        outputs = [[] for _ in range(count)]
+        tasks = [
+            asyncio.create_task(service.Session(instructions, memory, queue.get, append(output), engine='signal').run())
+            for queue, output in zip(queues, outputs)
+        ]
+        await asyncio.sleep(0)
+        for number, queue in enumerate(queues):
+            queue.put_nowait(f'{number}\n\n')
+        return await asyncio.gather(*tasks), outputs
+
+    results, outputs = asyncio.run(run_many(1000))
+    assert all(result.status == service.HALTED for result in results)
+    assert [''.join(output) for output in outputs] == [f'{number}end' for number in range(1000)]
+
+    async def run_server():
+        server = await service.serve(instructions, memory, port=0, slice_size=10)
+        async with server:
+            host, port = server.sockets[0].getsockname()[:2]
+            reader, writer = await asyncio.open_connection(host, port)
+            writer.write('привет\n'.encode()[:3])
+            await writer.drain()
+            writer.write('привет\n'.encode()[3:])
+            assert await reader.readexactly(len('привет'.encode())) == 'привет'.encode()
+            writer.write_eof()
+            output = await reader.read()
+            writer.close()
+            return output
+
+    assert asyncio.run(run_server()) == b'end'
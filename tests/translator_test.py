@@ -0,0 +1,340 @@
+import os
+import random
+
+import pytest
+from machine import machine
+from machine.isa import AddressingMode, Instruction, Opcode, SourceMap, load_source_map
+from machine.ports import BufferOutputPort
+from translator import batch, translator
+from translator.cache import Artifacts, TranslationCache
+from translator.optimizer import PeepholeOptimizer, optimize
+from translator.syntax import Binary, Name, Number, Output, Position, Unary, parse
+
+IMMEDIATE = AddressingMode.IMMEDIATE
+
+
+def test_parser():
+    # `!` binds as tightly as the unary minus and can be nested
+    assert parse('x = 5\n\n> !(!(x > 7)) + -!x') == [
+        parse('x = 5')[0],
+        Output(
+            Binary(
+                '+',
+                Unary(
+                    '!',
+                    Unary(
+                        '!', Binary('>', Name('x', Position(3, 7)), Number(7, Position(3, 11)), Position(3, 9)), Position(3, 5)
+                    ),
+                    Position(3, 3),
+                ),
+                Unary('-', Unary('!', Name('x', Position(3, 19)), Position(3, 18)), Position(3, 17)),
+                Position(3, 15),
+            ),
+            Position(3, 1),
+        ),
+    ]
+    instructions, memory = translator.code2machine('x = 5\n> !(!(x > 7)) + !!x * 10 + !(x - 5 || 0)')
+    assert machine.simulation(instructions, memory, '')[0] == '11'
+
+
+@pytest.mark.parametrize(
+    ('code', 'message'),
+    [
+        ('x = 1 < 2 < 3', 'Multiple comparisons are not allowed (line 1, column 11)'),
+        ('x = 1\nif x:\n  > x', 'Unclosed `if` block (line 2, column 1)'),
+        ('x = 1\n;', 'Unexpected ; (line 2, column 1)'),
+        ('x = (1 + 2', 'Expected `)`, got the end of the code (line 1, column 11)'),
+        ('while 1: > 1\n;', 'Expected the end of the line, got `>` (line 1, column 10)'),
+        ('x = 1 $ 2', 'Unexpected symbol `$` (line 1, column 7)'),
+        ('/print 1', 'Unknown command /print (line 1, column 1)'),
+        ('if = 1', 'if cannot be used as a variable name (line 1, column 1)'),
+        ('x = 1\n> x + y', 'Cannot find variable y (line 2, column 7)'),
+        ('x = ' + '(' * 800 + '1' + ')' * 800, 'Nesting deeper than 200 levels (line 1, column 205)'),
+        ('x = ' + '-' * 5000 + '1', 'Nesting deeper than 200 levels (line 1, column 205)'),
+        ('x = ' + '+'.join(['1'] * 300), 'Nesting deeper than 200 levels (line 1, column 404)'),
+        ('if 1:\n' * 201 + '> 1\n' + ';\n' * 201, 'Nesting deeper than 200 levels (line 201, column 1)'),
+    ],
+)
+def test_syntax_errors(code, message):
+    with pytest.raises(AssertionError) as e:
+        translator.code2machine(code)
+    assert str(e.value) == message
+
+
+@pytest.mark.parametrize(
+    ('code', 'expected'),
+    [
+        ('> 2 * 3 + 4', [Instruction(Opcode.LD, 10, IMMEDIATE), Instruction(Opcode.OUTN)]),
+        ('> 1 / 0', [Instruction(Opcode.LD, 1, IMMEDIATE), Instruction(Opcode.DIV, 0, IMMEDIATE), Instruction(Opcode.OUTN)]),
+        (
+            '> 2147483647 + 1',
+            [Instruction(Opcode.LD, 2**31 - 1, IMMEDIATE), Instruction(Opcode.ADD, 1, IMMEDIATE), Instruction(Opcode.OUTN)],
+        ),
+        ('x = 0\nwhile 0:\n  x = 1\n;', []),
+    ],
+)
+def test_peephole_folding(code, expected):
+    # errors of the original program are kept
+    assert translator.code2machine(code, opt_level=1)[0] == [*expected, Instruction(Opcode.HLT)]
+
+
+def test_peephole_addr_map():
+    instructions, memory = translator.code2machine("n = 3\nwhile n > 0:\n  n = n - 1\n  > n\n;\n> 'ok'")
+    optimizer = PeepholeOptimizer(instructions)
+    optimized = optimizer.optimize()
+    _, report = optimize(instructions)
+
+    assert report == (len(instructions), len(optimized), report.ticks_before, report.ticks_after)
+    assert report.ticks_after < report.ticks_before
+    assert len(optimizer.addr_map) == len(instructions) + 1
+    assert optimizer.addr_map == sorted(optimizer.addr_map)
+    assert optimizer.addr_map[0] == 0
+    assert optimizer.addr_map[-1] == len(optimized)
+    assert machine.simulation(optimized, memory, '')[0] == machine.simulation(instructions, memory, '')[0] == '210ok'
+
+
+def test_peephole_convergence():
+    # the known values cross all the blocks at once, so the rounds reach the fixpoint: every condition is resolved
+    lines = [f'x{i} = {i}' for i in range(5)]
+    for i in range(40):
+        x, y = f'x{i % 5}', f'x{(i + 1) % 5}'
+        lines += [f'{x} = {y} * 3 + {i}', f'if {x} > {i}:', f'  > {x}', ';']
+    instructions, memory = translator.code2machine('\n'.join(lines))
+    optimized = PeepholeOptimizer(instructions).optimize()
+
+    assert PeepholeOptimizer(optimized).optimize() == optimized
+    assert not any(instr.opcode in {Opcode.JE, Opcode.JNE, Opcode.JL, Opcode.JG} for instr in optimized)
+    assert machine.simulation(optimized, memory, '')[0] == machine.simulation(instructions, memory, '')[0]
+
+
+def test_peephole_entry_point_flags():
+    # the jump back to the entry point sets the flags by CMP, so the dead store before JNE keeps setting them
+    instructions = [
+        Instruction(Opcode.ST, 5),
+        Instruction(Opcode.JNE, 5),
+        Instruction(Opcode.ADD, 1, IMMEDIATE),
+        Instruction(Opcode.CMP, 1, IMMEDIATE),
+        Instruction(Opcode.JMP, 0),
+        Instruction(Opcode.OUTN),
+        Instruction(Opcode.HLT),
+    ]
+    optimized = PeepholeOptimizer(instructions).optimize()
+    assert optimized[0] == Instruction(Opcode.ST, 5)
+    assert machine.simulation(optimized, [], '')[0] == machine.simulation(instructions, [], '')[0] == '1'
+
+
+@pytest.mark.parametrize(
+    ('expression', 'expected'),
+    [
+        ('(2 * 3) + x', '11'),
+        ('x * 1 - 0', '5'),
+        ('!0 + !x', '1'),
+        ('0 && x', '0'),
+        ('x || 1', '1'),
+        ('x && 1', '1'),
+        ('1 && 1 && 0', '0'),
+        ('!(x < 3) + !(x > 7)', '2'),
+        ("'abc' * x", '15'),
+        ('-7 / 2 + -7 % 2', '-3'),
+        ('(2147483647 + 1) * 0', "AssertionError('Integer overflow: 2147483648')"),
+        ('x / (1 - 1)', "ZeroDivisionError('integer division or modulo by zero')"),
+    ],
+)
+def test_expression_simplification(expression, expected):
+    code = f'x = 5\n> {expression}'
+    results = []
+    for opt_level in (0, 1):
+        instructions, memory = translator.code2machine(code, opt_level)
+        try:
+            output, _, ticks = machine.simulation(instructions, memory, '')
+            results.append((output, ticks))
+        except (AssertionError, ArithmeticError) as e:
+            results.append((repr(e), 0))
+    (output, ticks), (simplified_output, simplified_ticks) = results
+    assert output == simplified_output == expected
+    assert simplified_ticks <= ticks
+
+
+def random_expression(rng: random.Random, depth: int) -> str:
+    if depth == 0 or rng.random() < 0.25:
+        return rng.choice(['a', 'b', "'str'", str(rng.randint(-9, 9)), str(rng.randint(-(2**31), 2**31 - 1))])
+    if rng.random() < 0.1:
+        return f'{rng.choice("-+")}({random_expression(rng, depth - 1)})'
+    if rng.random() < 0.1:
+        return f'!{random_expression(rng, depth - 1)}'
+    op = rng.choice(['+', '-', '*', '/', '%', '==', '!=', '<', '<=', '>', '>=', '&&', '||'])
+    return f'({random_expression(rng, depth - 1)} {op} {random_expression(rng, depth - 1)})'
+
+
+def test_accumulator_codegen():
+    # both codegens compute the same values (or stop with the same error) on a random expression corpus
+    rng = random.Random(42)
+    ticks = {'stack': 0, 'accumulator': 0}
+    for _ in range(300):
+        code = f'a = {rng.randint(-50, 50)}\nb = {rng.randint(-50, 50)}\n> {random_expression(rng, 4)}'
+        results = []
+        for codegen in ticks:
+            instructions, memory = translator.code2machine(code, codegen=codegen)
+            try:
+                output, _, codegen_ticks = machine.simulation(instructions, memory, '')
+                results.append(output)
+                ticks[codegen] += codegen_ticks
+            except (AssertionError, ArithmeticError) as e:
+                results.append(repr(e))
+        assert results[0] == results[1], code
+    assert ticks['accumulator'] < ticks['stack'] * 0.8
+
+
+@pytest.mark.parametrize('opt_level', [0, 1, 2])
+def test_string_routines(opt_level):
+    # the routines shared by the string commands compute the same as the inline loops and the calls return
+    # to their sites, the code is smaller and executes fewer instructions, a string copied to itself becomes empty
+    code = "s = 'routine'\nt = s\n> t\nwhile t:\n  /in t\n  > t\n  u = t\n  > u\n;\n> s\ns = s\n> s\n> 'end'"
+    text = 'first\n' + 'x' * 70 + '\n\n'
+    inline = translator.code2machine(code, opt_level, string_routines=False)
+    routines = translator.code2machine(code, opt_level, string_routines=True)
+    output, inline_instr, _ = machine.simulation(*inline, text)
+    assert output == 'routinefirstfirst' + 'x' * 140 + 'routineend'
+    routines_output, routines_instr, _ = machine.simulation(*routines, text)
+    assert routines_output == output
+    assert routines_instr < inline_instr * 0.9
+    if opt_level == 0:  # the optimizer drops the inline copy of the emptied string to itself, the routine call stays
+        assert len(routines[0]) < len(inline[0])
+
+
+@pytest.mark.parametrize('string_routines', [False, True])
+def test_memory_reuse(string_routines):
+    # the strings take their capacities, the cells of a block are reused after it, the outputs are the same
+    code = "s = 'ab'\nif 1:\n  t = 'xyz'\n  > t\n;\nif 1:\n  u = s\n  > u\n;\nw = ''\n/in w\n> w\n> s"
+    translator_ = translator.Translator(1, string_routines=string_routines)
+    translator_.translate(code)
+    assert list(translator_.string_capacities.values()) == [2, 3, 2, 63]
+    plain = translator.Translator(1, string_routines=string_routines, reuse_memory=False)
+    plain.translate(code)
+    assert translator_.data_memory_size < plain.data_memory_size - 63
+
+    instructions, memory, text = translator_.instructions, translator_.string_literal_mem, 'i' * 63  # the longest input
+    expected = machine.simulation(*translator.code2machine(code), text)[0]
+    assert machine.simulation(instructions, memory, text, memory_capacity=translator_.data_memory_size + 1)[0] == expected
+    with pytest.raises(AssertionError, match='Out of memory'):
+        machine.simulation(instructions, memory, text, memory_capacity=translator_.data_memory_size - 1)
+
+    # the capacity of a string grows with the strings assigned to it, even after the assignment
+    translator_ = translator.Translator(1)
+    translator_.translate("a = 'x'\nb = 'yy'\nwhile b:\n  /in b\n  b = a\n  a = b\n;\n> a")
+    assert list(translator_.string_capacities.values()) == [63, 63]
+
+
+def run_program(code: str, opt_level: int, optimize_loops: bool, text: str = '') -> tuple[str, int]:
+    # the output (with the error, if any) and the ticks
+    translator_ = translator.Translator(opt_level, optimize_loops=optimize_loops)
+    translator_.translate(code)
+    output_port = BufferOutputPort()
+    try:
+        output, _, ticks = machine.simulation(
+            translator_.instructions, translator_.string_literal_mem, text, output_port=output_port
+        )
+    except (AssertionError, ArithmeticError) as e:
+        return output_port.getvalue() + repr(e), 0
+    return output, ticks
+
+
+@pytest.mark.parametrize('opt_level', [1, 2])
+def test_loop_optimizations(opt_level):
+    # the invariant expressions are computed before the loops, the conditions compare with the variables, the
+    # multiplications of a counter become additions; the outputs are the same and the loops take fewer ticks;
+    # the size comes from the input, as the peephole optimizer would fold a constant one into the loops itself
+    code = (
+        "s = ''\n/in s\ntotal = 0\nsize = s * 1\ni = 0\nwhile i < size * 2:\n  j = 0\n  while j < size - i:\n"
+        '    total = total + size * size - i\n    j = j + 1\n  ;\n  i = i + 1\n;\n> total\n'
+        'k = 0\nwhile k < 50:\n  > k * 4 % 3 + k * 4 % 5 + k * 4 % 7 + k * 4 / 9 - k * 4 / 11\n  k = k + 2\n;'
+    )
+    text = 'x' * 30 + '\n'
+    translator_ = translator.Translator(opt_level)
+    translator_.translate(code)
+    assert (translator_.loop_optimizer.hoisted, translator_.loop_optimizer.reduced) == (3, 5)
+    output, ticks = run_program(code, opt_level, optimize_loops=True, text=text)
+    expected_output, expected_ticks = run_program(code, opt_level, optimize_loops=False, text=text)
+    assert output == expected_output == run_program(code, 0, optimize_loops=False, text=text)[0]
+    assert ticks < expected_ticks * 0.85
+
+    # an expression which may fail is computed only if the loop runs, and before no output and nothing else
+    # that may fail or stop
+    for code, text, expected in [
+        ("a = 2147483647\ni = 0\nwhile i < 0:\n  > a + 1\n  i = i + 1\n;\n> 'ok'", '', 'ok'),
+        ('a = 2147483647\nb = 0\ni = 0\nwhile i < 2:\n  > i / b\n  > a + 1\n  i = i + 1\n;', '', 'ZeroDivisionError'),
+        ("s = ''\na = 2147483647\ni = 0\nwhile i < 2:\n  /in s\n  > a + 1\n  i = i + 1\n;", '', ''),
+        ('a = 2147483647\ni = 0\nwhile i < 2:\n  > a + 1\n  i = i + 1\n;', '', 'Integer overflow: 2147483648'),
+        ("a = 0\ni = 0\nwhile i < 1:\n  > 'hello'\n  b = 9 % a\n  i = i + 1\n;", '', 'helloZeroDivisionError'),
+    ]:
+        output, _ = run_program(code, opt_level, optimize_loops=True, text=text)
+        assert output == run_program(code, 0, optimize_loops=False, text=text)[0]
+        assert expected in output
+
+
+@pytest.mark.parametrize('opt_level', [0, 1, 2])
+def test_source_map(opt_level, tmp_path):
+    code = 'n = 0\nwhile n < 3:\n  n = n + 1\n;\n> n'
+    translator_ = translator.Translator(opt_level)
+    translator_.translate(code)
+    lines = translator_.source_lines
+    assert len(lines) == len(translator_.instructions)
+    # the condition and the jump back belong to the header of the loop, the final HLT to no statement
+    assert [line for i, line in enumerate(lines) if i == 0 or line != lines[i - 1]] == [1, 2, 3, 2, 5, 0]
+    assert translator_.instructions[lines.index(5) - 1].opcode is Opcode.JMP
+
+    map_file = tmp_path / 'prog.map'
+    map_file.write_text(translator.build(code, opt_level).source_map, encoding='utf-8')
+    assert load_source_map(map_file) == SourceMap(lines, code.split('\n'))
+
+
+def test_translation_cache(tmp_path, monkeypatch):
+    source_file, target_file, debug_file = tmp_path / 'prog.code', tmp_path / 'prog.bin', tmp_path / 'prog.debug'
+    source_file.write_text('n = 3\nwhile n > 0:\n  > n\n  n = n - 1\n;', encoding='utf-8')
+    cache = TranslationCache(tmp_path / 'cache')
+    artifacts, hit = translator.translate_file(source_file, target_file, debug_file, 1, cache)
+    assert not hit
+    assert artifacts == translator.build(source_file.read_text(encoding='utf-8'), 1)
+
+    # a hit skips the translation, other options are other entries
+    monkeypatch.setattr(translator.Translator, 'translate', None)
+    target_file.unlink()
+    map_file = tmp_path / 'prog.map'
+    assert translator.translate_file(source_file, target_file, debug_file, 1, cache, map_file) == (artifacts, True)
+    assert target_file.read_bytes() == artifacts.binary
+    assert debug_file.read_text(encoding='utf-8') == artifacts.debug
+    assert map_file.read_text(encoding='utf-8') == artifacts.source_map
+    with pytest.raises(TypeError):
+        translator.translate_file(source_file, target_file, debug_file, 0, cache)
+    assert (cache.hits, cache.misses) == (1, 2)
+
+
+def test_translation_cache_eviction(tmp_path):
+    cache = TranslationCache(tmp_path, max_size=250)  # two entries of 116 bytes
+    for i in range(2):
+        cache.put(str(i), Artifacts(bytes(100), '', '', ''))
+        os.utime(tmp_path / f'{i}.entry', (1000 + i, 1000 + i))
+    assert cache.get('0') is not None  # the most recently used now
+    cache.put('2', Artifacts(bytes(100), '', '', ''))
+    assert [cache.get(str(i)) is not None for i in range(3)] == [True, False, True]
+    (tmp_path / '2.entry').write_bytes(b'broken')
+    assert cache.get('2') is None
+
+
+def test_translation_batch(tmp_path):
+    jobs = []
+    broken = {5: '> 1 +', 6: 'x = ' + '(' * 800 + '1' + ')' * 800, 7: 'x = ' + '-' * 5000 + '1'}
+    for i in range(8):
+        (tmp_path / f'{i}.code').write_text(broken.get(i, f"i = {i}\n> 'i = '\n> i"), encoding='utf-8')
+        jobs.append(batch.Job(*(str(tmp_path / f'{i}{suffix}') for suffix in ('.code', '.bin', '.debug'))))
+    cache_dir = str(tmp_path / 'cache')
+
+    for cached in (False, True):
+        results = sorted(batch.run_batch(jobs, cache_dir=cache_dir, workers=2, chunksize=2), key=lambda r: r['source'])
+        assert [(result['cached'], result['error'] is None) for result in results] == [(cached, True)] * 5 + [(False, False)] * 3
+        assert all('Nesting deeper than' in result['error'] for result in results[6:])
+    for job in jobs[:5]:
+        with open(job.source_file, encoding='utf-8') as f:
+            artifacts = translator.build(f.read())
+        with open(job.target_file, 'rb') as f:
+            assert f.read() == artifacts.binary